@@ -1,23 +1,3 @@
-import time
-from adafruit_servokit import ServoKit
+from servo_common import run_pair
 
-kit = ServoKit(channels=16)
-
-kit.servo[10].angle = 180
-kit.continuous_servo[11].throttle = 1
-time.sleep(1)
-
-kit.continuous_servo[11].throttle = -1
-time.sleep(1)
-
-kit.servo[10].angle = 0
-kit.continuous_servo[11].throttle = 0
-time.sleep(1)
-
-kit.servo[10].angle = None
-
-def stop_signal(kit, channel):
-    pwm = kit._pca
-    pwm.channels[channel].duty_cycle = 0 
-
-stop_signal(kit, 11)
+run_pair(10, 11)
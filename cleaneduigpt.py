@@ -1,15 +1,39 @@
-from flask import Flask, render_template_string, request, jsonify
-from threading import Thread, Event
+from flask import Flask, request, jsonify, Response, stream_with_context
+from threading import Thread, Event, Lock, active_count, get_ident
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+import errno
+import gzip
+import hashlib
+import multiprocessing
+import queue
 import time
 import os
 import re
+import select
+import signal
 import subprocess
-import tempfile
+import sys
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from adafruit_servokit import ServoKit
 from gtts import gTTS
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+from servo_common import (angle_of, duty_for_angle, get_kit, lock_memory, make_realtime,
+                          sleep_until, write_channels)
+
 # ===================== Keys / Config =====================
 DEEPGRAM_API_KEY = os.environ.get("DEEPGRAM_API_KEY")
 if not DEEPGRAM_API_KEY:
@@ -24,28 +48,78 @@ SONG_24K_PATH = os.path.expanduser(
     os.environ.get("SONG_24K_PATH", os.path.join("~", "media", "24k_magic.mp3"))
 )
 
+# ===================== HTTP sessions =====================
+def _make_session() -> requests.Session:
+    """Session with a keep-alive pool so repeat calls skip the TCP/TLS handshake."""
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retry))
+    return session
+
+_DG_SESSION = _make_session()
+_SERP_SESSION = _make_session()
+
 # OpenAI client (uses the modern SDK)
+# Idle pooled connections are kept well past httpx's 5 s default, so a chat
+# turn after a pause reuses the TLS session instead of handshaking again
+LM_KEEPALIVE_S = 120
+
+def _lm_http_client():
+    """httpx client for the OpenAI SDK: HTTP/2 when h2 is installed, long keep-alive either way."""
+    import httpx
+    from openai import DefaultHttpxClient
+    limits = httpx.Limits(max_connections=8, max_keepalive_connections=4,
+                          keepalive_expiry=LM_KEEPALIVE_S)
+    try:
+        return DefaultHttpxClient(http2=True, limits=limits)
+    except ImportError:  # http2 needs the h2 package
+        return DefaultHttpxClient(limits=limits)
+
 try:
     from openai import OpenAI
-    _openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    _openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), http_client=_lm_http_client())
 except Exception as e:
     _openai_client = None
     print("OpenAI client not available:", e)
 
 # ===================== Global control (generation/TTS) =====================
 _generation_cancel = Event()   # set() to cancel in-flight generation
-_tts_proc = None               # mpg123 process for TTS audio
+_tts_queue = queue.Queue()     # (text, interrupt_music) for the TTS worker, in order
 
 def cancel_generation():
     """Signal any in-flight generation to stop and silence TTS."""
     _generation_cancel.set()
+    while True:
+        try:
+            _tts_queue.get_nowait()
+        except queue.Empty:
+            break
     tts_stop()
 
+# ===================== mpg123 =====================
+# No output buffer for speech so a stop cuts it off at once; music keeps a
+# small buffer because smooth playback matters more than stop latency there.
+# All speech plays on one resident player driven over stdin (mpg123 remote mode)
+MPG123_ARGS_RC = ['mpg123', '-R', '--buffer', '0', '--no-gapless']
+MPG123_ARGS_MEDIA = ['mpg123', '-q', '--buffer', '32', '--no-gapless']
+
+def _stop_proc(proc):
+    """Stop mpg123 fast: SIGINT first (it exits at once), then SIGTERM, then SIGKILL."""
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(timeout=0.2)
+        return
+    except subprocess.TimeoutExpired:
+        proc.terminate()
+    try:
+        proc.wait(timeout=0.5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
 # ===================== Media (music) playback =====================
 _media_proc = None
 
 def media_is_playing() -> bool:
-    global _media_proc
     return _media_proc is not None and _media_proc.poll() is None
 
 def media_stop():
@@ -53,26 +127,26 @@ def media_stop():
     global _media_proc
     if _media_proc is not None and _media_proc.poll() is None:
         try:
-            _media_proc.terminate()
-            try:
-                _media_proc.wait(timeout=1.5)
-            except subprocess.TimeoutExpired:
-                _media_proc.kill()
+            _stop_proc(_media_proc)
         except Exception as e:
             print("media_stop error:", e)
     _media_proc = None
 
 def media_play_file(path: str):
     """Play a file with mpg123 (non-blocking)."""
-    global _media_proc
-    media_stop()  # stop any previous playback
     path = os.path.expanduser(path)
     if not os.path.exists(path):
+        media_stop()
         print(f"[MEDIA] File not found: {path}")
         return False
+    return _media_spawn(path)
+
+def _media_spawn(path: str):
+    global _media_proc
+    media_stop()  # stop any previous playback
     try:
         _media_proc = subprocess.Popen(
-            ['mpg123', '-q', path],
+            MPG123_ARGS_MEDIA + [path],
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL
         )
@@ -82,89 +156,419 @@ def media_play_file(path: str):
         _media_proc = None
         return False
 
+def _preload_file(path: str) -> bool:
+    """Ask the kernel to read a file into the page cache; False if it is missing."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+    return True
+
+# Resolved once; the song is preloaded so the first play skips the SD card seek
+_SONG_24K_ABS = os.path.realpath(SONG_24K_PATH)
+_song_24k_ok = _preload_file(_SONG_24K_ABS)
+
 def media_play_24k():
-    ok = media_play_file(SONG_24K_PATH)
+    global _song_24k_ok
+    if not _song_24k_ok:
+        _song_24k_ok = _preload_file(_SONG_24K_ABS)  # the file may have been added since
+    ok = _song_24k_ok and _media_spawn(_SONG_24K_ABS)
+    if not _song_24k_ok:
+        print(f"[MEDIA] File not found: {_SONG_24K_ABS}")
     return "Playing 24K Magic." if ok else "24K Magic file not found or could not be played."
 
+# ===================== TTS cache =====================
+# Synthesized MP3s are kept on disk keyed by a hash of (lang, text), so
+# repeated replies skip the gTTS round trip entirely.
+TTS_CACHE_DIR = os.path.expanduser(
+    os.environ.get("TTS_CACHE_DIR", os.path.join("~", ".cache", "quadruped_tts"))
+)
+TTS_CACHE_MAX = 200
+
+_tts_cache = OrderedDict()   # key -> mp3 path, least recently used first
+_tts_cache_lock = Lock()
+
+def _load_tts_cache():
+    try:
+        os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+        entries = sorted(os.scandir(TTS_CACHE_DIR), key=lambda e: e.stat().st_mtime)
+    except OSError as e:
+        print("TTS cache unavailable:", e)
+        return
+    for e in entries:
+        if e.name.endswith('.mp3'):
+            _tts_cache[e.name[:-4]] = e.path
+
+_load_tts_cache()
+
+def _tts_key(text: str, lang: str) -> str:
+    return hashlib.sha1(f"{lang}\0{text}".encode()).hexdigest()
+
+def _tts_cache_get(key: str):
+    """Return the cached mp3 path for key, or None."""
+    with _tts_cache_lock:
+        path = _tts_cache.get(key)
+        if path and os.path.exists(path):
+            _tts_cache.move_to_end(key)
+            return path
+    return None
+
+def _tts_tmp_path(key: str) -> str:
+    return os.path.join(TTS_CACHE_DIR, f"{key}.{get_ident()}.tmp")
+
+def _tts_cache_put(key: str, tmp: str) -> str:
+    """Move a finished tmp file into the cache and evict old entries."""
+    path = os.path.join(TTS_CACHE_DIR, key + '.mp3')
+    os.replace(tmp, path)  # never leave a half-written mp3 under the real name
+    with _tts_cache_lock:
+        _tts_cache[key] = path
+        _tts_cache.move_to_end(key)
+        while len(_tts_cache) > TTS_CACHE_MAX:
+            _, old = _tts_cache.popitem(last=False)
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return path
+
+_tts_inflight = {}   # key -> Event set once that key's synthesis finishes
+
+def tts_cached_path(text: str, lang: str = 'en') -> str:
+    """Return an MP3 of text, synthesizing it with gTTS only on a cache miss.
+
+    Concurrent misses for the same text (e.g. the prewarm and a live reply)
+    share one gTTS request.
+    """
+    key = _tts_key(text, lang)
+    path = _tts_cache_get(key)
+    if path:
+        return path
+    with _tts_cache_lock:
+        done = _tts_inflight.get(key)
+        owner = done is None
+        if owner:
+            done = _tts_inflight[key] = Event()
+    if not owner:
+        done.wait()
+        path = _tts_cache_get(key)
+        if path:
+            return path
+    try:
+        tmp = _tts_tmp_path(key)
+        gTTS(text=text, lang=lang).save(tmp)
+        return _tts_cache_put(key, tmp)
+    finally:
+        if owner:
+            with _tts_cache_lock:
+                del _tts_inflight[key]
+            done.set()
+
+class _TeeToPlayer:
+    """File-like for gTTS.write_to_fp: feeds mpg123's stdin and the cache file.
+
+    If playback is cancelled the pipe breaks; the cache file keeps filling so
+    the next request for the same text is still a hit.
+    """
+    def __init__(self, player_stdin, cache_fp):
+        self._player = player_stdin
+        self._cache = cache_fp
+
+    def write(self, data):
+        self._cache.write(data)
+        if self._player is not None and _generation_cancel.is_set():
+            # EOF now, so the player is not left waiting on the download
+            self.close_player()
+        if self._player is not None:
+            try:
+                self._player.write(data)
+                self._player.flush()  # let mpg123 start on the first frames
+            except (BrokenPipeError, ValueError):
+                self._player = None
+
+    def close_player(self):
+        player, self._player = self._player, None
+        if player is not None:
+            try:
+                player.close()
+            except BrokenPipeError:
+                pass
+
 # ===================== TTS =====================
+_mpg_rc = None
+_mpg_rc_playing = False
+
+def _mpg_rc_start():
+    """Return the resident mpg123, (re)starting it if it is not running."""
+    global _mpg_rc
+    if _mpg_rc is None or _mpg_rc.poll() is not None:
+        _mpg_rc = subprocess.Popen(
+            MPG123_ARGS_RC, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, bufsize=0
+        )
+        _mpg_rc.stdin.write(b"SILENCE\n")  # no per-frame progress lines
+    return _mpg_rc
+
+def _mpg_rc_play(path, feed=None):
+    """Play a file on the resident mpg123 and block until it ends or is stopped.
+
+    feed, if given, is called right after the LOAD to write the data into
+    path (a FIFO) and close it; it returns False if the player never opened
+    the FIFO.
+    """
+    global _mpg_rc, _mpg_rc_playing
+    rc = _mpg_rc_start()
+    fd = rc.stdout.fileno()
+    # Drop status lines left over from an earlier STOP
+    while select.select([fd], [], [], 0)[0]:
+        if not os.read(fd, 4096):
+            break
+    _mpg_rc_playing = True
+    try:
+        rc.stdin.write(f"LOAD {path}\n".encode())
+        if _generation_cancel.is_set():
+            rc.stdin.write(b"STOP\n")
+        if feed is not None and not feed():
+            # mpg123 is still blocked opening the FIFO, so it would never read
+            # a STOP or print a status line: replace it instead of waiting
+            rc.kill()
+            rc.wait()
+            _mpg_rc = None
+            return
+        buf = b""
+        while True:
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                return
+            buf += chunk
+            lines = buf.split(b"\n")
+            buf = lines.pop()
+            if any(line.startswith((b"@P 0", b"@E")) for line in lines):
+                return
+    finally:
+        _mpg_rc_playing = False
+
 def tts_stop():
     """Stop any in-progress TTS playback."""
-    global _tts_proc
-    if _tts_proc is not None and _tts_proc.poll() is None:
+    if _mpg_rc_playing:
         try:
-            _tts_proc.terminate()
-            try:
-                _tts_proc.wait(timeout=1.0)
-            except subprocess.TimeoutExpired:
-                _tts_proc.kill()
-        except Exception as e:
+            _mpg_rc.stdin.write(b"STOP\n")
+        except OSError as e:
             print("tts_stop error:", e)
-    _tts_proc = None
 
-def speak_async(text: str, interrupt_music: bool = True):
-    """Speak text in the background using gTTS + mpg123."""
+# Cache misses are streamed to the resident player through this FIFO
+TTS_FIFO = os.path.join(TTS_CACHE_DIR, "stream.fifo")
+TTS_FIFO_OPEN_TIMEOUT = 2.0
+
+def _open_fifo_writer(path, timeout=TTS_FIFO_OPEN_TIMEOUT):
+    """Open the write end of a FIFO once the player has opened it; None on timeout.
+
+    Never gives up early on a cancel: mpg123 blocks in open() until a writer
+    shows up, so the FIFO must be opened (and closed) for it to move on. On
+    None the caller must restart the player, which is still stuck in open().
+    """
+    try:
+        os.mkfifo(path)
+    except FileExistsError:
+        pass
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno != errno.ENXIO or time.monotonic() > deadline:
+                print("TTS stream error:", e)
+                return None
+            time.sleep(0.005)   # no reader yet
+            continue
+        os.set_blocking(fd, True)
+        return os.fdopen(fd, 'wb', buffering=0)
+
+def speak(text: str, interrupt_music: bool = True):
+    """Speak text using gTTS + mpg123, returning when playback ends."""
     if not text:
         return
-
-    def _run():
-        global _tts_proc
+    try:
+        if _generation_cancel.is_set():
+            return
+        if interrupt_music:
+            media_stop()
+        key = _tts_key(text, 'en')
+        path = _tts_cache_get(key)
+        if _generation_cancel.is_set():
+            return
+        if path:
+            _mpg_rc_play(path)
+            return
+        # On a cache miss, stream gTTS through the FIFO into the resident
+        # mpg123: playback starts with the first frames, and no player is
+        # spawned (fork, exec, ALSA open) per utterance
+        tmp = _tts_tmp_path(key)
         try:
-            if _generation_cancel.is_set():
-                return
-            if interrupt_music:
-                media_stop()
-            tts = gTTS(text=text, lang='en')
-            with tempfile.NamedTemporaryFile(delete=True, suffix='.mp3') as fp:
-                tts.save(fp.name)
+            with open(tmp, 'wb') as cache_fp:
+                def feed():
+                    player = _open_fifo_writer(TTS_FIFO)
+                    if player is None:
+                        return False  # the player is replaced before any download
+                    tee = _TeeToPlayer(player, cache_fp)
+                    try:
+                        gTTS(text=text, lang='en').write_to_fp(tee)
+                    finally:
+                        tee.close_player()
+                    return True
+                _mpg_rc_play(TTS_FIFO, feed)
+            if os.path.getsize(tmp):
+                _tts_cache_put(key, tmp)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    except Exception as e:
+        print("TTS error:", e)
+
+def _tts_worker():
+    while True:
+        speak(*_tts_queue.get())
+
+def speak_async(text: str, interrupt_music: bool = True):
+    """Queue text for the TTS worker; utterances play in the order queued."""
+    if text:
+        _tts_queue.put((text, interrupt_music))
+
+# ===================== Language model =====================
+LM_MODEL = "gpt-4o-mini"
+# Kept byte-identical across calls so the API can reuse the cached prompt prefix
+LM_SYSTEM_PROMPT = {
+    "role": "system",
+    "content": "You are a concise assistant for a quadruped robot. Robot motion and media playback are handled by the app; keep confirmations brief.",
+}
+# A sentence ends at . ! ? followed by whitespace, or at a newline
+_SENTENCE_END = re.compile(r"[.!?](?=\s)|\n")
+SENTENCE_MIN_CHARS = 24  # avoids speaking list markers like "1." on their own
+
+def _lm_create(user_text: str, stream: bool):
+    return _openai_client.chat.completions.create(
+        model=LM_MODEL,
+        messages=[LM_SYSTEM_PROMPT, {"role": "user", "content": user_text}],
+        temperature=0.4,
+        max_tokens=300,
+        stream=stream,
+    )
+
+def lm_stream(user_text: str):
+    """Yield reply text as the model produces it; stops early on cancel."""
+    if not _openai_client:
+        yield "Language model is not configured. Please set OPENAI_API_KEY."
+        return
+    try:
+        # Closing the stream hands its connection back to the pool even when
+        # a cancel or a disconnected client ends the loop early
+        with _lm_create(user_text, stream=True) as events:
+            for event in events:
                 if _generation_cancel.is_set():
                     return
-                _tts_proc = subprocess.Popen(
-                    ['mpg123', '-q', fp.name],
-                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-                )
-                while True:
-                    if _tts_proc.poll() is not None:
-                        break
-                    if _generation_cancel.is_set():
-                        tts_stop()
-                        break
-                    time.sleep(0.05)
+                delta = event.choices[0].delta.content if event.choices else None
+                if delta:
+                    yield delta
+    except Exception as e:
+        yield f"Error contacting language model: {e}"
+
+def speak_sentences(deltas, on_chunk):
+    """Pass deltas through, calling on_chunk with each complete sentence."""
+    buf = ""
+    for delta in deltas:
+        buf += delta
+        ends = [m.end() for m in _SENTENCE_END.finditer(buf)]
+        if ends and ends[-1] >= SENTENCE_MIN_CHARS:
+            head, buf = buf[:ends[-1]], buf[ends[-1]:]
+            if head.strip():
+                on_chunk(head.strip())
+        yield delta
+    if buf.strip() and not _generation_cancel.is_set():
+        on_chunk(buf.strip())
+
+def sentence_speaker():
+    """on_chunk callback that speaks sentences, stopping music on the first."""
+    first = [True]
+    def on_chunk(text):
+        speak_async(text, interrupt_music=first[0])
+        first[0] = False
+    return on_chunk
+
+def _prewarm_lm():
+    """Open the pooled HTTPS connection to the LM API so the first reply skips the handshake."""
+    if not _openai_client:
+        return
+    def _run():
+        try:
+            _openai_client.models.retrieve(LM_MODEL)
         except Exception as e:
-            print("TTS error:", e)
-        finally:
-            _tts_proc = None
-
+            print("LM prewarm error:", e)
     Thread(target=_run, daemon=True).start()
 
-# ===================== Language model =====================
-def lm_reply(user_text: str) -> str:
+def lm_reply(user_text: str, on_chunk=None) -> str:
+    """Full reply text; with on_chunk, stream and hand over each sentence as it completes."""
+    if on_chunk is not None:
+        return "".join(speak_sentences(lm_stream(user_text), on_chunk)).strip()
     if not _openai_client:
         return "Language model is not configured. Please set OPENAI_API_KEY."
     try:
-        resp = _openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system",
-                 "content": "You are a concise assistant for a quadruped robot. Robot motion and media playback are handled by the app; keep confirmations brief."
-                 },
-                {"role": "user", "content": user_text},
-            ],
-            temperature=0.4,
-            max_tokens=300,
-        )
+        resp = _lm_create(user_text, stream=False)
         return (resp.choices[0].message.content or "").strip()
     except Exception as e:
         return f"Error contacting language model: {e}"
 
 # ===================== Deepgram STT =====================
-def deepgram_transcribe(audio_bytes: bytes, mimetype: str = "audio/webm") -> str:
+DG_CHUNK_SIZE = 8192
+
+def _audio_chunks(audio):
+    """Yield bytes from a bytes object, a file-like object or an iterable of chunks."""
+    if isinstance(audio, (bytes, bytearray, memoryview)):
+        view = memoryview(audio)
+        for i in range(0, len(view), DG_CHUNK_SIZE):
+            yield view[i:i + DG_CHUNK_SIZE].tobytes()
+    elif hasattr(audio, "read"):
+        while True:
+            chunk = audio.read(DG_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        yield from audio
+
+DG_LISTEN_PARAMS = {"model": "nova-2", "smart_format": "true", "language": "en-US", "punctuate": "true"}
+# The browser streams mic audio to Deepgram's live endpoint with these extras
+DG_LIVE_PARAMS = dict(DG_LISTEN_PARAMS, interim_results="true", endpointing="300")
+DG_TOKEN_TTL = 30  # seconds; the browser only needs it to open the socket
+
+def deepgram_token() -> str:
+    """Mint a short-lived Deepgram token for the browser, or '' if unavailable."""
+    if not DEEPGRAM_API_KEY:
+        return ""
+    try:
+        r = _DG_SESSION.post("https://api.deepgram.com/v1/auth/grant",
+                             headers={"Authorization": f"Token {DEEPGRAM_API_KEY}"},
+                             json={"ttl_seconds": DG_TOKEN_TTL}, timeout=5)
+        r.raise_for_status()
+        return r.json().get("access_token") or ""
+    except Exception as e:
+        print("Deepgram token error:", e)
+        return ""
+
+def deepgram_transcribe(audio, mimetype: str = "audio/webm") -> str:
+    """Transcribe audio (bytes, file-like or chunk iterator), uploading it chunked."""
     if not DEEPGRAM_API_KEY:
         return ""
     url = "https://api.deepgram.com/v1/listen"
     headers = {"Authorization": f"Token {DEEPGRAM_API_KEY}", "Content-Type": mimetype}
-    params = {"model": "nova-2", "smart_format": "true", "language": "en-US", "punctuate": "true"}
+    params = DG_LISTEN_PARAMS
     try:
-        r = requests.post(url, headers=headers, params=params, data=audio_bytes, timeout=30)
+        # A generator body makes requests send Transfer-Encoding: chunked,
+        # so Deepgram can start on the audio before the upload finishes
+        r = _DG_SESSION.post(url, headers=headers, params=params, data=_audio_chunks(audio), timeout=30)
         r.raise_for_status()
         jd = r.json()
         try:
@@ -181,9 +585,32 @@ def deepgram_transcribe(audio_bytes: bytes, mimetype: str = "audio/webm") -> str
 # ===================== SerpAPI Web Browse =====================
 SERP_ENDPOINT = "https://serpapi.com/search.json"
 
+# Short-lived response cache so repeated voice queries skip the round trip
+SERP_CACHE_MAX = 128
+_serp_cache = OrderedDict()  # key -> (monotonic timestamp, json)
+_serp_cache_lock = Lock()
+
+def _serp_key(params: dict) -> tuple:
+    return tuple(sorted((k, " ".join(v.lower().split()) if k == "q" else v)
+                        for k, v in params.items()))
+
+def _serp_ttl(params: dict) -> float:
+    if params.get("engine") == "google_news":
+        return 90.0
+    if str(params.get("q", "")).lower().startswith("weather"):
+        return 30.0
+    return 60.0
+
+ELLIPSIS = "…"
+
 def _shorten(txt: str, n: int = 350) -> str:
-    txt = (txt or "").strip()
-    return txt if len(txt) <= n else (txt[:n-1].rstrip() + "…")
+    if not txt:
+        return ""
+    # Most SerpAPI fields are already short and trimmed; skip the strip copy
+    if len(txt) <= n and not txt[0].isspace() and not txt[-1].isspace():
+        return txt
+    txt = txt.strip()
+    return txt if len(txt) <= n else (txt[:n-1].rstrip() + ELLIPSIS)
 
 def _s(v):
     """Sanitize any SerpAPI value to a readable string."""
@@ -213,10 +640,22 @@ def serp_request(params: dict, timeout: int = 15) -> dict:
         return {"error": "SerpAPI key not set"}
     try:
         params = dict(params or {})
+        key = _serp_key(params)
+        with _serp_cache_lock:
+            hit = _serp_cache.get(key)
+            if hit and time.monotonic() - hit[0] < _serp_ttl(params):
+                _serp_cache.move_to_end(key)
+                return hit[1]
         params["api_key"] = SERPAPI_KEY
-        r = requests.get(SERP_ENDPOINT, params=params, timeout=timeout)
+        r = _SERP_SESSION.get(SERP_ENDPOINT, params=params, timeout=timeout)
         r.raise_for_status()
-        return r.json()
+        data = r.json()
+        with _serp_cache_lock:
+            _serp_cache[key] = (time.monotonic(), data)
+            _serp_cache.move_to_end(key)
+            while len(_serp_cache) > SERP_CACHE_MAX:
+                _serp_cache.popitem(last=False)
+        return data
     except Exception as e:
         return {"error": f"SerpAPI error: {e}"}
 
@@ -253,23 +692,29 @@ def serp_search(query: str, num: int = 5) -> str:
 
     return "\n".join(lines) if lines else "No results found."
 
+# Shared so a slow losing request never blocks the caller on pool shutdown
+_SERP_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="serp")
+
 def serp_news(query: str, num: int = 6) -> str:
-    """News via SerpAPI (google_news engine preferred)."""
+    """News via SerpAPI; google_news and google + tbm=nws race, first with results wins."""
     q = query or ""
     params = {"engine": "google_news"}
     if q:
         params["q"] = q
-    data = serp_request(params)
-    if "error" in data:
-        return data["error"]
-
-    news = data.get("news_results") or data.get("stories_results") or []
+    primary = _SERP_POOL.submit(serp_request, params)
+    fallback = _SERP_POOL.submit(serp_request, {"engine": "google", "q": (q or "top news"), "tbm": "nws"})
+
+    news = []
+    for fut in as_completed((primary, fallback)):
+        data = fut.result()
+        news = data.get("news_results") or data.get("stories_results") or []
+        if news:
+            break
+    for fut in (primary, fallback):
+        fut.cancel()
     if not news:
-        # Fallback to google + tbm=nws
-        data = serp_request({"engine": "google", "q": (q or "top news"), "tbm": "nws"})
-        news = data.get("news_results") or []
-        if not news:
-            return "No recent news found."
+        data = primary.result()
+        return data["error"] if "error" in data else "No recent news found."
 
     lines = [f"News{(' for: ' + q) if q else ''}"]
     for i, item in enumerate(news[:num], start=1):
@@ -325,26 +770,43 @@ def serp_weather(location: str) -> str:
         return f"{title} — {_shorten(snip, 220)} [{link}]"
     return "Couldn't retrieve weather right now."
 
+_SEARCH_RE = re.compile(r'^(search|look\s*up|google)\s+(for\s+)?(.+)$')
+_WEATHER_RE = re.compile(r'weather\s+(in|for)\s+(.+)$')
+_NEWS_RE = re.compile(r'(news|headlines|top stories)\s+(about|on|regarding)\s+(.+)$')
+_NEWS_WORDS = ("news", "headlines", "top stories", "what's happening", "whats happening")
+
+def _normalize(text: str) -> str:
+    return (text or "").lower().strip()
+
 def detect_web_intent(text: str):
     """Return {'type': 'search'|'news'|'weather', 'query': str} or None."""
-    t = (text or "").lower().strip()
+    return _detect_web_intent(_normalize(text))
 
+def _detect_web_intent(t: str):
+    intent = _web_intent(t)
+    return {"type": intent[0], "query": intent[1]} if intent else None
+
+# Voice turns repeat a lot ("weather", "news"), so results are memoized per
+# normalized text; tuples keep the cached value safe from callers
+@lru_cache(maxsize=512)
+def _web_intent(t: str):
     # Explicit search
-    m = re.match(r'^(search|look\s*up|google)\s+(for\s+)?(.+)$', t)
-    if m:
-        return {"type": "search", "query": m.group(3).strip()}
+    if t.startswith(("search", "look", "google")):
+        m = _SEARCH_RE.match(t)
+        if m:
+            return ("search", m.group(3).strip())
 
     # Weather
     if "weather" in t:
-        m = re.search(r'weather\s+(in|for)\s+(.+)$', t)
-        return {"type": "weather", "query": m.group(2).strip() if m else ""}
+        m = _WEATHER_RE.search(t)
+        return ("weather", m.group(2).strip() if m else "")
 
     # News (broadened)
-    if ("news" in t) or ("headlines" in t) or ("top stories" in t) or ("what's happening" in t) or ("whats happening" in t) or ("what's the news" in t):
-        m = re.search(r'(news|headlines|top stories)\s+(about|on|regarding)\s+(.+)$', t)
+    if any(w in t for w in _NEWS_WORDS):
+        m = _NEWS_RE.search(t)
         if m:
-            return {"type": "news", "query": m.group(3).strip()}
-        return {"type": "news", "query": ""}  # default to top news
+            return ("news", m.group(3).strip())
+        return ("news", "")  # default to top news
 
     return None
 
@@ -371,8 +833,17 @@ def do_web_intent(intent: dict) -> str:
         return f"Web error: {e}"
 
 # ===================== Flask & ServoKit =====================
-app = Flask(__name__)
-kit = ServoKit(channels=16)
+# /static is served from memory below, pre-gzipped
+app = Flask(__name__, static_folder=None)
+_kit = None
+
+def kit():
+    """Return the ServoKit, opening I2C on first motion so the UI starts without it."""
+    global _kit
+    if _kit is None:
+        # get_kit warns if the bus is below 1 MHz or MODE1 reads back wrong
+        _kit = get_kit()
+    return _kit
 
 # ===================== Channel Mapping (your wiring) =====================
 LEG1F_CHANNEL = 0
@@ -393,12 +864,16 @@ ALL_HIPS  = [LF_HIP, RF_HIP, LR_HIP, RR_HIP]
 ALL_KNEES = [LF_KNEE, RF_KNEE, LR_KNEE, RR_KNEE]
 
 # Diagonal pairs
-DIAG_A = [(LF_HIP, LF_KNEE), (RR_HIP, RR_KNEE)]
-DIAG_B = [(RF_HIP, RF_KNEE), (LR_HIP, LR_KNEE)]
+DIAG_A = ((LF_HIP, LF_KNEE), (RR_HIP, RR_KNEE))
+DIAG_B = ((RF_HIP, RF_KNEE), (LR_HIP, LR_KNEE))
+# Looked up once per step instead of comparing pairs
+OTHER_DIAG = {DIAG_A: DIAG_B, DIAG_B: DIAG_A}
+OPPOSITE_PAIR = {leg: OTHER_DIAG[diag] for diag in (DIAG_A, DIAG_B) for leg in diag}
 
 # ===================== Tuning =====================
-INVERT_HIP  = {LF_HIP: False, RF_HIP: True,  LR_HIP: False, RR_HIP: True}
-INVERT_KNEE = {LF_KNEE: False, RF_KNEE: True, LR_KNEE: False, RR_KNEE: True}
+# Indexed by PCA9685 channel; True mirrors the angle (180 - a)
+INVERT_HIP  = tuple(ch in (RF_HIP, RR_HIP) for ch in range(16))
+INVERT_KNEE = tuple(ch in (RF_KNEE, RR_KNEE) for ch in range(16))
 
 HIP_NEUTRAL = 90
 HIP_FWD     = 65
@@ -415,71 +890,114 @@ RAMP_DELAY  = 0.01
 DWELL       = 0.12
 TROT_DWELL  = 0.12
 
-# ===================== Movement flags =====================
-movement_flag = {
-    'forward':   False,
-    'backward':  False,
-    'left':      False,
-    'right':     False,
-    'trot':      False,
-    'trot_sync': False,
-}
+# ===================== Movement control =====================
+# One dispatcher runs every gait loop in turn; routes only queue what they
+# want next, and a running loop stops as soon as anything newer is queued.
+# With the GIL on, the dispatcher is a separate process so chat, LM and TTS
+# threads cannot stall a servo tick; a free-threaded build keeps it in-process.
+GAIT_IN_PROCESS = hasattr(sys, "_is_gil_enabled") and not sys._is_gil_enabled()
+PARK = None           # queued instead of a loop to stop and park neutral
+_gait_q = None        # (seq, loop or PARK); set by _start_gait_worker()
+_gait_seq = None      # shared count of commands queued so far
 
 # ===================== Helpers =====================
-def _apply_invert(ch, angle, invert_map):
-    return 180 - angle if invert_map.get(ch, False) else angle
-
-def _current_angle(ch, default_raw, invert_map):
-    a = kit.servo[ch].angle
-    return int(a) if a is not None else _apply_invert(ch, default_raw, invert_map)
-
-def _ramp_to(ch, target_raw, invert_map, step=RAMP_STEP, delay=RAMP_DELAY):
-    target = _apply_invert(ch, target_raw, invert_map)
-    cur = _current_angle(ch, target_raw, invert_map)
-    if cur == target:
-        kit.servo[ch].angle = target
-        return
-    sgn = 1 if target > cur else -1
-    for a in range(cur, target, sgn * step):
-        kit.servo[ch].angle = a
-        time.sleep(delay)
-    kit.servo[ch].angle = target
-
-def _ramp_sync(ch_list, target_raw_list, invert_map, step=RAMP_STEP, delay=RAMP_DELAY):
-    curs, targs = [], []
-    for ch, t_raw in zip(ch_list, target_raw_list):
-        t = _apply_invert(ch, t_raw, invert_map)
-        c = _current_angle(ch, t_raw, invert_map)
-        curs.append(c)
-        targs.append(t)
-    deltas = [abs(t - c) for c, t in zip(curs, targs)]
-    max_steps = 0 if not deltas else max((d + step - 1) // step for d in deltas)
-    for _ in range(max_steps):
-        for idx, ch in enumerate(ch_list):
-            c, t = curs[idx], targs[idx]
-            if c == t:
-                continue
-            sgn = 1 if t > c else -1
-            move = min(step, abs(t - c))
-            c_new = c + sgn * move
-            kit.servo[ch].angle = c_new
-            curs[idx] = c_new
-        time.sleep(delay)
-    for ch, t in zip(ch_list, targs):
-        kit.servo[ch].angle = t
-
-def set_hip(ch, angle):  _ramp_to(ch, angle, INVERT_HIP)
-def set_knee(ch, angle): _ramp_to(ch, angle, INVERT_KNEE)
+# Last angle written to each channel through _write_angles; every ramp ends
+# with one, so this is where each servo was left
+_last_angle = [None] * 16
+
+def _current_angle(ch, default):
+    a = _last_angle[ch]
+    if a is not None:
+        return a
+    # Not written yet in this process: decode it from the register shadow
+    a = angle_of(kit()._pca, ch)
+    return int(a) if a is not None else default
+
+def _write_angles(angles):
+    """Write {channel: angle} straight to the PCA9685, one burst per run of adjacent channels."""
+    write_channels(kit()._pca, {ch: duty_for_angle(a, ch) for ch, a in angles.items()})
+    for ch, a in angles.items():
+        _last_angle[ch] = a
+
+@lru_cache(maxsize=1024)
+def _ramp_path(ch, cur, targ, step):
+    """Counts channel ch steps through from cur to targ, ending on targ."""
+    if cur == targ:
+        return ()
+    sgn = 1 if targ > cur else -1
+    return tuple(duty_for_angle(a, ch) for a in range(cur + sgn * step, targ, sgn * step)) + (duty_for_angle(targ, ch),)
+
+@lru_cache(maxsize=256)
+def _ramp_plan(ch_list, curs, targs, step):
+    """Every tick's {channel: count} write for a synchronized ramp.
+
+    Gaits repeat the same few moves each cycle, so after the first cycle
+    every plan comes straight from the cache. Callers must not mutate it.
+    """
+    paths = [_ramp_path(ch, c, t, step) for ch, c, t in zip(ch_list, curs, targs)]
+    ticks = [{} for _ in range(max(map(len, paths), default=0))]
+    for ch, path in zip(ch_list, paths):
+        for tick, d in zip(ticks, path):
+            tick[ch] = d
+    return tuple(ticks)
+
+def _prewarm_ramps():
+    """Fill the path cache for every move between the gaits' poses before the first gait."""
+    hips = (HIP_NEUTRAL, HIP_FWD, HIP_BACK, (HIP_NEUTRAL + HIP_BACK) // 2)
+    knees = (KNEE_DOWN, KNEE_UP, KNEE_DOWN + PRESS_DELTA, KNEE_DOWN + LIGHTEN_DELTA)
+    for channels, poses in ((ALL_HIPS, hips), (ALL_KNEES, knees)):
+        angles = set(poses) | {180 - a for a in poses}
+        for ch in channels:
+            for cur in angles:
+                for targ in angles:
+                    _ramp_path(ch, cur, targ, RAMP_STEP)
+
+def _ramp_sync(ch_list, target_raw_list, invert, step=RAMP_STEP, delay=RAMP_DELAY):
+    """Ramp channels to their targets together; False if all were already there."""
+    targs = tuple(180 - t if invert[ch] else t for ch, t in zip(ch_list, target_raw_list))
+    curs = tuple(_current_angle(ch, t) for ch, t in zip(ch_list, targs))
+    if curs == targs:
+        return False
+    ticks = _ramp_plan(tuple(ch_list), curs, targs, step)
+    pca = kit()._pca
+    # Tick k is due at t0 + k*delay; after a late wake-up the ramp jumps to
+    # the tick for the current time instead of replaying the missed ones.
+    # The last tick lands on the targets, so nothing waits after it: a move
+    # within one step is a single write and no sleep.
+    t0 = time.monotonic()
+    last = len(ticks) - 1
+    k = 0
+    while True:
+        write_channels(pca, ticks[min(k, last)])
+        if k >= last:
+            break
+        sleep_until(t0 + (k + 1) * delay)
+        k = max(k + 1, int((time.monotonic() - t0) / delay))
+    _write_angles(dict(zip(ch_list, targs)))
+    return True
+
+def _ramp_to(ch, target_raw, invert, step=RAMP_STEP, delay=RAMP_DELAY):
+    # A one-channel synchronized ramp: same cached plan and deadlines, no per-tick branching
+    return _ramp_sync((ch,), (target_raw,), invert, step, delay)
+
+def _settle(moved, seconds):
+    """Dwell while the servos arrive, skipped when the ramp had nothing to move."""
+    if moved:
+        time.sleep(seconds)
+
+# Each returns whether anything moved
+def set_hip(ch, angle):  return _ramp_to(ch, angle, INVERT_HIP)
+def set_knee(ch, angle): return _ramp_to(ch, angle, INVERT_KNEE)
 def set_hip_pair(pair, angle):
     chs = [pair[0][0], pair[1][0]]
-    _ramp_sync(chs, [angle, angle], INVERT_HIP)
+    return _ramp_sync(chs, [angle, angle], INVERT_HIP)
 def set_knee_pair(pair, angle):
     chs = [pair[0][1], pair[1][1]]
-    _ramp_sync(chs, [angle, angle], INVERT_KNEE)
+    return _ramp_sync(chs, [angle, angle], INVERT_KNEE)
 def set_hips_all_sync(angle):
-    _ramp_sync(ALL_HIPS, [angle]*4, INVERT_HIP)
+    return _ramp_sync(ALL_HIPS, [angle]*4, INVERT_HIP)
 def set_knees_all_sync(angle):
-    _ramp_sync(ALL_KNEES, [angle]*4, INVERT_KNEE)
+    return _ramp_sync(ALL_KNEES, [angle]*4, INVERT_KNEE)
 
 # ===================== Posture =====================
 def plant_all():
@@ -493,15 +1011,16 @@ def setup():
     time.sleep(0.2)
 
 # ===================== Motion building blocks =====================
-def leg_lift(hip, knee):           set_knee(knee, KNEE_UP)
-def leg_lower(hip, knee):          set_knee(knee, KNEE_DOWN)
-def leg_swing_forward(hip, knee):  set_hip(hip, HIP_FWD)
-def leg_swing_backward(hip, knee): set_hip(hip, HIP_BACK)
+def leg_lift(hip, knee):           return set_knee(knee, KNEE_UP)
+def leg_lower(hip, knee):          return set_knee(knee, KNEE_DOWN)
+def leg_swing_forward(hip, knee):  return set_hip(hip, HIP_FWD)
+def leg_swing_backward(hip, knee): return set_hip(hip, HIP_BACK)
 def weight_shift_for_pair(swing_pair):
-    stance_pair = DIAG_B if swing_pair == DIAG_A else DIAG_A
-    set_knee_pair(stance_pair, KNEE_DOWN + PRESS_DELTA)
-    set_knee_pair(swing_pair,   KNEE_DOWN + LIGHTEN_DELTA)
-    time.sleep(TROT_DWELL)
+    stance_pair = OTHER_DIAG[swing_pair]
+    # All four knees in one ramp, so each tick is a single burst
+    moved = _ramp_sync([stance_pair[0][1], stance_pair[1][1], swing_pair[0][1], swing_pair[1][1]],
+                       [KNEE_DOWN + PRESS_DELTA] * 2 + [KNEE_DOWN + LIGHTEN_DELTA] * 2, INVERT_KNEE)
+    _settle(moved, TROT_DWELL)
 def clear_weight_shift():
     set_knees_all_sync(KNEE_DOWN)
 
@@ -512,47 +1031,48 @@ def setup_pose_bias_back():
     _ramp_sync(ALL_HIPS, [ (HIP_NEUTRAL + HIP_BACK)//2 ]*4, INVERT_HIP)
     time.sleep(0.2)
 def swing_backward_sequence(hip, knee):
-    weight_shift_for_pair(DIAG_B if (hip, knee) in DIAG_A else DIAG_A)
-    leg_lift(hip, knee);   time.sleep(DWELL)
-    leg_swing_backward(hip, knee); time.sleep(DWELL)
-    leg_lower(hip, knee);  time.sleep(DWELL)
+    weight_shift_for_pair(OPPOSITE_PAIR[(hip, knee)])
+    _settle(leg_lift(hip, knee), DWELL)
+    _settle(leg_swing_backward(hip, knee), DWELL)
+    _settle(leg_lower(hip, knee), DWELL)
     clear_weight_shift()
 def stance_push_all_forward():
-    set_hips_all_sync(HIP_FWD);  time.sleep(DWELL)
+    _settle(set_hips_all_sync(HIP_FWD), DWELL)
 def crawl_step_backward(order):
     for hip, knee in order:
         swing_backward_sequence(hip, knee)
         stance_push_all_forward()
-def walk_backward_loop():
+def walk_backward_loop(stop_evt):
     print("Crawl (backward)")
     setup_pose_bias_back()
     order = [(LF_HIP, LF_KNEE), (RR_HIP, RR_KNEE), (RF_HIP, RF_KNEE), (LR_HIP, LR_KNEE)]
-    while movement_flag['backward']:
+    while not stop_evt.is_set():
         crawl_step_backward(order)
     setup(); print("Backward stopped.")
 
 # ===================== Locked‑sync trot (Forward) =====================
 def trot_step_forward_sync(stance_pair, swing_pair):
     weight_shift_for_pair(swing_pair)
-    set_knee_pair(swing_pair, KNEE_UP); time.sleep(TROT_DWELL)
-    set_hip_pair(swing_pair, HIP_FWD);  time.sleep(TROT_DWELL)
-    set_knee_pair(swing_pair, KNEE_DOWN); time.sleep(TROT_DWELL)
-    clear_weight_shift()
-    set_hips_all_sync(HIP_BACK); time.sleep(TROT_DWELL)
-def trot_forward_loop_sync():
+    _settle(set_knee_pair(swing_pair, KNEE_UP), TROT_DWELL)
+    _settle(set_hip_pair(swing_pair, HIP_FWD), TROT_DWELL)
+    # Landing the swing pair and releasing the stance press are one ramp
+    # over all four knees, so every tick of it is a single burst
+    _settle(set_knees_all_sync(KNEE_DOWN), TROT_DWELL)
+    _settle(set_hips_all_sync(HIP_BACK), TROT_DWELL)
+def trot_forward_loop_sync(stop_evt):
     print("Locked‑sync trot (forward)")
     setup_pose_bias_back()
     stance, swing = DIAG_A, DIAG_B
-    while movement_flag['trot_sync']:
+    while not stop_evt.is_set():
         trot_step_forward_sync(stance, swing)
         stance, swing = swing, stance
     setup(); print("Trot (sync) stopped.")
 
 # ===================== Simple in‑place turns =====================
-def turn_left_loop():
+def turn_left_loop(stop_evt):
     print("Turning left (in place)...")
     plant_all(); hips_all(HIP_NEUTRAL); time.sleep(0.2)
-    while movement_flag['left']:
+    while not stop_evt.is_set():
         _ramp_sync([LF_HIP, LR_HIP, RF_HIP, RR_HIP],
                    [HIP_BACK, HIP_BACK, HIP_FWD, HIP_FWD], INVERT_HIP)
         time.sleep(DWELL)
@@ -560,10 +1080,10 @@ def turn_left_loop():
         set_knee(LR_KNEE, KNEE_UP); time.sleep(DWELL*0.6); set_knee(LR_KNEE, KNEE_DOWN)
         hips_all(HIP_NEUTRAL); time.sleep(DWELL*0.5)
     setup(); print("Left turn stopped.")
-def turn_right_loop():
+def turn_right_loop(stop_evt):
     print("Turning right (in place)...")
     plant_all(); hips_all(HIP_NEUTRAL); time.sleep(0.2)
-    while movement_flag['right']:
+    while not stop_evt.is_set():
         _ramp_sync([RF_HIP, RR_HIP, LF_HIP, LR_HIP],
                    [HIP_BACK, HIP_BACK, HIP_FWD, HIP_FWD], INVERT_HIP)
         time.sleep(DWELL)
@@ -576,36 +1096,85 @@ def turn_right_loop():
 COMMAND_PATTERNS = [
     # Generation / TTS control
     (r'\b(stop|cancel|quiet|shut\s*up)\b.*\b(speaking|talking|voice|tts|response|reply|generate|generating)\b',
-        lambda: ('gen/stop',)),
+        'gen/stop'),
     # Web browse triggers
-    (r'^\b(search|look\s*up|google)\b',              lambda: ('web/intent',)),
-    (r'\bnews\b',                                     lambda: ('web/intent',)),
-    (r'\bheadlines\b',                                lambda: ('web/intent',)),
-    (r'\btop stories\b',                              lambda: ('web/intent',)),
-    (r"what'?s happening",                            lambda: ('web/intent',)),
-    (r"what'?s the news",                             lambda: ('web/intent',)),
+    (r'^\b(search|look\s*up|google)\b',              'web/intent'),
+    (r'\bnews\b',                                     'web/intent'),
+    (r'\bheadlines\b',                                'web/intent'),
+    (r'\btop stories\b',                              'web/intent'),
+    (r"what'?s happening",                            'web/intent'),
+    (r"what'?s the news",                             'web/intent'),
     # Music control
-    (r'\b(stop|pause|halt)\b.*\b(music|song|audio|playback)\b', lambda: ('media/stop',)),
-    (r'\bplay\b.*\b(24\s?k|twenty[\s-]*four\s?k)\b.*\bmagic\b', lambda: ('media/play_24k',)),
-    (r'\bplay\b.*\bmagic\b.*\b(24\s?k|twenty[\s-]*four\s?k)\b', lambda: ('media/play_24k',)),
+    (r'\b(stop|pause|halt)\b.*\b(music|song|audio|playback)\b', 'media/stop'),
+    (r'\bplay\b.*\b(24\s?k|twenty[\s-]*four\s?k)\b.*\bmagic\b', 'media/play_24k'),
+    (r'\bplay\b.*\bmagic\b.*\b(24\s?k|twenty[\s-]*four\s?k)\b', 'media/play_24k'),
     # Robot motion
-    (r'\b(stop|halt|park)\b',                        lambda: ('stop',)),
-    (r'\b(trot sync|sync trot|locked trot)\b',       lambda: ('forward',)),
-    (r'\bforward\b',                                 lambda: ('forward',)),
-    (r'\bbackward|reverse\b',                        lambda: ('backward',)),
-    (r'\bleft\b',                                    lambda: ('left',)),
-    (r'\bright\b',                                   lambda: ('right',)),
-    (r'\bneutral|home|reset\b',                      lambda: ('diag/neutral',)),
+    (r'\b(stop|halt|park)\b',                        'stop'),
+    (r'\b(trot sync|sync trot|locked trot)\b',       'forward'),
+    (r'\bforward\b',                                 'forward'),
+    (r'\bbackward|reverse\b',                        'backward'),
+    (r'\bleft\b',                                    'left'),
+    (r'\bright\b',                                   'right'),
+    (r'\bneutral|home|reset\b',                      'diag/neutral'),
 ]
 
+# All patterns fused into one regex compiled at import. Each alternative is a
+# lookahead from the start of the text, so the first pattern in the list
+# that matches anywhere still wins, exactly like searching them in order.
+_COMMAND_RE = re.compile("|".join(
+    rf"(?P<g{i}>(?=[\s\S]*?(?:{pattern})))" for i, (pattern, _) in enumerate(COMMAND_PATTERNS)
+))
+_COMMAND_ACTIONS = [action for _, action in COMMAND_PATTERNS]
+
+# Every pattern above needs at least one of these substrings, so text with
+# none of them (most chat) is rejected by plain substring scans before the
+# regex walks it once per pattern. Keep this in step with COMMAND_PATTERNS.
+_COMMAND_KEYWORDS = (
+    "stop", "cancel", "quiet", "shut", "search", "look", "google", "news",
+    "headlines", "top stories", "happening", "pause", "halt", "play", "park",
+    "trot", "forward", "backward", "reverse", "left", "right", "neutral",
+    "home", "reset",
+)
+
+def _build_command_db():
+    """Compile COMMAND_PATTERNS into one hyperscan DFA when the library is installed."""
+    if hyperscan is None:
+        return None
+    try:
+        db = hyperscan.Database()
+        # \b is ASCII-only here (hyperscan has no Unicode \b); the keywords are all ASCII
+        flags = hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_SINGLEMATCH
+        db.compile(
+            expressions=[pattern.encode() for pattern, _ in COMMAND_PATTERNS],
+            ids=list(range(len(COMMAND_PATTERNS))),
+            elements=len(COMMAND_PATTERNS),
+            flags=[flags] * len(COMMAND_PATTERNS),
+        )
+        return db
+    except Exception as e:
+        print("[WARN] hyperscan could not compile the command patterns; using re:", e)
+        return None
+
+_COMMAND_DB = _build_command_db()
+_command_db_lock = Lock()   # one scratch space per database
+
 def parse_robot_command(text: str):
-    text = (text or "").lower().strip()
+    return _parse_robot_command(_normalize(text))
+
+@lru_cache(maxsize=512)
+def _parse_robot_command(text: str):
     if text.startswith("robot "):
         text = text.split(" ", 1)[1]
-    for pattern, builder in COMMAND_PATTERNS:
-        if re.search(pattern, text):
-            return builder()[0]
-    return None
+    if not any(k in text for k in _COMMAND_KEYWORDS):
+        return None
+    if _COMMAND_DB is not None:
+        # Every pattern is scanned in one pass; the earliest in the list wins
+        hits = []
+        with _command_db_lock:
+            _COMMAND_DB.scan(text.encode(), match_event_handler=lambda i, *_: hits.append(i))
+        return _COMMAND_ACTIONS[min(hits)] if hits else None
+    m = _COMMAND_RE.match(text)
+    return _COMMAND_ACTIONS[int(m.lastgroup[1:])] if m else None
 
 def execute_robot_action(action: str):
     if action == 'gen/stop':
@@ -634,6 +1203,48 @@ def execute_robot_action(action: str):
     else:
         return "Unknown action."
 
+# A bare motion command ("robot stop", "turn left") gets a fixed reply
+# instead of a round trip to the LM; longer text still goes to the LM
+MOTION_REPLIES = {
+    'stop': "Stopping now.",
+    'forward': "Moving forward.",
+    'backward': "Moving backward.",
+    'left': "Turning left.",
+    'right': "Turning right.",
+    'diag/neutral': "Standing neutral.",
+}
+SHORT_COMMAND_WORDS = 4
+
+def _motion_reply(t: str, action):
+    """Canned reply for a short motion command, or None if the LM should answer."""
+    if action in MOTION_REPLIES and len(t.split()) <= SHORT_COMMAND_WORDS:
+        return MOTION_REPLIES[action]
+    return None
+
+# Fixed replies that can reach speak_async; synthesized once at startup so
+# speaking them never waits on gTTS
+CANNED_REPLIES = tuple(MOTION_REPLIES.values()) + (
+    "Stopped music.",
+    "Stopped speaking.",
+    "Playing 24K Magic.",
+    "I didn't catch that. Please try again.",
+    "No results found.",
+    "No recent news found.",
+    "Couldn't retrieve weather right now.",
+    "Web search is not configured (set SERPAPI_KEY).",
+    "Language model is not configured. Please set OPENAI_API_KEY.",
+)
+
+def _prewarm_tts():
+    def _run():
+        for text in CANNED_REPLIES:
+            try:
+                tts_cached_path(text)
+            except Exception as e:
+                print("TTS prewarm error:", e)
+                return
+    Thread(target=_run, daemon=True).start()
+
 # ===================== UI (speech bubbles + mic button) =====================
 HTML = '''
 <!DOCTYPE html>
@@ -642,53 +1253,7 @@ HTML = '''
   <meta charset="utf-8" />
   <title>Quadruped Controller</title>
   <meta name="viewport" content="width=device-width,initial-scale=1" />
-  <style>
-    :root{
-      --bg: #f4f5f7;
-      --card: #ffffff;
-      --text: #1f2937;
-      --muted: #6b7280;
-      --shadow: 0 8px 24px rgba(0,0,0,.06);
-      --radius: 12px;
-      --neutral: #f1f3f5;
-      --neutral-hover: #e9ecef;
-      --neutral-border: #dfe3e8;
-      --neutral-text: #2c3e50;
-      --blue: #2563eb;
-      --blue-600: #2563eb;
-      --blue-glow: rgba(59,130,246,.35);
-      --blue-border: #3b82f6;
-      --danger: #b91c1c;
-      --danger-hover: #991b1b;
-    }
-    *{box-sizing:border-box}
-    body{font-family: ui-sans-serif,-apple-system,Segoe UI,Roboto,Helvetica,Arial;background:linear-gradient(180deg,#f8f9fa 0%,var(--bg) 100%);color:var(--text);margin:0;padding:28px;display:flex;justify-content:center;}
-    .container{ width:min(1080px,100%); display:grid; gap:18px; }
-    .card{ background:var(--card); border-radius:12px; box-shadow:0 8px 24px rgba(0,0,0,.06); border:1px solid #eef0f2; padding:18px; }
-    .header{ display:flex; align-items:center; justify-content:space-between; gap:12px; }
-    .title{ font-size:20px; font-weight:700; letter-spacing:.2px; }
-    .controls{ display:grid; grid-template-columns:repeat(auto-fit,minmax(160px,1fr)); gap:12px; margin-top:12px; }
-    .btn{ appearance:none; cursor:pointer; user-select:none; border:1px solid var(--neutral-border); padding:12px 14px; border-radius:10px; font-size:16px; font-weight:600; letter-spacing:.2px; background:var(--neutral); color:var(--neutral-text); transition:transform .06s, box-shadow .18s, background .18s, border-color .18s, filter .18s; box-shadow:0 2px 10px rgba(0,0,0,.05); outline:none; }
-    .btn:hover{ background:var(--neutral-hover); transform:translateY(-1px); }
-    .btn:active{ transform:translateY(0); }
-    .btn:focus-visible{ box-shadow:0 0 0 4px var(--blue-glow); border-color:var(--blue-border); }
-    .btn-danger{ background:var(--danger); color:#fff; border-color:var(--danger); }
-    .btn-danger:hover{ background:var(--danger-hover); border-color:var(--danger-hover); }
-    #chatbox{ height:320px; border:1px solid #e5e7eb; border-radius:12px; padding:12px; overflow:auto; background:#fcfcfd; display:flex; flex-direction:column; gap:8px; }
-    .row{ display:flex; gap:10px; align-items:center; }
-    .chat-input{ flex:1; padding:12px 14px; border:1px solid #dadada; border-radius:12px; font-size:16px; outline:none; background:#fff; transition: box-shadow .18s, border-color .18s; }
-    .chat-input:focus{ border-color:var(--blue-border); box-shadow:0 0 0 4px var(--blue-glow); }
-    .msg{ max-width:75%; padding:10px 12px; border-radius:14px; line-height:1.35; word-wrap:break-word; box-shadow:0 1px 4px rgba(0,0,0,.06); }
-    .msg.user{ margin-left:auto; background:var(--neutral); color:var(--neutral-text); border:1px solid var(--neutral-border); }
-    .msg.bot{ margin-right:auto; background:var(--blue); color:#fff; border:1px solid var(--blue-600); }
-    .msg.system{ margin-right:auto; background:#eef2ff; color:#1e3a8a; border:1px solid #c7d2fe; }
-    .icon-btn{ display:inline-flex; align-items:center; justify-content:center; width:46px; height:46px; border-radius:50%; border:1px solid transparent; background:#3a3a3a; color:#fff; box-shadow:0 2px 10px rgba(0,0,0,.10); cursor:pointer; transition: transform .06s, background .2s, box-shadow .2s, border-color .2s; outline:none; }
-    .icon-btn:hover{ background:#2f2f2f; transform:translateY(-1px); }
-    .icon-btn:active{ transform:translateY(0); }
-    .icon-btn:focus-visible{ box-shadow:0 0 0 4px var(--blue-glow); border-color:var(--blue-border); }
-    .icon{ width:22px; height:22px; display:block; }
-    .icon-btn.mic.active{ background:#ef4444; }
-  </style>
+  <link rel="stylesheet" href="/static/style.css" />
 </head>
 <body>
   <div class="container">
@@ -723,146 +1288,168 @@ HTML = '''
     </div>
   </div>
 
-  <script>
-    function sendCmd(path){
-      fetch('/' + path);
-      appendBubble('system', 'Executing: ' + path);
-    }
-    function appendBubble(kind, text){
-      const box = document.getElementById('chatbox');
-      const div = document.createElement('div');
-      div.className = 'msg ' + (kind || 'bot');
-      div.textContent = text;
-      box.appendChild(div);
-      box.scrollTop = box.scrollHeight;
-    }
-    async function ask(){
-      const input = document.getElementById('msg');
-      const text = input.value.trim();
-      if(!text) return;
-      appendBubble('user', text);
-      input.value = '';
-      const resp = await fetch('/ask', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({text})});
-      const data = await resp.json();
-      if (data.robot_action) appendBubble('system', 'Executing: ' + data.robot_action);
-      appendBubble('bot', data.reply || '(no response)');
-    }
-    document.getElementById('msg').addEventListener('keydown', (e)=>{ if(e.key === 'Enter') ask(); });
-
-    // ======== Voice (MediaRecorder -> /voice_ask) ========
-    let mediaRecorder = null, chunks = [], streamRef = null, recording = false;
-    function pickSupportedMime(){
-      const candidates = ['audio/webm;codecs=opus','audio/webm','audio/mp4'];
-      for (const t of candidates){
-        if (MediaRecorder.isTypeSupported && MediaRecorder.isTypeSupported(t)) return t;
-      }
-      return '';
-    }
-    async function toggleRec(){
-      if (recording){ stopRec(); } else { await startRec(); }
-    }
-    async function startRec(){
-      const micBtn = document.getElementById('micBtn');
-      try {
-        const mimeType = pickSupportedMime();
-        streamRef = await navigator.mediaDevices.getUserMedia({ audio: true });
-        mediaRecorder = new MediaRecorder(streamRef, mimeType ? { mimeType } : undefined);
-        chunks = [];
-        mediaRecorder.ondataavailable = e => { if (e.data && e.data.size > 0) chunks.push(e.data); };
-        mediaRecorder.onstop = async () => {
-          const chosenType = mediaRecorder.mimeType || 'audio/webm';
-          const blob = new Blob(chunks, { type: chosenType });
-          chunks = [];
-          await sendVoiceBlob(blob);
-          cleanupStream();
-        };
-        mediaRecorder.start();
-        recording = true;
-        micBtn.classList.add('active');
-      } catch (err) {
-        appendBubble('system', 'Microphone error: ' + err);
-        cleanupStream();
-      }
-    }
-    function stopRec(){
-      const micBtn = document.getElementById('micBtn');
-      if (mediaRecorder && mediaRecorder.state === 'recording') { mediaRecorder.stop(); }
-      else { cleanupStream(); }
-      recording = false;
-      micBtn.classList.remove('active');
-    }
-    function cleanupStream(){
-      if (streamRef){ streamRef.getTracks().forEach(t => t.stop()); streamRef = null; }
-      mediaRecorder = null;
-    }
-    async function sendVoiceBlob(blob){
-      const form = new FormData();
-      form.append('audio', blob, 'voice');
-      try {
-        const resp = await fetch('/voice_ask', { method: 'POST', body: form });
-        const data = await resp.json();
-        if (data.transcript) appendBubble('user', data.transcript);
-        if (data.robot_action) appendBubble('system', 'Executing: ' + data.robot_action);
-        appendBubble('bot', data.reply || '(no response)');
-      } catch (e){
-        appendBubble('system', 'Voice send error: ' + e);
-      }
-    }
-  </script>
+  <script src="/static/voice.js" defer></script>
 </body>
 </html>
 '''
 
+GZIP_MIN_BYTES = 512
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+STATIC_MAX_AGE = 86400
+INDEX_MAX_AGE = 3600
+STATIC_TYPES = {'.js': 'text/javascript', '.css': 'text/css'}
+
+def _asset(data, mimetype):
+    """(raw bytes, gzipped bytes, mimetype, etag) for a response built once."""
+    return (data, gzip.compress(data, compresslevel=9), mimetype,
+            hashlib.sha1(data).hexdigest()[:16])
+
+def _load_static():
+    """Read and gzip every asset in static/ once, keyed by file name."""
+    assets = {}
+    try:
+        names = os.listdir(STATIC_DIR)
+    except OSError as e:
+        print("[WARN] no static assets:", e)
+        return assets
+    for name in names:
+        mimetype = STATIC_TYPES.get(os.path.splitext(name)[1])
+        if mimetype is None:
+            continue
+        with open(os.path.join(STATIC_DIR, name), 'rb') as f:
+            assets[name] = _asset(f.read(), mimetype)
+    return assets
+
+_STATIC = _load_static()
+# HTML has no template variables, so it is encoded and gzipped once instead of rendered per request
+_INDEX = _asset(HTML.encode("utf-8"), 'text/html')
+
+def _send_asset(asset, max_age):
+    data, gz, mimetype, etag = asset
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        resp = Response(gz, mimetype=mimetype)
+        resp.headers['Content-Encoding'] = 'gzip'
+    else:
+        resp = Response(data, mimetype=mimetype)
+    resp.headers['Vary'] = 'Accept-Encoding'
+    resp.headers['Cache-Control'] = f'public, max-age={max_age}'
+    resp.set_etag(etag)
+    return resp.make_conditional(request)
+
 @app.route('/')
 def index():
-    return render_template_string(HTML)
+    return _send_asset(_INDEX, INDEX_MAX_AGE)
+
+@app.route('/static/<name>')
+def static_asset(name):
+    asset = _STATIC.get(name)
+    if asset is None:
+        return "Not found", 404
+    return _send_asset(asset, STATIC_MAX_AGE)
+
+@app.after_request
+def _gzip_json(resp):
+    """Gzip JSON replies for clients that accept it; streamed replies pass through."""
+    if (resp.mimetype != 'application/json' or resp.is_streamed
+            or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+        return resp
+    data = resp.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return resp
+    resp.set_data(gzip.compress(data, compresslevel=5))
+    resp.headers['Content-Encoding'] = 'gzip'
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
 
 # ---- Start/Stop endpoints ----
-def _stop_all_flags():
-    for k in movement_flag.keys():
-        movement_flag[k] = False
+class _SeqStop:
+    """Stop flag handed to a gait loop: set once a command newer than seq n is queued."""
+    def __init__(self, seq, n):
+        self._seq = seq
+        self._n = n
+
+    def is_set(self):
+        return self._seq.value != self._n
+
+def _gait_dispatcher(q, seq):
+    # Chat, TTS and LM threads run at normal priority, so they can no longer
+    # delay a servo tick; memory is locked so the gaits never page-fault
+    make_realtime()
+    lock_memory()
+    _prewarm_ramps()
+    while True:
+        n, loop = q.get()
+        # Only the latest request matters when taps pile up
+        while True:
+            try:
+                n, loop = q.get_nowait()
+            except queue.Empty:
+                break
+        if n != seq.value:
+            continue  # a newer command is counted but not through the queue yet
+        try:
+            if loop is PARK:
+                setup()
+            else:
+                loop(_SeqStop(seq, n))
+        except Exception as e:
+            print("Gait error:", e)
+
+def _start_gait_worker():
+    """Start the gait dispatcher; must run before any other servo access."""
+    global _gait_q, _gait_seq
+    # fork, so the child needs nothing re-imported; it only ever touches the servos
+    ctx = multiprocessing.get_context("fork")
+    _gait_seq = ctx.Value('Q', 0)
+    # A forked child gets copies of every lock another thread might be
+    # holding, so only fork while this is the sole thread
+    in_process = GAIT_IN_PROCESS
+    if not in_process and active_count() > 1:
+        print("Warning: threads already running, keeping the gait dispatcher in-process")
+        in_process = True
+    if in_process:
+        _gait_q = queue.Queue()
+        Thread(target=_gait_dispatcher, args=(_gait_q, _gait_seq), name="gait", daemon=True).start()
+        return
+    _gait_q = ctx.Queue()
+    ctx.Process(target=_gait_dispatcher, args=(_gait_q, _gait_seq), name="gait", daemon=True).start()
+
+def _start_motion(loop):
+    """Queue the next gait loop (or PARK); the running one stops on its own. Never blocks."""
+    # Counted and queued under one lock, so queue order matches the count
+    with _gait_seq.get_lock():
+        _gait_seq.value += 1
+        _gait_q.put((_gait_seq.value, loop))
 
 @app.route('/forward')
 def forward():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['trot_sync'] = True
-    Thread(target=trot_forward_loop_sync, daemon=True).start()
+    _start_motion(trot_forward_loop_sync)
     return "Moving forward (locked-sync trot)..."
 
 @app.route('/backward')
 def backward():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['backward'] = True
-    Thread(target=walk_backward_loop, daemon=True).start()
+    _start_motion(walk_backward_loop)
     return "Moving backward (crawl gait)..."
 
 @app.route('/left')
 def left():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['left'] = True
-    Thread(target=turn_left_loop, daemon=True).start()
+    _start_motion(turn_left_loop)
     return "Turning left..."
 
 @app.route('/right')
 def right():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['right'] = True
-    Thread(target=turn_right_loop, daemon=True).start()
+    _start_motion(turn_right_loop)
     return "Turning right..."
 
 @app.route('/stop')
 def stop():
-    _stop_all_flags()
-    setup()
+    _start_motion(PARK)
     return "Stopping and parking neutral."
 
 @app.route('/diag_neutral')
 def diag_neutral():
-    setup()
+    _start_motion(PARK)
     return "Neutral posture set."
 
 # ----- Music routes (optional) -----
@@ -876,90 +1463,175 @@ def media_stop_route():
     return "Stopped music."
 
 # ===================== Chat endpoints (media/gen/web-aware) =====================
+def ojson(data):
+    """JSON response encoded with orjson when it is installed."""
+    if orjson is None:
+        return jsonify(data)
+    return Response(orjson.dumps(data), mimetype='application/json')
+
+# Web lookups run here so they overlap a robot action from the same message;
+# kept apart from _SERP_POOL, which serp_news itself submits to
+_EXEC = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chat")
+
+def _start_web_intent(t: str, action):
+    """Submit the message's web lookup, if any, before the robot action runs."""
+    if action == 'gen/stop' or (action or '').startswith('media/'):
+        return None
+    intent = _detect_web_intent(t)
+    if not intent and action != 'web/intent':
+        return None
+    return _EXEC.submit(do_web_intent, intent or {"type": "news", "query": ""})
+
 @app.route('/ask', methods=['POST'])
 def ask():
     data = request.get_json(force=True, silent=True) or {}
     text = (data.get('text') or "").strip()
     _generation_cancel.clear()
 
-    action = parse_robot_command(text)
+    t = _normalize(text)
+    action = _parse_robot_command(t)
+    web = _start_web_intent(t, action)
     robot_msg = None
     if action:
         robot_msg = execute_robot_action(action)
         if action == 'gen/stop':
-            return jsonify({"reply": robot_msg, "robot_action": action, "robot_message": robot_msg})
+            return ojson({"reply": robot_msg, "robot_action": action, "robot_message": robot_msg})
         if action and action.startswith('media/'):
             reply = robot_msg or "OK."
             if action == 'media/stop':
                 speak_async(reply, interrupt_music=False)
-            return jsonify({"reply": reply, "robot_action": action, "robot_message": robot_msg})
+            return ojson({"reply": reply, "robot_action": action, "robot_message": robot_msg})
+        reply = _motion_reply(t, action)
+        if reply:
+            speak_async(reply)
+            return ojson({"reply": reply, "robot_action": action, "robot_message": robot_msg})
 
     # Web intent?
-    intent = detect_web_intent(text)
-    if intent or (action == 'web/intent'):
-        if not intent:
-            intent = {"type": "news", "query": ""}
-        reply = do_web_intent(intent)
+    if web:
+        reply = web.result()
         to_say = reply.splitlines()[0] if reply else ""
         speak_async(_shorten(to_say, 180), interrupt_music=False)
-        return jsonify({"reply": reply, "robot_action": "web/intent", "robot_message": robot_msg})
+        return ojson({"reply": reply, "robot_action": "web/intent", "robot_message": robot_msg})
 
-    # Normal LM
-    reply = lm_reply(text)
-    if _generation_cancel.is_set():
-        return jsonify({"reply": "(stopped)", "robot_action": action, "robot_message": robot_msg})
-    speak_async(reply, interrupt_music=True)
-    return jsonify({"reply": reply, "robot_action": action, "robot_message": robot_msg})
+    # Normal LM: stream text to the bubble while each sentence is spoken
+    deltas = speak_sentences(lm_stream(text), sentence_speaker())
+    headers = {"X-Robot-Action": action} if action else {}
+    return Response(stream_with_context(deltas), mimetype='text/plain', headers=headers)
 
 @app.route('/voice_ask', methods=['POST'])
 def voice_ask():
     f = request.files.get('audio')
     if not f:
-        return jsonify({"error": "No audio provided"}), 400
+        return ojson({"error": "No audio provided"}), 400
     _generation_cancel.clear()
 
-    audio_bytes = f.read()
     mimetype = f.mimetype or "audio/webm"
-    transcript = deepgram_transcribe(audio_bytes, mimetype=mimetype)
+    return _voice_reply(deepgram_transcribe(f.stream, mimetype=mimetype))
+
+@app.route('/dg_token')
+def dg_token():
+    token = deepgram_token()
+    if not token:
+        return ojson({"error": "Deepgram streaming unavailable"}), 503
+    return ojson({"token": token, "params": DG_LIVE_PARAMS})
+
+@app.route('/voice_text', methods=['POST'])
+def voice_text():
+    """Same as /voice_ask for a transcript the browser already got from Deepgram."""
+    data = request.get_json(force=True, silent=True) or {}
+    _generation_cancel.clear()
+    return _voice_reply((data.get('transcript') or "").strip())
+
+# Speculative LM reply started from a live transcript before the mic is released.
+# It gets its own single worker, so guesses queue behind each other instead of
+# taking _EXEC slots from real requests.
+_PREFETCH = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+_speculative = None   # (normalized text, Future) or None
+_speculative_lock = Lock()
+
+@app.route('/voice_prefetch', methods=['POST'])
+def voice_prefetch():
+    """Start the LM on what Deepgram has finalized so far; /voice_text uses it if nothing changes."""
+    global _speculative
+    data = request.get_json(force=True, silent=True) or {}
+    transcript = (data.get('transcript') or "").strip()
+    t = _normalize(transcript)
+    # Commands and web lookups never reach the LM, so there is nothing to prefetch
+    if not t or _parse_robot_command(t) or _detect_web_intent(t):
+        return ojson({"prefetch": False})
+    with _speculative_lock:
+        if not (_speculative and _speculative[0] == t):
+            if _speculative:
+                _speculative[1].cancel()  # a newer transcript; drop the stale guess if not started
+            _speculative = (t, _PREFETCH.submit(lm_reply, transcript))
+    return ojson({"prefetch": True})
+
+def _take_speculative(t: str):
+    """Return the speculative reply future if it was started for exactly this text."""
+    global _speculative
+    with _speculative_lock:
+        spec, _speculative = _speculative, None
+    if not spec:
+        return None
+    if spec[0] != t:
+        spec[1].cancel()
+        return None
+    return spec[1]
+
+def _voice_reply(transcript: str):
     if not transcript:
         reply = "I didn't catch that. Please try again."
         speak_async(reply, interrupt_music=True)
-        return jsonify({"transcript": "", "reply": reply, "robot_action": None})
+        return ojson({"transcript": "", "reply": reply, "robot_action": None})
 
-    action = parse_robot_command(transcript)
+    t = _normalize(transcript)
+    action = _parse_robot_command(t)
+    web = _start_web_intent(t, action)
     robot_msg = None
     if action:
         robot_msg = execute_robot_action(action)
         if action == 'gen/stop':
-            return jsonify({"transcript": transcript, "reply": robot_msg,
-                            "robot_action": action, "robot_message": robot_msg})
+            return ojson({"transcript": transcript, "reply": robot_msg,
+                          "robot_action": action, "robot_message": robot_msg})
         if action and action.startswith('media/'):
             reply = robot_msg or "OK."
             if action == 'media/stop':
                 speak_async(reply, interrupt_music=False)
-            return jsonify({"transcript": transcript, "reply": reply,
-                            "robot_action": action, "robot_message": robot_msg})
-
-    intent = detect_web_intent(transcript)
-    if intent or (action == 'web/intent'):
-        if not intent:
-            intent = {"type": "news", "query": ""}
-        reply = do_web_intent(intent)
+            return ojson({"transcript": transcript, "reply": reply,
+                          "robot_action": action, "robot_message": robot_msg})
+        reply = _motion_reply(t, action)
+        if reply:
+            speak_async(reply)
+            return ojson({"transcript": transcript, "reply": reply,
+                          "robot_action": action, "robot_message": robot_msg})
+
+    if web:
+        reply = web.result()
         to_say = reply.splitlines()[0] if reply else ""
         speak_async(_shorten(to_say, 180), interrupt_music=False)
-        return jsonify({"transcript": transcript, "reply": reply,
-                        "robot_action": "web/intent", "robot_message": robot_msg})
+        return ojson({"transcript": transcript, "reply": reply,
+                      "robot_action": "web/intent", "robot_message": robot_msg})
 
-    reply = lm_reply(transcript)
+    spec = _take_speculative(t)
+    if spec:
+        reply = spec.result()
+        speak_async(reply, interrupt_music=True)
+    else:
+        reply = lm_reply(transcript, on_chunk=sentence_speaker())
     if _generation_cancel.is_set():
-        return jsonify({"transcript": transcript, "reply": "(stopped)",
-                        "robot_action": action, "robot_message": robot_msg})
-    speak_async(reply, interrupt_music=True)
-    return jsonify({"transcript": transcript, "reply": reply,
-                    "robot_action": action, "robot_message": robot_msg})
+        return ojson({"transcript": transcript, "reply": "(stopped)",
+                      "robot_action": action, "robot_message": robot_msg})
+    return ojson({"transcript": transcript, "reply": reply,
+                  "robot_action": action, "robot_message": robot_msg})
 
 # ===================== Main =====================
-if __name__ == "__main__":
+def startup():
+    """One-time process setup; run from __main__ or gunicorn.conf.py's post_worker_init."""
+    # Forked first, before this module starts any threads or children of
+    # its own (the TTS worker, mpg123); gunicorn's gthread pool only spawns
+    # threads once requests arrive, after post_worker_init
+    _start_gait_worker()
+    Thread(target=_tts_worker, name="tts", daemon=True).start()
     try:
         default_dir = os.path.dirname(os.path.expanduser(SONG_24K_PATH))
         if default_dir and not os.path.exists(default_dir):
@@ -967,8 +1639,20 @@ if __name__ == "__main__":
     except Exception as e:
         print("Warning: could not ensure media directory:", e)
 
-    setup()
-    # Optional per-servo calibration
-    # for ch in [LF_HIP, RF_HIP, LR_HIP, RR_HIP, LF_KNEE, RF_KNEE, LR_KNEE, RR_KNEE]:
-    #     kit.servo[ch].set_pulse_width_range(500, 2500)
-    app.run(host='0.0.0.0', port=5000)
+    try:
+        _mpg_rc_start()
+    except Exception as e:
+        print("Warning: could not start mpg123 remote player:", e)
+    _prewarm_tts()
+    _prewarm_lm()
+    # Servo errors are reported by the dispatcher; chat still works without it
+    _start_motion(PARK)
+    # Optional calibration: servo writes go through servo_common, so change
+    # MIN_PULSE / MAX_PULSE there (e.g. 500 / 2500), or call
+    # servo_common.set_pulse_range(ch, 500, 2500) per servo at import time
+    # so the forked gait process inherits it
+
+if __name__ == "__main__":
+    startup()
+    # Development server; for production use `gunicorn -c gunicorn.conf.py cleaneduigpt:app`
+    app.run(host='0.0.0.0', port=5000, threaded=True)
@@ -1,13 +1,13 @@
-from flask import Flask, render_template_string
-from threading import Thread
+from flask import Flask, Response
+from threading import Event, Lock, Thread
 import time
-from adafruit_servokit import ServoKit
+from servo_common import duty_for_angle, get_kit, loop_events, run_realtime, write_angles
 
 # Initialize Flask app
 app = Flask(__name__)
 
 # Initialize ServoKit with 16 channels
-kit = ServoKit(channels=16)
+kit = get_kit()
 
 # Define servo channels
 LEG1F_CHANNEL = 0  # Front Left Forward
@@ -27,54 +27,61 @@ DEFAULT_BACKWARD_ANGLE = 90
 FORWARD_ANGLE = 60
 BACKWARD_ANGLE = 120
 
-# Movement control flag
-movement_flag = {'forward': False}
+# Raw PCA9685 counts for the gait angles, so a step is just two register writes
+PULSE = {a: duty_for_angle(a) for a in (DEFAULT_FORWARD_ANGLE, DEFAULT_BACKWARD_ANGLE, FORWARD_ANGLE, BACKWARD_ANGLE)}
+
+ALL_CHANNELS = (LEG1F_CHANNEL, LEG1B_CHANNEL, LEG2F_CHANNEL, LEG2B_CHANNEL,
+                LEG3F_CHANNEL, LEG3B_CHANNEL, LEG4F_CHANNEL, LEG4B_CHANNEL)
+
+# Set to stop the running walk; each walk gets a fresh Event
+stop_evt = Event()
+stop_evt.set()
+walk_thread = None
+_walk_lock = Lock()
+
+def _stop_walk():
+    """Stop the running walk and wait until it has written its last step."""
+    stop_evt.set()
+    if walk_thread is not None:
+        walk_thread.join()
 
 # Setup the default positions
 def setup():
     print("Setting all servos to default positions...")
     set_all_servos(DEFAULT_FORWARD_ANGLE)
 
+def set_servos_bulk(angle_map):
+    # Adjacent channels share one auto-incremented PCA9685 write
+    write_angles(kit._pca, angle_map)
+
 def set_all_servos(angle):
-    kit.servo[LEG1F_CHANNEL].angle = angle
-    kit.servo[LEG1B_CHANNEL].angle = angle
-    kit.servo[LEG2F_CHANNEL].angle = angle
-    kit.servo[LEG2B_CHANNEL].angle = angle
-    kit.servo[LEG3F_CHANNEL].angle = angle
-    kit.servo[LEG3B_CHANNEL].angle = angle
-    kit.servo[LEG4F_CHANNEL].angle = angle
-    kit.servo[LEG4B_CHANNEL].angle = angle
+    set_servos_bulk(dict.fromkeys(ALL_CHANNELS, angle))
     time.sleep(1)
 
-# Leg movement functions
-def move_leg_forward(forward_channel, backward_channel):
-    kit.servo[forward_channel].angle = FORWARD_ANGLE
-    kit.servo[backward_channel].angle = DEFAULT_BACKWARD_ANGLE
-    time.sleep(0.2)
-
-def move_leg_backward(forward_channel, backward_channel):
-    kit.servo[forward_channel].angle = DEFAULT_FORWARD_ANGLE
-    kit.servo[backward_channel].angle = BACKWARD_ANGLE
-    time.sleep(0.2)
-
 # Gait functions
-def walk_forward():
+STEP_TIME = 0.2
+LEG_FORWARD = (PULSE[FORWARD_ANGLE], PULSE[DEFAULT_BACKWARD_ANGLE])
+LEG_BACKWARD = (PULSE[DEFAULT_FORWARD_ANGLE], PULSE[BACKWARD_ANGLE])
+WALK_STEPS = [
+    (LEG1F_CHANNEL, LEG1B_CHANNEL, LEG_FORWARD),
+    (LEG4F_CHANNEL, LEG4B_CHANNEL, LEG_FORWARD),
+    (LEG2F_CHANNEL, LEG2B_CHANNEL, LEG_BACKWARD),
+    (LEG3F_CHANNEL, LEG3B_CHANNEL, LEG_BACKWARD),
+    (LEG1F_CHANNEL, LEG1B_CHANNEL, LEG_BACKWARD),
+    (LEG4F_CHANNEL, LEG4B_CHANNEL, LEG_BACKWARD),
+    (LEG2F_CHANNEL, LEG2B_CHANNEL, LEG_FORWARD),
+    (LEG3F_CHANNEL, LEG3B_CHANNEL, LEG_FORWARD),
+]
+# One (time, {channel: count}) entry per step, replayed on fixed deadlines
+WALK_EVENTS = [(i * STEP_TIME, {f: pf, b: pb}) for i, (f, b, (pf, pb)) in enumerate(WALK_STEPS)]
+WALK_CYCLE = len(WALK_STEPS) * STEP_TIME
+
+def walk_forward(stop):
     print("Walking forward...")
-    while movement_flag['forward']:
-        move_leg_forward(LEG1F_CHANNEL, LEG1B_CHANNEL)
-        move_leg_forward(LEG4F_CHANNEL, LEG4B_CHANNEL)
-        move_leg_backward(LEG2F_CHANNEL, LEG2B_CHANNEL)
-        move_leg_backward(LEG3F_CHANNEL, LEG3B_CHANNEL)
-        move_leg_backward(LEG1F_CHANNEL, LEG1B_CHANNEL)
-        move_leg_backward(LEG4F_CHANNEL, LEG4B_CHANNEL)
-        move_leg_forward(LEG2F_CHANNEL, LEG2B_CHANNEL)
-        move_leg_forward(LEG3F_CHANNEL, LEG3B_CHANNEL)
-        print("Step complete.")
+    loop_events(kit._pca, WALK_EVENTS, WALK_CYCLE, lambda: not stop.is_set())
 
 # Flask endpoints
-@app.route('/')
-def index():
-    return render_template_string('''
+HTML = '''
     <!DOCTYPE html>
     <html>
     <head>
@@ -99,18 +106,34 @@ def index():
         </script>
     </body>
     </html>
-    ''')
+    '''
+
+# HTML has no template variables, so it is encoded once instead of rendered per request
+_INDEX_BYTES = HTML.encode("utf-8")
+
+@app.route('/')
+def index():
+    resp = Response(_INDEX_BYTES, mimetype='text/html')
+    resp.headers['Cache-Control'] = 'public, max-age=3600'
+    return resp
 
 @app.route('/forward')
 def forward():
-    movement_flag['forward'] = True
-    Thread(target=walk_forward).start()
+    global stop_evt, walk_thread
+    with _walk_lock:
+        # The old walk is done before the new one starts, so they never overlap
+        _stop_walk()
+        stop_evt = Event()
+        walk_thread = Thread(target=run_realtime, args=(walk_forward, stop_evt), daemon=True)
+        walk_thread.start()
     return "Moving forward!"
 
 @app.route('/stop')
 def stop():
-    movement_flag['forward'] = False
-    set_all_servos(DEFAULT_FORWARD_ANGLE)
+    # Joined first, so no walk step lands after the neutral pose
+    with _walk_lock:
+        _stop_walk()
+        set_all_servos(DEFAULT_FORWARD_ANGLE)
     return "Stopping all movements!"
 
 if __name__ == "__main__":
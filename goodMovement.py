@@ -1,8 +1,7 @@
-import time
-from adafruit_servokit import ServoKit
+from servo_common import duty_for_angle, get_kit, loop_events, run_realtime, write_angles
 
 # Initialize ServoKit with 16 channels
-kit = ServoKit(channels=16)
+kit = get_kit()
 
 # Define servo channels
 LEG1F_CHANNEL = 1  # Front Left Forward
@@ -14,6 +13,9 @@ LEG3B_CHANNEL = 2  # Back Left Backward
 LEG4F_CHANNEL = 10 # Back Right Forward
 LEG4B_CHANNEL = 11 # Back Right Backward
 
+ALL_CHANNELS = (LEG1F_CHANNEL, LEG1B_CHANNEL, LEG2F_CHANNEL, LEG2B_CHANNEL,
+                LEG3F_CHANNEL, LEG3B_CHANNEL, LEG4F_CHANNEL, LEG4B_CHANNEL)
+
 # Default positions
 DEFAULT_FORWARD_ANGLE = 90  # Neutral position (adjust if needed)
 DEFAULT_BACKWARD_ANGLE = 90  # Neutral position (adjust if needed)
@@ -22,53 +24,39 @@ DEFAULT_BACKWARD_ANGLE = 90  # Neutral position (adjust if needed)
 FORWARD_ANGLE = 30  # Angle to move leg forward (within 0-180)
 BACKWARD_ANGLE = 150  # Angle to move leg backward (within 0-180)
 
+# Raw PCA9685 counts for the gait angles, so a step is just two register writes
+PULSE = {a: duty_for_angle(a) for a in (DEFAULT_FORWARD_ANGLE, DEFAULT_BACKWARD_ANGLE, FORWARD_ANGLE, BACKWARD_ANGLE)}
+
 def setup():
     """Initialize default servo positions."""
     set_all_servos(DEFAULT_FORWARD_ANGLE)
 
+def set_servos_bulk(angle_map):
+    """Set several servos at once; adjacent channels share one I2C write."""
+    write_angles(kit._pca, angle_map)
+
 def set_all_servos(angle):
     """Set all servos to the same angle."""
-    kit.servo[LEG1F_CHANNEL].angle = angle
-    kit.servo[LEG1B_CHANNEL].angle = angle
-    kit.servo[LEG2F_CHANNEL].angle = angle
-    kit.servo[LEG2B_CHANNEL].angle = angle
-    kit.servo[LEG3F_CHANNEL].angle = angle
-    kit.servo[LEG3B_CHANNEL].angle = angle
-    kit.servo[LEG4F_CHANNEL].angle = angle
-    kit.servo[LEG4B_CHANNEL].angle = angle
-
-def move_leg_forward(forward_channel, backward_channel):
-    """Move a single leg forward."""
-    kit.servo[forward_channel].angle = FORWARD_ANGLE
-    kit.servo[backward_channel].angle = DEFAULT_BACKWARD_ANGLE
-    time.sleep(0.1)  # Adjust delay for smoother movement
-
-def move_leg_backward(forward_channel, backward_channel):
-    """Move a single leg backward."""
-    kit.servo[forward_channel].angle = DEFAULT_FORWARD_ANGLE
-    kit.servo[backward_channel].angle = BACKWARD_ANGLE
-    time.sleep(0.1)
-
-def walk_forward():
-    """Make the robot walk forward with a simple gait."""
-    # Step 1: Move Front Left and Back Right forward
-    move_leg_forward(LEG1F_CHANNEL, LEG1B_CHANNEL)
-    move_leg_forward(LEG4F_CHANNEL, LEG4B_CHANNEL)
-
-    # Step 2: Move Front Right and Back Left backward
-    move_leg_backward(LEG2F_CHANNEL, LEG2B_CHANNEL)
-    move_leg_backward(LEG3F_CHANNEL, LEG3B_CHANNEL)
-
-    # Step 3: Move Front Left and Back Right backward
-    move_leg_backward(LEG1F_CHANNEL, LEG1B_CHANNEL)
-    move_leg_backward(LEG4F_CHANNEL, LEG4B_CHANNEL)
-
-    # Step 4: Move Front Right and Back Left forward
-    move_leg_forward(LEG2F_CHANNEL, LEG2B_CHANNEL)
-    move_leg_forward(LEG3F_CHANNEL, LEG3B_CHANNEL)
+    set_servos_bulk(dict.fromkeys(ALL_CHANNELS, angle))
+
+STEP_TIME = 0.1
+LEG_FORWARD = (PULSE[FORWARD_ANGLE], PULSE[DEFAULT_BACKWARD_ANGLE])
+LEG_BACKWARD = (PULSE[DEFAULT_FORWARD_ANGLE], PULSE[BACKWARD_ANGLE])
+# The simple gait as a (time, {channel: count}) schedule on fixed deadlines:
+# diagonal pairs (1+4, 2+3) step forward and back in turn
+WALK_EVENTS = [(i * STEP_TIME, {f: pf, b: pb}) for i, (f, b, (pf, pb)) in enumerate([
+    (LEG1F_CHANNEL, LEG1B_CHANNEL, LEG_FORWARD),   # Step 1
+    (LEG4F_CHANNEL, LEG4B_CHANNEL, LEG_FORWARD),
+    (LEG2F_CHANNEL, LEG2B_CHANNEL, LEG_BACKWARD),  # Step 2
+    (LEG3F_CHANNEL, LEG3B_CHANNEL, LEG_BACKWARD),
+    (LEG1F_CHANNEL, LEG1B_CHANNEL, LEG_BACKWARD),  # Step 3
+    (LEG4F_CHANNEL, LEG4B_CHANNEL, LEG_BACKWARD),
+    (LEG2F_CHANNEL, LEG2B_CHANNEL, LEG_FORWARD),   # Step 4
+    (LEG3F_CHANNEL, LEG3B_CHANNEL, LEG_FORWARD),
+])]
+WALK_CYCLE = len(WALK_EVENTS) * STEP_TIME
 
 if __name__ == "__main__":
     setup()
     print("Starting to walk forward...")
-    while True:
-        walk_forward()
+    run_realtime(loop_events, kit._pca, WALK_EVENTS, WALK_CYCLE, lambda: True)
@@ -1,42 +1,200 @@
-from flask import Flask, render_template_string, request, jsonify
-from threading import Thread
+from flask import Flask, Response, request, jsonify
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread, get_ident, local
 import time
 import os
+import io
+import json
+import hashlib
+import queue
 import re
 import subprocess
-import tempfile
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from adafruit_servokit import ServoKit
 from gtts import gTTS
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from functools import lru_cache
+from servo_common import (angle_of, duty_for_angle, get_kit, merge_events, sleep_until,
+                          write_angles, write_channels)
+
+# Optional: streaming voice over WebSocket (browser -> here -> Deepgram).
+# Without these, the page falls back to uploading the clip to /voice_ask.
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+try:
+    from websockets.sync.client import connect as ws_connect
+except ImportError:
+    ws_connect = None
+try:
+    from faster_whisper import WhisperModel
+except ImportError:
+    WhisperModel = None
+
 # ===================== Keys / Config =====================
 DEEPGRAM_API_KEY = os.environ.get("DEEPGRAM_API_KEY")
 if not DEEPGRAM_API_KEY:
     print("[WARN] DEEPGRAM_API_KEY not set; set it with: export DEEPGRAM_API_KEY='YOUR_KEY'")
 
+# ===================== HTTP sessions =====================
+def _make_session() -> requests.Session:
+    """Session with a keep-alive pool so repeat calls skip the TCP/TLS handshake."""
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry))
+    return session
+
+_DG_SESSION = _make_session()
+if DEEPGRAM_API_KEY:
+    _DG_SESSION.headers["Authorization"] = f"Token {DEEPGRAM_API_KEY}"
+
+DG_URL = "https://api.deepgram.com/v1/listen"
+# Model/params chosen for general English, punctuation, and formatting.
+_DG_PARAMS = {
+    "model": "nova-2",
+    "smart_format": "true",
+    "language": "en-US",
+    "punctuate": "true"
+}
+
 # OpenAI client (uses the modern SDK)
 try:
     from openai import OpenAI
-    _openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    # One retry instead of the SDK's two keeps a failing call's tail short
+    _openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=1)
 except Exception as e:
     _openai_client = None
     print("OpenAI client not available:", e)
 
 # ===================== TTS =====================
-def speak_async(text: str):
-    """Speak text in the background using gTTS + mpg123."""
-    if not text:
+# Synthesized MP3s are kept on disk keyed by a hash of (lang, text), so a
+# repeated reply skips the gTTS round trip. The index lives in memory, so a
+# hit costs no stat() either.
+TTS_CACHE_DIR = os.path.expanduser(
+    os.environ.get("TTS_CACHE_DIR", os.path.join("~", ".cache", "robot_tts"))
+)
+TTS_CACHE_MAX = 200
+
+_tts_cache = OrderedDict()   # key -> mp3 path, least recently used first
+_tts_cache_lock = Lock()
+
+def _load_tts_cache():
+    try:
+        os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+        entries = sorted(os.scandir(TTS_CACHE_DIR), key=lambda e: e.stat().st_mtime)
+    except OSError as e:
+        print("TTS cache unavailable:", e)
         return
-    def _run():
+    for e in entries:
+        if e.name.endswith('.mp3'):
+            _tts_cache[e.name[:-4]] = e.path
+
+_load_tts_cache()
+
+def tts_cached_path(text: str, lang: str = 'en') -> str:
+    """Return an MP3 of text, synthesizing it with gTTS only on a cache miss."""
+    key = hashlib.sha256(f"{lang}\0{text}".encode()).hexdigest()
+    with _tts_cache_lock:
+        path = _tts_cache.get(key)
+        if path:
+            _tts_cache.move_to_end(key)
+            return path
+    path = os.path.join(TTS_CACHE_DIR, key + '.mp3')
+    tmp = f"{path}.{get_ident()}.tmp"
+    gTTS(text=text, lang=lang).save(tmp)
+    os.replace(tmp, path)  # never leave a half-written mp3 under the real name
+    with _tts_cache_lock:
+        _tts_cache[key] = path
+        while len(_tts_cache) > TTS_CACHE_MAX:
+            _, old = _tts_cache.popitem(last=False)
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return path
+
+# One resident mpg123 decoding MP3s from its stdin, so a reply costs a pipe
+# write instead of a fork/exec and decoder start-up. A single worker feeds it,
+# so replies play in the order they were queued.
+_mpg123 = None
+_mpg123_lock = Lock()
+_tts_queue = queue.Queue()  # (epoch, text) for the TTS worker, in order
+_tts_epoch = 0              # bumped by stop_speaking(); older entries are dropped
+
+def _player():
+    """The running mpg123, (re)started if it is missing or has exited. Call under _mpg123_lock."""
+    global _mpg123
+    if _mpg123 is None or _mpg123.poll() is not None:
+        _mpg123 = subprocess.Popen(['mpg123', '-q', '-'], stdin=subprocess.PIPE,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return _mpg123
+
+def _play_mp3(data: bytes, epoch=None):
+    """Queue MP3 bytes on the resident player, respawning it once if the pipe broke."""
+    global _mpg123
+    with _mpg123_lock:
+        for attempt in range(2):
+            try:
+                proc = _player()
+                proc.stdin.write(data)
+                proc.stdin.flush()
+                return
+            except BrokenPipeError:
+                proc.kill()
+                _mpg123 = None
+                if epoch is not None and epoch != _tts_epoch:
+                    return  # cut off by stop_speaking(), not a dead player
+                if attempt:
+                    raise
+
+def _tts_worker():
+    while True:
+        epoch, text = _tts_queue.get()
+        if epoch != _tts_epoch:
+            continue
         try:
-            tts = gTTS(text=text, lang='en')
-            with tempfile.NamedTemporaryFile(delete=True, suffix='.mp3') as fp:
-                tts.save(fp.name)
-                subprocess.run(['mpg123', fp.name],
-                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            with open(tts_cached_path(text), 'rb') as f:
+                data = f.read()
+            if epoch == _tts_epoch:
+                _play_mp3(data, epoch)
         except Exception as e:
             print("TTS error:", e)
+
+def speak_async(text: str):
+    """Queue text for the TTS worker; replies play in the order queued."""
+    if text:
+        _tts_queue.put((_tts_epoch, text))
+
+def stop_speaking():
+    """Drop queued replies and cut off the one playing."""
+    global _tts_epoch
+    _tts_epoch += 1
+    while True:
+        try:
+            _tts_queue.get_nowait()
+        except queue.Empty:
+            break
+    proc = _mpg123
+    if proc is not None:
+        proc.kill()  # the worker's pending write fails and _player() respawns it
+
+def _prewarm_tts():
+    def _run():
+        for text in CANNED_REPLIES:
+            try:
+                tts_cached_path(text)
+            except Exception as e:
+                print("TTS prewarm error:", e)
+                return
     Thread(target=_run, daemon=True).start()
 
 # ===================== Language model =====================
@@ -63,28 +221,21 @@ def lm_reply(user_text: str) -> str:
         return f"Error contacting language model: {e}"
 
 # ===================== Deepgram STT =====================
-def deepgram_transcribe(audio_bytes: bytes, mimetype: str = "audio/webm") -> str:
+def deepgram_transcribe(audio, mimetype: str = "audio/webm") -> str:
     """
-    Send audio bytes to Deepgram's /v1/listen endpoint and return the transcript text.
+    Send audio (bytes or a file-like object) to Deepgram's /v1/listen endpoint
+    and return the transcript text. File-like audio is streamed from where it
+    lies instead of being read into memory first. With USE_LOCAL_STT=1 the
+    clip is transcribed on the Pi instead.
     """
+    if _local_stt is not None:
+        return local_transcribe(audio)
     if not DEEPGRAM_API_KEY:
         return ""
 
-    url = "https://api.deepgram.com/v1/listen"
-    headers = {
-        "Authorization": f"Token {DEEPGRAM_API_KEY}",
-        "Content-Type": mimetype
-    }
-    # Model/params chosen for general English, punctuation, and formatting.
-    params = {
-        "model": "nova-2",
-        "smart_format": "true",
-        "language": "en-US",
-        "punctuate": "true"
-    }
-
     try:
-        r = requests.post(url, headers=headers, params=params, data=audio_bytes, timeout=30)
+        r = _DG_SESSION.post(DG_URL, headers={"Content-Type": mimetype}, params=_DG_PARAMS,
+                             data=audio, timeout=30)
         r.raise_for_status()
         jd = r.json()
 
@@ -105,9 +256,87 @@ def deepgram_transcribe(audio_bytes: bytes, mimetype: str = "audio/webm") -> str
         print("Deepgram error:", e)
         return ""
 
+# ===================== Local STT (optional) =====================
+# USE_LOCAL_STT=1 transcribes on the Pi with faster-whisper (CTranslate2,
+# int8 weights) instead of Deepgram: no Internet hop, and tiny.en runs at
+# about real time on a Pi 5, which beats the round trip for short clips.
+USE_LOCAL_STT = os.environ.get("USE_LOCAL_STT") == "1"
+LOCAL_STT_MODEL = os.environ.get("LOCAL_STT_MODEL", "tiny.en")
+_local_stt = None
+
+def _load_local_stt():
+    global _local_stt
+    if not USE_LOCAL_STT or _local_stt is not None:
+        return
+    if WhisperModel is None:
+        print("[WARN] USE_LOCAL_STT=1 but faster-whisper is not installed; using Deepgram")
+        return
+    _local_stt = WhisperModel(LOCAL_STT_MODEL, device="cpu", compute_type="int8")
+
+def local_transcribe(audio) -> str:
+    """Transcribe audio (bytes or a file-like object) with the local Whisper model."""
+    if isinstance(audio, (bytes, bytearray)):
+        audio = io.BytesIO(audio)
+    try:
+        segments, _ = _local_stt.transcribe(audio, language="en", vad_filter=True)
+        return " ".join(seg.text.strip() for seg in segments).strip()
+    except Exception as e:
+        print("Local STT error:", e)
+        return ""
+
+# ===================== Deepgram streaming STT =====================
+DG_STREAM_URL = ("wss://api.deepgram.com/v1/listen?model=nova-2&language=en-US"
+                 "&punctuate=true&smart_format=true&interim_results=true")
+VOICE_MAX_SECONDS = 30  # audio relayed per utterance; the rest is dropped
+
+def _relay_audio(ws, dg, done):
+    """Browser -> Deepgram: forward audio chunks until Stop, the time cap, or an early command."""
+    deadline = time.monotonic() + VOICE_MAX_SECONDS
+    try:
+        while not done.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            data = ws.receive(timeout=min(remaining, 0.5))
+            if data is None:
+                continue
+            if isinstance(data, str):  # "stop" from the page
+                break
+            dg.send(data)
+    except Exception:
+        pass
+    finally:
+        try:
+            dg.send(json.dumps({"type": "CloseStream"}))
+        except Exception:
+            pass
+
+def _stream_transcript(ws, dg) -> str:
+    """Deepgram -> transcript: join final segments, returning early at the first robot command."""
+    done = Event()
+    Thread(target=_relay_audio, args=(ws, dg, done), daemon=True).start()
+    finals = []
+    try:
+        for msg in dg:
+            jd = json.loads(msg)
+            if not jd.get("is_final"):
+                continue
+            seg = jd["channel"]["alternatives"][0]["transcript"].strip()
+            if seg:
+                finals.append(seg)
+                # Only final segments count, so a command never fires on an interim guess
+                if parse_robot_command(" ".join(finals)):
+                    break
+    except Exception as e:
+        print("Deepgram stream error:", e)
+    finally:
+        done.set()
+    return " ".join(finals)
+
 # ===================== Flask & ServoKit =====================
 app = Flask(__name__)
-kit = ServoKit(channels=16)
+sock = Sock(app) if Sock else None
+kit = get_kit()
 
 # ===================== Channel Mapping (your wiring) =====================
 LEG1F_CHANNEL = 0   # Front Left - HIP (forward/back swing)
@@ -132,8 +361,13 @@ DIAG_A = [(LF_HIP, LF_KNEE), (RR_HIP, RR_KNEE)]  # LF + RR
 DIAG_B = [(RF_HIP, RF_KNEE), (LR_HIP, LR_KNEE)]  # RF + LR
 
 # ===================== Tuning (angles & inversion) =====================
-INVERT_HIP  = {LF_HIP: False, RF_HIP: True,  LR_HIP: False, RR_HIP: True}
-INVERT_KNEE = {LF_KNEE: False, RF_KNEE: True, LR_KNEE: False, RR_KNEE: True}
+# Per-channel servo state is kept as flat 16-entry tables indexed by PCA9685
+# channel (hips and knees never share a channel, so one table covers both).
+# True mirrors the angle (180 - a).
+INVERT = tuple(ch in (RF_HIP, RR_HIP, RF_KNEE, RR_KNEE) for ch in range(16))
+# raw = offset + sign * angle: (0, 1) passes through, (180, -1) mirrors
+_INVERT_OFFSET = array('h', (180 if inv else 0 for inv in INVERT))
+_INVERT_SIGN   = array('b', (-1 if inv else 1 for inv in INVERT))
 
 HIP_NEUTRAL = 90
 HIP_FWD     = 65     # forward (protraction) — only while the foot is lifted
@@ -150,81 +384,209 @@ RAMP_DELAY  = 0.01
 DWELL       = 0.12
 TROT_DWELL  = 0.12
 
-# ===================== Movement flags =====================
-movement_flag = {
-    'forward':   False,
-    'backward':  False,
-    'left':      False,
-    'right':     False,
-    'trot':      False,
-    'trot_sync': False,
-}
+# ===================== Gait runner =====================
+# One long-lived thread owns the servos. Routes post (gait, epoch) and bump
+# the epoch; a running loop notices at its next phase boundary, parks, and
+# the runner takes the newest command. Only the latest request matters, so
+# the queue holds one entry.
+_gait_q = queue.Queue(maxsize=1)
+_gait_epoch = 0
+_gait_lock = Lock()
+
+def _gait_runner():
+    while True:
+        gait, epoch, done = _gait_q.get()
+        try:
+            if epoch == _gait_epoch:
+                gait(epoch)
+        except Exception as e:
+            print("Gait error:", e)
+        finally:
+            done.set()
+
+def _run_gait(gait):
+    """Make gait(epoch) the robot's next motion; returns an Event set once it has finished."""
+    global _gait_epoch
+    done = Event()
+    with _gait_lock:
+        _gait_epoch += 1
+        try:
+            _gait_q.get_nowait()[2].set()  # superseded before it started
+        except queue.Empty:
+            pass
+        _gait_q.put_nowait((gait, _gait_epoch, done))
+    return done
 
 # ===================== Low-level helpers (with inversion) =====================
-def _apply_invert(ch, angle, invert_map):
-    return 180 - angle if invert_map.get(ch, False) else angle
-
-def _current_angle(ch, default_raw, invert_map):
-    a = kit.servo[ch].angle
-    return int(a) if a is not None else _apply_invert(ch, default_raw, invert_map)
-
-def _ramp_to(ch, target_raw, invert_map, step=RAMP_STEP, delay=RAMP_DELAY):
-    target = _apply_invert(ch, target_raw, invert_map)
-    cur = _current_angle(ch, target_raw, invert_map)
+def _apply_invert(ch, angle):
+    return _INVERT_OFFSET[ch] + _INVERT_SIGN[ch] * angle
+
+# Raw angle each channel was last ramped to, None until this process moves it
+_last_angle = [None] * 16
+
+def _current_angle(ch, default_raw):
+    a = _last_angle[ch]
+    if a is not None:
+        return a
+    # First move of this channel: decode the register shadow. The shadow is
+    # read once per process and the first write needs it anyway, so this adds
+    # no I2C traffic; every later ramp starts from _last_angle.
+    a = angle_of(kit._pca, ch)
+    return int(a) if a is not None else _apply_invert(ch, default_raw)
+
+def _write_angles(angles):
+    """Write {channel: angle} straight to the PCA9685, one burst per run of adjacent channels."""
+    write_angles(kit._pca, angles)
+
+# Ramps sleep to absolute deadlines (t0 + i*delay), so write time and sleep
+# overshoot never add up over a ramp. Each returns the time it was due to
+# end, for _dwell_after.
+def _ramp_to(ch, target_raw, step=RAMP_STEP, delay=RAMP_DELAY):
+    target = _apply_invert(ch, target_raw)
+    cur = _current_angle(ch, target_raw)
+    _last_angle[ch] = target
+    t0 = time.monotonic()
     if cur == target:
-        kit.servo[ch].angle = target
-        return
+        _write_angles({ch: target})
+        return t0
     sgn = 1 if target > cur else -1
-    for a in range(cur, target, sgn * step):
-        kit.servo[ch].angle = a
-        time.sleep(delay)
-    kit.servo[ch].angle = target
-
-def _ramp_sync(ch_list, target_raw_list, invert_map, step=RAMP_STEP, delay=RAMP_DELAY):
-    curs = []
-    targs = []
-    for ch, t_raw in zip(ch_list, target_raw_list):
-        t = _apply_invert(ch, t_raw, invert_map)
-        c = _current_angle(ch, t_raw, invert_map)
-        curs.append(c)
-        targs.append(t)
-
-    deltas = [abs(t - c) for c, t in zip(curs, targs)]
-    max_steps = 0 if not deltas else max((d + step - 1) // step for d in deltas)
-
+    for i, a in enumerate(range(cur, target, sgn * step), 1):
+        _write_angles({ch: a})
+        sleep_until(t0 + i * delay)
+    _write_angles({ch: target})
+    return t0 + i * delay
+
+@lru_cache(maxsize=512)
+def _plan_ramp(ch_list, curs, targs, step):
+    """Every tick's {channel: count} write for a synchronized ramp, the last tick landing on targs.
+
+    Gaits repeat the same few moves, so after the first cycle the plan comes
+    straight from the cache. Callers must not mutate it.
+    """
+    curs = list(curs)
+    max_steps = max(((abs(t - c) + step - 1) // step for c, t in zip(curs, targs)), default=0)
+    ticks = []
     for _ in range(max_steps):
+        tick = {}
         for idx, ch in enumerate(ch_list):
             c = curs[idx]; t = targs[idx]
             if c == t:
                 continue
             sgn = 1 if t > c else -1
-            move = min(step, abs(t - c))
-            c_new = c + sgn * move
-            kit.servo[ch].angle = c_new
-            curs[idx] = c_new
-        time.sleep(delay)
-
+            c += sgn * min(step, abs(t - c))
+            tick[ch] = duty_for_angle(c, ch)
+            curs[idx] = c
+        ticks.append(tick)
+    ticks.append({ch: duty_for_angle(t, ch) for ch, t in zip(ch_list, targs)})
+    return tuple(ticks)
+
+def _ramp_sync(ch_list, target_raw_list, step=RAMP_STEP, delay=RAMP_DELAY):
+    ch_list = tuple(ch_list)
+    targs = tuple(_apply_invert(ch, t) for ch, t in zip(ch_list, target_raw_list))
+    curs = tuple(_current_angle(ch, t) for ch, t in zip(ch_list, target_raw_list))
+    plan = _plan_ramp(ch_list, curs, targs, step)
     for ch, t in zip(ch_list, targs):
-        kit.servo[ch].angle = t
-
-def set_hip(ch, angle):  _ramp_to(ch, angle, INVERT_HIP)
-def set_knee(ch, angle): _ramp_to(ch, angle, INVERT_KNEE)
+        _last_angle[ch] = t
+
+    if getattr(_rec, "events", None) is not None:
+        t0 = _rec.clock
+        _rec.events.extend((t0 + i * delay, tick) for i, tick in enumerate(plan))
+        _rec.clock = t0 + (len(plan) - 1) * delay
+        return _rec.clock
+
+    # Every channel that moves this tick goes out in the same I2C burst
+    t0 = time.monotonic()
+    for i, tick in enumerate(plan[:-1], 1):
+        write_channels(kit._pca, tick)
+        sleep_until(t0 + i * delay)
+    write_channels(kit._pca, plan[-1])
+    return t0 + (len(plan) - 1) * delay
+
+def _prewarm_ramps():
+    """Plan the gaits' whole-group pose-to-pose moves up front, off the first gait's path."""
+    hips = (HIP_NEUTRAL, HIP_FWD, HIP_BACK, (HIP_NEUTRAL + HIP_BACK) // 2)
+    knees = (KNEE_DOWN, KNEE_UP, KNEE_DOWN + PRESS_DELTA, KNEE_DOWN + LIGHTEN_DELTA)
+    groups = [(ALL_HIPS, hips), (ALL_KNEES, knees)]
+    for pair in (DIAG_A, DIAG_B):
+        groups.append(([h for h, _ in pair], hips))
+        groups.append(([k for _, k in pair], knees))
+    for chs, poses in groups:
+        chs = tuple(chs)
+        for cur in poses:
+            for targ in poses:
+                _plan_ramp(chs, tuple(_apply_invert(ch, cur) for ch in chs),
+                           tuple(_apply_invert(ch, targ) for ch in chs), RAMP_STEP)
+
+def _dwell_after(end, seconds):
+    """Sleep until seconds after a ramp was due to end; a late ramp eats into the dwell."""
+    if getattr(_rec, "events", None) is not None:
+        _rec.clock = end + seconds
+        return
+    sleep_until(end + seconds)
+
+# ===================== Compiled gait steps =====================
+# A gait step built only from _ramp_sync and _dwell_after always writes the
+# same counts at the same offsets for a given start pose. _compile_step runs
+# it once against a virtual clock (_rec) to record that schedule; the loop
+# then just replays it: sleep to each deadline, write one burst.
+_rec = local()
+_PAIRS = (DIAG_A, DIAG_B)
+_GAIT_CHANNELS = tuple(ALL_HIPS + ALL_KNEES)
+
+def _pose():
+    return tuple(_last_angle[ch] for ch in _GAIT_CHANNELS)
+
+def _tuning():
+    """Every constant a compiled step depends on, so retuning misses the cache."""
+    return (RAMP_STEP, RAMP_DELAY, TROT_DWELL, HIP_NEUTRAL, HIP_FWD, HIP_BACK,
+            KNEE_DOWN, KNEE_UP, PRESS_DELTA, LIGHTEN_DELTA)
+
+@lru_cache(maxsize=64)
+def _compile_step(step, swing, start_pose, tuning):
+    """(events, duration, end pose) of step(stance_pair, swing_pair) from start_pose."""
+    saved = _last_angle[:]
+    for ch, a in zip(_GAIT_CHANNELS, start_pose):
+        _last_angle[ch] = a
+    _rec.clock, _rec.events = 0.0, []
+    try:
+        step(_PAIRS[1 - swing], _PAIRS[swing])
+        return tuple(merge_events(_rec.events)), _rec.clock, _pose()
+    finally:
+        _rec.events = None
+        _last_angle[:] = saved
+
+def _run_compiled(step, epoch, swing=1):
+    """Replay step on alternating diagonals from compiled schedules until the epoch moves on."""
+    t0 = time.monotonic()
+    while _gait_epoch == epoch:
+        events, duration, end = _compile_step(step, swing, _pose(), _tuning())
+        for t, duties in events:
+            sleep_until(t0 + t)
+            write_channels(kit._pca, duties)
+        for ch, a in zip(_GAIT_CHANNELS, end):
+            _last_angle[ch] = a
+        # An overrun restarts the clock instead of rushing the next step
+        t0 = max(t0 + duration, time.monotonic())
+        swing ^= 1
+
+def set_hip(ch, angle):  return _ramp_to(ch, angle)
+def set_knee(ch, angle): return _ramp_to(ch, angle)
 
 def set_hip_pair(pair, angle):
     chs = [pair[0][0], pair[1][0]]
     tgs = [angle, angle]
-    _ramp_sync(chs, tgs, INVERT_HIP)
+    return _ramp_sync(chs, tgs)
 
 def set_knee_pair(pair, angle):
     chs = [pair[0][1], pair[1][1]]
     tgs = [angle, angle]
-    _ramp_sync(chs, tgs, INVERT_KNEE)
+    return _ramp_sync(chs, tgs)
 
 def set_hips_all_sync(angle):
-    _ramp_sync(ALL_HIPS, [angle]*4, INVERT_HIP)
+    return _ramp_sync(ALL_HIPS, [angle]*4)
 
 def set_knees_all_sync(angle):
-    _ramp_sync(ALL_KNEES, [angle]*4, INVERT_KNEE)
+    return _ramp_sync(ALL_KNEES, [angle]*4)
 
 # ===================== Posture helpers =====================
 def plant_all():
@@ -251,28 +613,31 @@ def leg_push_forward(hip, knee):   set_hip(hip, HIP_FWD)
 def weight_shift_for_pair(swing_pair):
     stance_pair = DIAG_B if swing_pair == DIAG_A else DIAG_A
     set_knee_pair(stance_pair, KNEE_DOWN + PRESS_DELTA)
-    set_knee_pair(swing_pair,   KNEE_DOWN + LIGHTEN_DELTA)
-    time.sleep(TROT_DWELL)
+    _dwell_after(set_knee_pair(swing_pair, KNEE_DOWN + LIGHTEN_DELTA), TROT_DWELL)
 
 def clear_weight_shift():
     set_knees_all_sync(KNEE_DOWN)
 
 # ===================== Diagnostics =====================
+# Queued through the gait runner like the single-cycle routes, so a
+# diagnostic never interleaves writes with a running gait
 @app.route('/diag/neutral')
 def diag_neutral():
-    setup()
+    _run_gait(lambda epoch: setup()).wait()
     return "Neutral: hips 90, knees down."
 
-@app.route('/diag/lf_push')
-def diag_lf_push():
+def _lf_push(epoch):
     leg_lower(LF_HIP, LF_KNEE); time.sleep(0.2)
     leg_push_back(LF_HIP, LF_KNEE); time.sleep(0.6)
     set_hip(LF_HIP, HIP_FWD); time.sleep(0.4)
     set_hip(LF_HIP, HIP_NEUTRAL)
+
+@app.route('/diag/lf_push')
+def diag_lf_push():
+    _run_gait(_lf_push).wait()
     return "LF push test complete."
 
-@app.route('/diag/lf_step')
-def diag_lf_step():
+def _lf_step(epoch):
     weight_shift_for_pair(DIAG_B)
     leg_lift(LF_HIP, LF_KNEE);               time.sleep(DWELL)
     leg_swing_forward(LF_HIP, LF_KNEE);      time.sleep(DWELL + 0.1)
@@ -280,13 +645,17 @@ def diag_lf_step():
     clear_weight_shift()
     leg_push_back(LF_HIP, LF_KNEE);          time.sleep(DWELL + 0.2)
     set_hip(LF_HIP, HIP_NEUTRAL)
+
+@app.route('/diag/lf_step')
+def diag_lf_step():
+    _run_gait(_lf_step).wait()
     return "LF weighted step done."
 
 # ===================== Crawl gait =====================
 def setup_pose_bias_back():
     plant_all()
     hips_all(HIP_NEUTRAL)
-    _ramp_sync(ALL_HIPS, [ (HIP_NEUTRAL + HIP_BACK)//2 ]*4, INVERT_HIP)
+    _ramp_sync(ALL_HIPS, [ (HIP_NEUTRAL + HIP_BACK)//2 ]*4)
     time.sleep(0.2)
 
 def swing_forward_sequence(hip, knee):
@@ -319,78 +688,75 @@ def crawl_step_backward(order):
         swing_backward_sequence(hip, knee)
         stance_push_all_forward()
 
-def walk_forward_loop():
+def walk_forward_loop(epoch):
     print("BD‑inspired crawl (forward)")
     setup_pose_bias_back()
     order = [(LF_HIP, LF_KNEE), (RR_HIP, RR_KNEE), (RF_HIP, RF_KNEE), (LR_HIP, LR_KNEE)]
-    while movement_flag['forward']:
+    while _gait_epoch == epoch:
         crawl_step_forward(order)
     setup(); print("Forward stopped.")
 
-def walk_backward_loop():
+def walk_backward_loop(epoch):
     print("BD‑inspired crawl (backward)")
     setup_pose_bias_back()
     order = [(LF_HIP, LF_KNEE), (RR_HIP, RR_KNEE), (RF_HIP, RF_KNEE), (LR_HIP, LR_KNEE)]
-    while movement_flag['backward']:
+    while _gait_epoch == epoch:
         crawl_step_backward(order)
     setup(); print("Backward stopped.")
 
 # ===================== STRICTLY-SYNCHRONIZED TROT =====================
 def trot_step_forward_sync(stance_pair, swing_pair):
     weight_shift_for_pair(swing_pair)
-    set_knee_pair(swing_pair, KNEE_UP); time.sleep(TROT_DWELL)
-    set_hip_pair(swing_pair, HIP_FWD);  time.sleep(TROT_DWELL)
-    set_knee_pair(swing_pair, KNEE_DOWN); time.sleep(TROT_DWELL)
+    _dwell_after(set_knee_pair(swing_pair, KNEE_UP), TROT_DWELL)
+    _dwell_after(set_hip_pair(swing_pair, HIP_FWD), TROT_DWELL)
+    _dwell_after(set_knee_pair(swing_pair, KNEE_DOWN), TROT_DWELL)
     clear_weight_shift()
-    set_hips_all_sync(HIP_BACK); time.sleep(TROT_DWELL)
+    _dwell_after(set_hips_all_sync(HIP_BACK), TROT_DWELL)
 
-def trot_forward_loop_sync():
+def trot_forward_loop_sync(epoch):
     print("Diagonal‑pair LOCKSTEP trot (forward): A supports while B swings, then alternate.")
     setup_pose_bias_back()
-    stance, swing = DIAG_A, DIAG_B
-    while movement_flag['trot_sync']:
-        trot_step_forward_sync(stance, swing)
-        stance, swing = swing, stance
+    _run_compiled(trot_step_forward_sync, epoch)  # DIAG_B swings first
     setup(); print("Trot (sync) stopped.")
 
 # (Legacy non-locked trot)
 def trot_step_forward(stance_pair, swing_pair):
     weight_shift_for_pair(swing_pair)
     set_knee_pair(swing_pair, KNEE_UP); time.sleep(TROT_DWELL)
-    _ramp_sync([swing_pair[0][0], swing_pair[1][0]], [HIP_FWD, HIP_FWD], INVERT_HIP)
+    _ramp_sync([swing_pair[0][0], swing_pair[1][0]], [HIP_FWD, HIP_FWD])
     time.sleep(TROT_DWELL)
     set_knee_pair(swing_pair, KNEE_DOWN); time.sleep(TROT_DWELL)
     clear_weight_shift()
     set_hips_all_sync(HIP_BACK); time.sleep(TROT_DWELL)
 
-def trot_forward_loop():
+def trot_forward_loop(epoch):
     print("Diagonal‑pair trot (forward)")
     setup_pose_bias_back()
     stance, swing = DIAG_A, DIAG_B
-    while movement_flag['trot']:
+    while _gait_epoch == epoch:
         trot_step_forward(stance, swing)
         stance, swing = swing, stance
     setup(); print("Trot stopped.")
 
 # ===================== Simple in‑place turn =====================
-def turn_left_loop():
+def turn_left_loop(epoch):
     print("Turning left (in place)...")
     plant_all(); hips_all(HIP_NEUTRAL); time.sleep(0.2)
-    while movement_flag['left']:
+    while _gait_epoch == epoch:
         _ramp_sync([LF_HIP, LR_HIP, RF_HIP, RR_HIP],
-                   [HIP_BACK, HIP_BACK, HIP_FWD, HIP_FWD], INVERT_HIP)
+                   [HIP_BACK, HIP_BACK, HIP_FWD, HIP_FWD])
         time.sleep(DWELL)
         set_knee(RF_KNEE, KNEE_UP); time.sleep(DWELL*0.6); set_knee(RF_KNEE, KNEE_DOWN)
         set_knee(LR_KNEE, KNEE_UP); time.sleep(DWELL*0.6); set_knee(LR_KNEE, KNEE_DOWN)
         hips_all(HIP_NEUTRAL); time.sleep(DWELL*0.5)
     setup(); print("Left turn stopped.")
 
-def turn_right_loop():
+def turn_right_loop(epoch):
     print("Turning right (in place)...")
     plant_all(); hips_all(HIP_NEUTRAL); time.sleep(0.2)
-    while movement_flag['right']:
+    while _gait_epoch == epoch:
         _ramp_sync([RF_HIP, RR_HIP, LF_HIP, LR_HIP],
-                   [HIP_BACK, HIP_BACK, HIP_FWD, HIP_FWD], INVERT_HIP)
+                   [HIP_BACK, HIP_BACK, HIP_FWD, HIP_FWD])
         time.sleep(DWELL)
         set_knee(LF_KNEE, KNEE_UP); time.sleep(DWELL*0.6); set_knee(LF_KNEE, KNEE_DOWN)
         set_knee(RR_KNEE, KNEE_UP); time.sleep(DWELL*0.6); set_knee(RR_KNEE, KNEE_DOWN)
@@ -398,29 +764,61 @@ def turn_right_loop():
     setup(); print("Right turn stopped.")
 
 # ===================== Natural-language command parsing =====================
-COMMAND_PATTERNS = [
-    (r'\b(stop|halt|park)\b',                        lambda: ('stop',)),
-    (r'\b(trot sync|sync trot|locked trot)\b',       lambda: ('trot_sync',)),
-    (r'\b(trot)\b',                                  lambda: ('trot',)),
-    (r'\bforward\b',                                 lambda: ('forward',)),
-    (r'\bbackward|reverse\b',                        lambda: ('backward',)),
-    (r'\bleft\b',                                    lambda: ('left',)),
-    (r'\bright\b',                                   lambda: ('right',)),
-    (r'\bneutral|home|reset\b',                      lambda: ('diag/neutral',)),
-]
+# One compiled pass over the text. Each alternative is a lookahead anchored at
+# the start, so the first alternative that matches anywhere wins, like the
+# old ordered pattern list.
+_CMD_ALTERNATIVES = (
+    ('stop',      r'\b(?:stop|halt|park)\b'),
+    ('trot_sync', r'\b(?:trot sync|sync trot|locked trot)\b'),
+    ('trot',      r'\btrot\b'),
+    ('forward',   r'\bforward\b'),
+    ('backward',  r'\bbackward|reverse\b'),
+    ('left',      r'\bleft\b'),
+    ('right',     r'\bright\b'),
+    ('neutral',   r'\bneutral|home|reset\b'),
+)
+_CMD_RE = re.compile(
+    "|".join(f"(?=.*?(?P<{name}>{pat}))" for name, pat in _CMD_ALTERNATIVES),
+    re.DOTALL,
+)
+_CMD_ACTIONS = {'neutral': 'diag/neutral'}
 
 def parse_robot_command(text: str):
-    text = (text or "").lower().strip()
     # Allow commands with or without "robot" prefix.
-    if text.startswith("robot "):
-        text = text.split(" ", 1)[1]
-    for pattern, builder in COMMAND_PATTERNS:
-        if re.search(pattern, text):
-            return builder()[0]
-    return None
+    text = (text or "").lower().strip().removeprefix("robot ")
+    m = _CMD_RE.match(text)
+    if m is None:
+        return None
+    return _CMD_ACTIONS.get(m.lastgroup, m.lastgroup)
+
+# A message that is nothing but a command ("stop", "Robot, trot sync.") has
+# nothing for the language model to answer; it gets a fixed acknowledgment.
+_PURE_CMD_RE = re.compile(
+    r"(?:robot[\s,]+)?(?:" + "|".join(pat for _, pat in _CMD_ALTERNATIVES) + r")[\s.,!?]*"
+)
+CANNED_ACK = {
+    'stop':         "Stopping.",
+    'trot_sync':    "Trotting.",
+    'trot':         "Trotting.",
+    'forward':      "Going forward.",
+    'backward':     "Going backward.",
+    'left':         "Turning left.",
+    'right':        "Turning right.",
+    'diag/neutral': "Back to neutral.",
+}
+
+def is_pure_command(text: str) -> bool:
+    return _PURE_CMD_RE.fullmatch((text or "").lower().strip()) is not None
+
+# Fixed replies that can reach speak_async; synthesized once at startup
+CANNED_REPLIES = tuple(dict.fromkeys(CANNED_ACK.values())) + (
+    "I didn't catch that. Please try again.",
+    "Language model is not configured. Please set OPENAI_API_KEY.",
+)
 
 def execute_robot_action(action: str):
     if action == 'stop':
+        stop_speaking()
         return stop()
     elif action == 'forward':
         return forward()
@@ -527,28 +925,71 @@ HTML = '''
       append('bot', data.reply || '(no response)');
     }
 
-    // ======== Voice Mode (MediaRecorder -> /voice_ask) ========
-    let mediaRecorder, chunks = [], streamRef = null;
+    // ======== Voice Mode (MediaRecorder -> /ws/voice, or /voice_ask) ========
+    // Chunks stream over /ws/voice while recording; if the socket is not
+    // available or closes without an answer, the clip is uploaded instead.
+    let mediaRecorder, chunks = [], streamRef = null, voiceWs = null, voiceAnswered = false;
+    // Speech needs no more than 16 kHz mono; ~24 kbps Opus is a quarter of the
+    // browser's default upload and Deepgram still decodes it natively
+    const MIC_CONSTRAINTS = { audio: { channelCount: 1, sampleRate: 16000, echoCancellation: true, noiseSuppression: true } };
+    const VOICE_BITRATE = 24000;
+
+    function showVoice(data){
+      if (data.transcript) append('user', '[voice] ' + data.transcript);
+      if (data.robot_action) append('bot', '[Executing] ' + data.robot_action);
+      append('bot', data.reply || '(no response)');
+    }
+
+    async function postVoice(){
+      const blob = new Blob(chunks, { type: 'audio/webm' });
+      chunks = [];
+      const form = new FormData();
+      form.append('audio', blob, 'voice.webm');
+      const resp = await fetch('/voice_ask', { method: 'POST', body: form });
+      showVoice(await resp.json());
+    }
+
+    function openVoiceSocket(){
+      const ws = new WebSocket((location.protocol === 'https:' ? 'wss://' : 'ws://') + location.host + '/ws/voice');
+      ws.onopen = () => {
+        chunks.forEach(c => ws.send(c));  // includes the WebM header chunk
+        if (mediaRecorder.state === 'inactive') ws.send('stop');
+      };
+      ws.onmessage = e => {
+        voiceWs = null; voiceAnswered = true;
+        ws.close();
+        showVoice(JSON.parse(e.data));
+        stopRec();  // a command may end the turn before Stop is pressed
+      };
+      ws.onclose = () => {
+        if (voiceWs !== ws) return;
+        voiceWs = null;
+        if (mediaRecorder.state === 'inactive') postVoice();
+      };
+      return ws;
+    }
 
     async function startRec(){
       try {
-        streamRef = await navigator.mediaDevices.getUserMedia({ audio: true });
-        mediaRecorder = new MediaRecorder(streamRef, { mimeType: 'audio/webm' });
+        streamRef = await navigator.mediaDevices.getUserMedia(MIC_CONSTRAINTS);
+        const mimeType = MediaRecorder.isTypeSupported('audio/webm;codecs=opus') ? 'audio/webm;codecs=opus' : 'audio/webm';
+        mediaRecorder = new MediaRecorder(streamRef, { mimeType, audioBitsPerSecond: VOICE_BITRATE });
         chunks = [];
-        mediaRecorder.ondataavailable = e => { if (e.data && e.data.size > 0) chunks.push(e.data); };
-        mediaRecorder.onstop = async () => {
-          const blob = new Blob(chunks, { type: 'audio/webm' });
-          chunks = [];
-          // Send to server
-          const form = new FormData();
-          form.append('audio', blob, 'voice.webm');
-          const resp = await fetch('/voice_ask', { method: 'POST', body: form });
-          const data = await resp.json();
-          if (data.transcript) append('user', '[voice] ' + data.transcript);
-          if (data.robot_action) append('bot', '[Executing] ' + data.robot_action);
-          append('bot', data.reply || '(no response)');
+        voiceAnswered = false;
+        voiceWs = openVoiceSocket();
+        mediaRecorder.ondataavailable = e => {
+          if (!e.data || e.data.size === 0) return;
+          chunks.push(e.data);
+          if (voiceWs && voiceWs.readyState === WebSocket.OPEN) voiceWs.send(e.data);
         };
-        mediaRecorder.start();
+        mediaRecorder.onstop = () => {
+          if (voiceWs) {
+            if (voiceWs.readyState === WebSocket.OPEN) voiceWs.send('stop');
+          } else if (!voiceAnswered) {
+            postVoice();
+          }
+        };
+        mediaRecorder.start(250);
       } catch (err) {
         append('bot', 'Microphone error: ' + err);
       }
@@ -568,108 +1009,110 @@ HTML = '''
 </html>
 '''
 
+# HTML has no template variables, so it is encoded once instead of rendered per request
+_INDEX_BYTES = HTML.encode("utf-8")
+
 @app.route('/')
 def index():
-    return render_template_string(HTML)
+    resp = Response(_INDEX_BYTES, mimetype='text/html')
+    resp.headers['Cache-Control'] = 'public, max-age=3600'
+    return resp
 
 # ---- Start/Stop endpoints ----
-def _stop_all_flags():
-    for k in movement_flag.keys():
-        movement_flag[k] = False
-
 @app.route('/forward')
 def forward():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['forward'] = True
-    Thread(target=walk_forward_loop, daemon=True).start()
+    _run_gait(walk_forward_loop)
     return "Moving forward (crawl gait)..."
 
 @app.route('/backward')
 def backward():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['backward'] = True
-    Thread(target=walk_backward_loop, daemon=True).start()
+    _run_gait(walk_backward_loop)
     return "Moving backward (crawl gait)..."
 
 @app.route('/left')
 def left():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['left'] = True
-    Thread(target=turn_left_loop, daemon=True).start()
+    _run_gait(turn_left_loop)
     return "Turning left..."
 
 @app.route('/right')
 def right():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['right'] = True
-    Thread(target=turn_right_loop, daemon=True).start()
+    _run_gait(turn_right_loop)
     return "Turning right..."
 
 @app.route('/trot_sync')
 def trot_sync():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['trot_sync'] = True
-    Thread(target=trot_forward_loop_sync, daemon=True).start()
+    _run_gait(trot_forward_loop_sync)
     return "Trot (locked synchronization) started..."
 
-@app.route('/trot_sync_step')
-def trot_sync_step():
-    _stop_all_flags(); time.sleep(0.05)
+def _trot_sync_cycle(epoch):
     setup_pose_bias_back()
     trot_step_forward_sync(DIAG_A, DIAG_B)
     trot_step_forward_sync(DIAG_B, DIAG_A)
     setup()
+
+@app.route('/trot_sync_step')
+def trot_sync_step():
+    _run_gait(_trot_sync_cycle).wait()
     return "Single locked-synchronization trot cycle done."
 
 @app.route('/trot')
 def trot():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['trot'] = True
-    Thread(target=trot_forward_loop, daemon=True).start()
+    _run_gait(trot_forward_loop)
     return "Trot (legacy) started..."
 
-@app.route('/trot_step')
-def trot_step():
-    _stop_all_flags(); time.sleep(0.05)
+def _trot_cycle(epoch):
     setup_pose_bias_back()
     trot_step_forward(DIAG_A, DIAG_B)
     trot_step_forward(DIAG_B, DIAG_A)
     setup()
+
+@app.route('/trot_step')
+def trot_step():
+    _run_gait(_trot_cycle).wait()
     return "Single trot cycle (legacy) done."
 
-@app.route('/step')
-def step():
-    _stop_all_flags(); time.sleep(0.05)
+def _crawl_step(epoch):
     order = [(LF_HIP, LF_KNEE), (RR_HIP, RR_KNEE), (RF_HIP, RF_KNEE), (LR_HIP, LR_KNEE)]
     crawl_step_forward(order)
+
+@app.route('/step')
+def step():
+    _run_gait(_crawl_step).wait()
     return "Single forward step (crawl) done."
 
 @app.route('/stop')
 def stop():
-    _stop_all_flags()
-    setup()
+    _run_gait(lambda epoch: setup())
     return "Stopping and parking neutral."
 
 # ===================== Text Chat endpoint =====================
-@app.route('/ask', methods=['POST'])
-def ask():
-    data = request.get_json(force=True, silent=True) or {}
-    text = (data.get('text') or "").strip()
+def ojson(data):
+    """JSON response encoded with orjson when it is installed."""
+    if orjson is None:
+        return jsonify(data)
+    return Response(orjson.dumps(data), mimetype='application/json')
 
+_EXEC = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chat")
+
+def _act_and_reply(text: str):
+    """Run the robot action while the LM call is in flight; return (action, robot_msg, reply)."""
     action = parse_robot_command(text)
+    if action and is_pure_command(text):
+        return action, execute_robot_action(action), CANNED_ACK[action]
+    reply_fut = _EXEC.submit(lm_reply, text)
     robot_msg = None
     if action:
         robot_msg = execute_robot_action(action)
+    return action, robot_msg, reply_fut.result()
 
-    reply = lm_reply(text)
+@app.route('/ask', methods=['POST'])
+def ask():
+    data = request.get_json(force=True, silent=True) or {}
+    text = (data.get('text') or "").strip()
+
+    action, robot_msg, reply = _act_and_reply(text)
     speak_async(reply)
-    return jsonify({"reply": reply, "robot_action": action, "robot_message": robot_msg})
+    return ojson({"reply": reply, "robot_action": action, "robot_message": robot_msg})
 
 # ===================== Voice Chat endpoint =====================
 @app.route('/voice_ask', methods=['POST'])
@@ -683,28 +1126,63 @@ def voice_ask():
     if not f:
         return jsonify({"error": "No audio provided"}), 400
 
-    audio_bytes = f.read()
     mimetype = f.mimetype or "audio/webm"
 
-    transcript = deepgram_transcribe(audio_bytes, mimetype=mimetype)
+    transcript = deepgram_transcribe(f.stream, mimetype=mimetype)
+    return ojson(_voice_result(transcript))
+
+def _voice_result(transcript: str) -> dict:
+    """Act on and answer a voice transcript; shared by the upload and streaming routes."""
     if not transcript:
         reply = "I didn't catch that. Please try again."
         speak_async(reply)
-        return jsonify({"transcript": "", "reply": reply, "robot_action": None})
+        return {"transcript": "", "reply": reply, "robot_action": None}
 
-    action = parse_robot_command(transcript)
-    robot_msg = None
-    if action:
-        robot_msg = execute_robot_action(action)
-
-    reply = lm_reply(transcript)
+    action, robot_msg, reply = _act_and_reply(transcript)
     speak_async(reply)
-    return jsonify({"transcript": transcript, "reply": reply, "robot_action": action, "robot_message": robot_msg})
+    return {"transcript": transcript, "reply": reply, "robot_action": action, "robot_message": robot_msg}
+
+if sock is not None and ws_connect is not None:
+    @sock.route('/ws/voice')
+    def voice_ws(ws):
+        """
+        Streaming voice: MediaRecorder chunks are relayed to Deepgram as they
+        arrive, so the transcript is ready about one chunk after Stop. The turn
+        ends on Stop or as soon as a final segment contains a robot command.
+        Closing without a reply makes the page fall back to /voice_ask.
+        """
+        if not DEEPGRAM_API_KEY or _local_stt is not None:
+            return
+        try:
+            dg = ws_connect(DG_STREAM_URL, additional_headers={"Authorization": f"Token {DEEPGRAM_API_KEY}"})
+        except Exception as e:
+            print("Deepgram stream error:", e)
+            return
+        with dg:
+            transcript = _stream_transcript(ws, dg)
+        ws.send(json.dumps(_voice_result(transcript)))
 
 # ===================== Main =====================
-if __name__ == "__main__":
-    setup()
-    # Optional: calibrate pulse ranges per your servo datasheet
+def startup():
+    """One-time process setup; run from __main__ or gunicorn.conf.py's post_worker_init."""
+    # Optional: calibrate pulse ranges per your servo datasheet (servo writes
+    # bypass ServoKit, so use servo_common.set_pulse_range; ramp plans cache
+    # raw counts, so calibrate before they are warmed)
     # for ch in [LF_HIP, RF_HIP, LR_HIP, RR_HIP, LF_KNEE, RF_KNEE, LR_KNEE, RR_KNEE]:
-    #     kit.servo[ch].set_pulse_width_range(500, 2500)
-    app.run(host='0.0.0.0', port=5000)
+    #     set_pulse_range(ch, 500, 2500)
+    _prewarm_ramps()
+    _prewarm_tts()
+    _load_local_stt()
+    try:
+        with _mpg123_lock:
+            _player()
+    except OSError as e:
+        print("[WARN] mpg123 not started:", e)
+    Thread(target=_tts_worker, daemon=True, name="tts").start()
+    setup()
+    Thread(target=_gait_runner, daemon=True, name="gait").start()
+
+if __name__ == "__main__":
+    startup()
+    # Development server; for production use `gunicorn -c gunicorn.conf.py gptversion:app`
+    app.run(host='0.0.0.0', port=5000, threaded=True)
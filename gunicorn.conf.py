@@ -0,0 +1,27 @@
+# gunicorn -c gunicorn.conf.py cleaneduigpt:app
+# gunicorn -c gunicorn.conf.py gptversion:app
+# gunicorn -c gunicorn.conf.py moving:app
+#
+# One worker only: the servo hat, gait worker, TTS queue and mpg123 players
+# are per-process state, so a second worker would fight over the I2C bus and
+# the speaker. Concurrency comes from threads, which is enough because every
+# slow path (Deepgram, SerpAPI, the LM) is network I/O that releases the GIL.
+#
+# Each in-flight voice turn holds one thread while it waits on Deepgram and
+# the LM. That wait is blocking socket I/O with the GIL released, so extra
+# threads cost only memory. Raise GUNICORN_THREADS rather than porting to an
+# async framework: the gait loops, TTS worker and servo bus are thread-based.
+import os
+import sys
+
+bind = "0.0.0.0:5000"
+workers = 1
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+# /ask streams LM replies and /voice_ask waits on Deepgram + the LM
+timeout = 120
+
+
+def post_worker_init(worker):
+    # Every app exposes startup(); run the one from the module being served
+    sys.modules[worker.wsgi.import_name].startup()
@@ -1,11 +1,14 @@
-from flask import Flask, render_template_string
-from threading import Thread
+from array import array
+from flask import Flask, Response
+from functools import lru_cache
+from threading import Event, Lock, Thread, local
 import time
-from adafruit_servokit import ServoKit
+from servo_common import (angle_of, duty_for_angle, get_kit, make_realtime,
+                          merge_events, sleep_until, write_angles, write_channels)
 
 # ===================== Flask & ServoKit =====================
 app = Flask(__name__)
-kit = ServoKit(channels=16)
+kit = get_kit()
 
 # ===================== Channel Mapping (your wiring) =====================
 # Original labels from your code
@@ -33,8 +36,12 @@ DIAG_B = [(RF_HIP, RF_KNEE), (LR_HIP, LR_KNEE)]  # RF + LR
 
 # ===================== Tuning (angles & inversion) =====================
 # Flip per servo if it moves opposite to what you expect on YOUR rig.
-INVERT_HIP  = {LF_HIP: False, RF_HIP: True,  LR_HIP: False, RR_HIP: True}
-INVERT_KNEE = {LF_KNEE: False, RF_KNEE: True, LR_KNEE: False, RR_KNEE: True}
+# One 16-entry table indexed by PCA9685 channel (hips and knees never share
+# a channel); True mirrors the angle (180 - a).
+INVERT = tuple(ch in (RF_HIP, RR_HIP, RF_KNEE, RR_KNEE) for ch in range(16))
+# raw = offset + sign * angle: (0, 1) passes through, (180, -1) mirrors
+_INVERT_OFFSET = array('h', (180 if inv else 0 for inv in INVERT))
+_INVERT_SIGN   = array('b', (-1 if inv else 1 for inv in INVERT))
 
 # Hip angles (swing)
 HIP_NEUTRAL = 90
@@ -54,121 +61,252 @@ RAMP_STEP   = 3      # deg per increment (smaller = smoother)
 RAMP_DELAY  = 0.01   # s between increments
 DWELL       = 0.12   # small pause inside gait phases
 TROT_DWELL  = 0.12   # trot phase dwell
-
-# ===================== Movement flags =====================
-movement_flag = {
-    'forward':   False,
-    'backward':  False,
-    'left':      False,
-    'right':     False,
-    'trot':      False,
-    'trot_sync': False,  # NEW: locked-synchronization trot
-}
+# Dwells count from the start of the ramp they follow: the servos track the
+# ramp as it is written, so a phase takes max(ramp + RAMP_LAG, dwell) rather
+# than ramp + dwell. RAMP_LAG is how long a servo trails the last tick.
+RAMP_LAG    = 0.04   # s, two 50 Hz PWM frames
+
+# ===================== Gait thread =====================
+# Set to stop the running gait; each gait gets a fresh Event. Loops check it
+# at phase boundaries, then park. Inside the gait thread _gait.stop is that
+# Event too: once it is set, dwells return at once and ramps not yet started
+# are skipped, so the loop reaches its check within one ramp.
+stop_evt = Event()
+stop_evt.set()
+gait_thread = None
+_gait_lock = Lock()
+_gait = local()
+# Cleared after the first failed SCHED_FIFO attempt, so later gaits don't re-warn
+_realtime = True
+
+def _stopping():
+    stop = getattr(_gait, "stop", None)
+    return stop is not None and stop.is_set()
+
+def _park():
+    """setup() at the end of a gait, in full even though the gait's stop is set."""
+    _gait.stop = None
+    setup()
 
 # ===================== Low-level helpers (with inversion) =====================
-def _apply_invert(ch, angle, invert_map):
-    return 180 - angle if invert_map.get(ch, False) else angle
-
-def _current_angle(ch, default_raw, invert_map):
-    a = kit.servo[ch].angle
-    return int(a) if a is not None else _apply_invert(ch, default_raw, invert_map)
-
-def _ramp_to(ch, target_raw, invert_map, step=RAMP_STEP, delay=RAMP_DELAY):
-    target = _apply_invert(ch, target_raw, invert_map)
-    cur = _current_angle(ch, target_raw, invert_map)
+def _apply_invert(ch, angle):
+    return _INVERT_OFFSET[ch] + _INVERT_SIGN[ch] * angle
+
+# Raw angle each channel was last ramped to, None until this process moves it
+_last_angle = [None] * 16
+
+def _current_angle(ch, default_raw):
+    a = _last_angle[ch]
+    if a is not None:
+        return a
+    # First move of this channel: decode the register shadow. The shadow is
+    # read once per process and the first write needs it anyway, so this adds
+    # no I2C traffic; every later ramp starts from _last_angle.
+    a = angle_of(kit._pca, ch)
+    return int(a) if a is not None else _apply_invert(ch, default_raw)
+
+def _write_angles(angles):
+    """Write {channel: angle} straight to the PCA9685, one burst per run of adjacent channels."""
+    write_angles(kit._pca, angles)
+
+# Ramps sleep to absolute deadlines (t0 + i*delay), so write time and sleep
+# overshoot never add up over a ramp. Each returns (start, due end) for
+# _dwell_after, or None if nothing had to move.
+def _ramp_to(ch, target_raw, step=RAMP_STEP, delay=RAMP_DELAY):
+    if _stopping():
+        return None
+    target = _apply_invert(ch, target_raw)
+    cur = _current_angle(ch, target_raw)
+    _last_angle[ch] = target
+    t0 = time.monotonic()
     if cur == target:
-        kit.servo[ch].angle = target
-        return
+        _write_angles({ch: target})
+        return t0, t0
     sgn = 1 if target > cur else -1
-    for a in range(cur, target, sgn * step):
-        kit.servo[ch].angle = a
-        time.sleep(delay)
-    kit.servo[ch].angle = target
-
-def _ramp_sync(ch_list, target_raw_list, invert_map, step=RAMP_STEP, delay=RAMP_DELAY):
-    """
-    Advance all channels in ch_list toward their targets in lockstep.
-    Each tick: move each by up to 'step' toward target, then sleep.
+    for i, a in enumerate(range(cur, target, sgn * step), 1):
+        _write_angles({ch: a})
+        sleep_until(t0 + i * delay)
+    _write_angles({ch: target})
+    return t0, t0 + i * delay
+
+@lru_cache(maxsize=512)
+def _plan_ramp(ch_list, curs, targs, step):
+    """Every tick's {channel: count} write for a synchronized ramp, the last tick landing on targs.
+
+    Gaits repeat the same few moves, so after the first cycle the plan comes
+    straight from the cache. Callers must not mutate it.
     """
-    # Prepare current and target (commanded) angles
-    curs = []
-    targs = []
-    for ch, t_raw in zip(ch_list, target_raw_list):
-        t = _apply_invert(ch, t_raw, invert_map)
-        c = _current_angle(ch, t_raw, invert_map)
-        curs.append(c)
-        targs.append(t)
-
-    # Determine the maximum steps needed
-    deltas = [abs(t - c) for c, t in zip(curs, targs)]
-    max_steps = 0 if not deltas else max((d + step - 1) // step for d in deltas)
-
-    for i in range(max_steps):
+    curs = list(curs)
+    max_steps = max(((abs(t - c) + step - 1) // step for c, t in zip(curs, targs)), default=0)
+    ticks = []
+    for _ in range(max_steps):
+        tick = {}
         for idx, ch in enumerate(ch_list):
             c = curs[idx]; t = targs[idx]
-            if c == t: 
+            if c == t:
                 continue
             sgn = 1 if t > c else -1
-            move = min(step, abs(t - c))
-            c_new = c + sgn * move
-            kit.servo[ch].angle = c_new
-            curs[idx] = c_new
-        time.sleep(delay)
-
-    # Snap exactly to targets
+            c += sgn * min(step, abs(t - c))
+            tick[ch] = duty_for_angle(c, ch)
+            curs[idx] = c
+        ticks.append(tick)
+    ticks.append({ch: duty_for_angle(t, ch) for ch, t in zip(ch_list, targs)})
+    return tuple(ticks)
+
+def _ramp_sync(ch_list, target_raw_list, step=RAMP_STEP, delay=RAMP_DELAY):
+    """
+    Advance all channels in ch_list toward their targets in lockstep.
+    Each tick: move each by up to 'step' toward target, then sleep.
+    """
+    ch_list = tuple(ch_list)
+    targs = tuple(_INVERT_OFFSET[ch] + _INVERT_SIGN[ch] * t for ch, t in zip(ch_list, target_raw_list))
+    curs = tuple(_last_angle[ch] for ch in ch_list)
+    # Already commanded there (e.g. hips back again at the end of a trot
+    # step): no write and no settle
+    if curs == targs:
+        return None
+    if _stopping() and getattr(_rec, "events", None) is None:
+        return None
+    if None in curs:
+        curs = tuple(_current_angle(ch, t) for ch, t in zip(ch_list, target_raw_list))
+    plan = _plan_ramp(ch_list, curs, targs, step)
     for ch, t in zip(ch_list, targs):
-        kit.servo[ch].angle = t
+        _last_angle[ch] = t
+
+    if getattr(_rec, "events", None) is not None:
+        t0 = _rec.clock
+        _rec.events.extend((t0 + i * delay, tick) for i, tick in enumerate(plan))
+        _rec.clock = t0 + (len(plan) - 1) * delay
+        return t0, _rec.clock
+
+    # Every channel that moves this tick goes out in the same I2C burst
+    t0 = time.monotonic()
+    for i, tick in enumerate(plan[:-1], 1):
+        write_channels(kit._pca, tick)
+        sleep_until(t0 + i * delay)
+    # Snap exactly to targets
+    write_channels(kit._pca, plan[-1])
+    return t0, t0 + (len(plan) - 1) * delay
+
+def _dwell_after(span, seconds):
+    """Sleep until seconds after a ramp started, and at least RAMP_LAG after it was due to end."""
+    if span is None:
+        return
+    start, end = span
+    deadline = max(start + seconds, end + RAMP_LAG)
+    if getattr(_rec, "events", None) is not None:
+        _rec.clock = deadline
+        return
+    sleep_until(deadline, getattr(_gait, "stop", None))
+
+def _pause(seconds):
+    """time.sleep that the running gait's stop Event cuts short."""
+    stop = getattr(_gait, "stop", None)
+    if stop is None:
+        time.sleep(seconds)
+    else:
+        stop.wait(seconds)
+
+# ===================== Compiled gait steps =====================
+# A gait step built only from _ramp_sync and _dwell_after always writes the
+# same counts at the same offsets for a given start pose. _compile_step runs
+# it once against a virtual clock (_rec) to record that schedule; the loop
+# then just replays it: sleep to each deadline, write one burst.
+_rec = local()
+_PAIRS = (DIAG_A, DIAG_B)
+_GAIT_CHANNELS = tuple(ALL_HIPS + ALL_KNEES)
+
+def _pose():
+    return tuple(_last_angle[ch] for ch in _GAIT_CHANNELS)
+
+def _tuning():
+    """Every constant a compiled step depends on, so retuning misses the cache."""
+    return (RAMP_STEP, RAMP_DELAY, TROT_DWELL, RAMP_LAG, HIP_NEUTRAL, HIP_FWD, HIP_BACK,
+            KNEE_DOWN, KNEE_UP, PRESS_DELTA, LIGHTEN_DELTA)
+
+@lru_cache(maxsize=64)
+def _compile_step(step, swing, start_pose, tuning):
+    """(events, duration, end pose) of step(stance_pair, swing_pair) from start_pose."""
+    saved = _last_angle[:]
+    for ch, a in zip(_GAIT_CHANNELS, start_pose):
+        _last_angle[ch] = a
+    _rec.clock, _rec.events = 0.0, []
+    try:
+        step(_PAIRS[1 - swing], _PAIRS[swing])
+        return tuple(merge_events(_rec.events)), _rec.clock, _pose()
+    finally:
+        _rec.events = None
+        _last_angle[:] = saved
+
+def _run_compiled(step, stop, swing=1):
+    """Replay step on alternating diagonals from compiled schedules until stop is set."""
+    t0 = time.monotonic()
+    while not stop.is_set():
+        events, duration, end = _compile_step(step, swing, _pose(), _tuning())
+        for t, duties in events:
+            if sleep_until(t0 + t, stop):
+                # Stopped mid-step: the parking ramp starts from the register shadow
+                for ch in _GAIT_CHANNELS:
+                    _last_angle[ch] = None
+                return
+            write_channels(kit._pca, duties)
+        for ch, a in zip(_GAIT_CHANNELS, end):
+            _last_angle[ch] = a
+        # An overrun restarts the clock instead of rushing the next step
+        t0 = max(t0 + duration, time.monotonic())
+        swing ^= 1
 
 # Convenience wrappers
-def set_hip(ch, angle):  _ramp_to(ch, angle, INVERT_HIP)
-def set_knee(ch, angle): _ramp_to(ch, angle, INVERT_KNEE)
+def set_hip(ch, angle):  return _ramp_to(ch, angle)
+def set_knee(ch, angle): return _ramp_to(ch, angle)
 
 def set_hip_pair(pair, angle):
     chs = [pair[0][0], pair[1][0]]
     tgs = [angle, angle]
-    _ramp_sync(chs, tgs, INVERT_HIP)
+    return _ramp_sync(chs, tgs)
 
 def set_knee_pair(pair, angle):
     chs = [pair[0][1], pair[1][1]]
     tgs = [angle, angle]
-    _ramp_sync(chs, tgs, INVERT_KNEE)
+    return _ramp_sync(chs, tgs)
 
 def set_hips_all_sync(angle):
-    _ramp_sync(ALL_HIPS, [angle]*4, INVERT_HIP)
+    return _ramp_sync(ALL_HIPS, [angle]*4)
 
 def set_knees_all_sync(angle):
-    _ramp_sync(ALL_KNEES, [angle]*4, INVERT_KNEE)
+    return _ramp_sync(ALL_KNEES, [angle]*4)
+
+def set_all_sync(hip_angle, knee_angle):
+    """Ramp all hips and knees together, one 8-channel burst per tick."""
+    return _ramp_sync(ALL_HIPS + ALL_KNEES, [hip_angle]*4 + [knee_angle]*4)
 
 # ===================== Posture helpers =====================
 def plant_all():
-    set_knees_all_sync(KNEE_DOWN)
+    return set_knees_all_sync(KNEE_DOWN)
 
 def hips_all(angle=HIP_NEUTRAL):
-    set_hips_all_sync(angle)
+    return set_hips_all_sync(angle)
 
 def setup():
     print("Setup: knees down, hips neutral...")
-    plant_all()
-    hips_all(HIP_NEUTRAL)
-    time.sleep(0.2)
+    _dwell_after(set_all_sync(HIP_NEUTRAL, KNEE_DOWN), 0.2)
 
 # ===================== Single‑leg primitives (kept for crawl/turn) =====================
-def leg_lift(hip, knee):           set_knee(knee, KNEE_UP)
-def leg_lower(hip, knee):          set_knee(knee, KNEE_DOWN)
-def leg_swing_forward(hip, knee):  set_hip(hip, HIP_FWD)
-def leg_swing_backward(hip, knee): set_hip(hip, HIP_BACK)
-def leg_push_back(hip, knee):      set_hip(hip, HIP_BACK)
-def leg_push_forward(hip, knee):   set_hip(hip, HIP_FWD)
+def leg_lift(hip, knee):           return set_knee(knee, KNEE_UP)
+def leg_lower(hip, knee):          return set_knee(knee, KNEE_DOWN)
+def leg_swing_forward(hip, knee):  return set_hip(hip, HIP_FWD)
+def leg_swing_backward(hip, knee): return set_hip(hip, HIP_BACK)
+def leg_push_back(hip, knee):      return set_hip(hip, HIP_BACK)
+def leg_push_forward(hip, knee):   return set_hip(hip, HIP_FWD)
 
 # ===================== Weight shift =====================
 def weight_shift_for_pair(swing_pair):
-    """Press stance pair; lighten swing pair — both actions in pair‑sync."""
+    """Press stance pair while lightening swing pair, all four knees in sync."""
     stance_pair = DIAG_B if swing_pair == DIAG_A else DIAG_A
-    # Press stance
-    set_knee_pair(stance_pair, KNEE_DOWN + PRESS_DELTA)
-    # Lighten swing
-    set_knee_pair(swing_pair,   KNEE_DOWN + LIGHTEN_DELTA)
-    time.sleep(TROT_DWELL)
+    # Stance presses as the swing pair lightens: one 4-knee ramp
+    span = _ramp_sync([k for _, k in stance_pair] + [k for _, k in swing_pair],
+                      [KNEE_DOWN + PRESS_DELTA]*2 + [KNEE_DOWN + LIGHTEN_DELTA]*2)
+    _dwell_after(span, TROT_DWELL)
 
 def clear_weight_shift():
     set_knees_all_sync(KNEE_DOWN)
@@ -176,81 +314,88 @@ def clear_weight_shift():
 # ===================== Diagnostics =====================
 @app.route('/diag/neutral')
 def diag_neutral():
-    setup()
+    _run_once(lambda stop: setup())
     return "Neutral: hips 90, knees down."
 
 @app.route('/diag/lf_push')
 def diag_lf_push():
-    leg_lower(LF_HIP, LF_KNEE); time.sleep(0.2)
-    leg_push_back(LF_HIP, LF_KNEE); time.sleep(0.6)
-    set_hip(LF_HIP, HIP_FWD); time.sleep(0.4)
-    set_hip(LF_HIP, HIP_NEUTRAL)
+    def once(stop):
+        leg_lower(LF_HIP, LF_KNEE); _pause(0.2)
+        leg_push_back(LF_HIP, LF_KNEE); _pause(0.6)
+        set_hip(LF_HIP, HIP_FWD); _pause(0.4)
+        set_hip(LF_HIP, HIP_NEUTRAL)
+    _run_once(once)
     return "LF push test complete."
 
 @app.route('/diag/lf_step')
 def diag_lf_step():
-    weight_shift_for_pair(DIAG_B)
-    leg_lift(LF_HIP, LF_KNEE);               time.sleep(DWELL)
-    leg_swing_forward(LF_HIP, LF_KNEE);      time.sleep(DWELL + 0.1)
-    leg_lower(LF_HIP, LF_KNEE);              time.sleep(DWELL)
-    clear_weight_shift()
-    leg_push_back(LF_HIP, LF_KNEE);          time.sleep(DWELL + 0.2)
-    set_hip(LF_HIP, HIP_NEUTRAL)
+    def once(stop):
+        weight_shift_for_pair(DIAG_B)
+        leg_lift(LF_HIP, LF_KNEE);               _pause(DWELL)
+        leg_swing_forward(LF_HIP, LF_KNEE);      _pause(DWELL + 0.1)
+        leg_lower(LF_HIP, LF_KNEE);              _pause(DWELL)
+        clear_weight_shift()
+        leg_push_back(LF_HIP, LF_KNEE);          _pause(DWELL + 0.2)
+        set_hip(LF_HIP, HIP_NEUTRAL)
+    _run_once(once)
     return "LF weighted step done."
 
 # ===================== Crawl gait (for completeness) =====================
 def setup_pose_bias_back():
-    plant_all()
-    hips_all(HIP_NEUTRAL)
-    # preload some "back" for stance
-    _ramp_sync(ALL_HIPS, [ (HIP_NEUTRAL + HIP_BACK)//2 ]*4, INVERT_HIP)
-    time.sleep(0.2)
+    # Knees down with the hips preloaded some "back" for stance, in one ramp
+    _dwell_after(set_all_sync((HIP_NEUTRAL + HIP_BACK)//2, KNEE_DOWN), 0.2)
 
 def swing_forward_sequence(hip, knee):
     weight_shift_for_pair(DIAG_B if (hip, knee) in DIAG_A else DIAG_A)
-    leg_lift(hip, knee);   time.sleep(DWELL)
-    leg_swing_forward(hip, knee); time.sleep(DWELL)
-    leg_lower(hip, knee);  time.sleep(DWELL)
+    _dwell_after(leg_lift(hip, knee), DWELL)
+    _dwell_after(leg_swing_forward(hip, knee), DWELL)
+    _dwell_after(leg_lower(hip, knee), DWELL)
     clear_weight_shift()
 
 def swing_backward_sequence(hip, knee):
     weight_shift_for_pair(DIAG_B if (hip, knee) in DIAG_A else DIAG_A)
-    leg_lift(hip, knee);   time.sleep(DWELL)
-    leg_swing_backward(hip, knee); time.sleep(DWELL)
-    leg_lower(hip, knee);  time.sleep(DWELL)
+    _dwell_after(leg_lift(hip, knee), DWELL)
+    _dwell_after(leg_swing_backward(hip, knee), DWELL)
+    _dwell_after(leg_lower(hip, knee), DWELL)
     clear_weight_shift()
 
 def stance_push_all_back():
-    set_hips_all_sync(HIP_BACK); time.sleep(DWELL)
+    _dwell_after(set_hips_all_sync(HIP_BACK), DWELL)
 
 def stance_push_all_forward():
-    set_hips_all_sync(HIP_FWD);  time.sleep(DWELL)
+    _dwell_after(set_hips_all_sync(HIP_FWD), DWELL)
 
-def crawl_step_forward(order):
+# A crawl cycle moves each leg in turn; the loops pass their stop Event so a
+# stop lands after the current leg rather than after all four
+def crawl_step_forward(order, stop=None):
     for hip, knee in order:
+        if stop is not None and stop.is_set():
+            return
         swing_forward_sequence(hip, knee)
         stance_push_all_back()
 
-def crawl_step_backward(order):
+def crawl_step_backward(order, stop=None):
     for hip, knee in order:
+        if stop is not None and stop.is_set():
+            return
         swing_backward_sequence(hip, knee)
         stance_push_all_forward()
 
-def walk_forward_loop():
+def walk_forward_loop(stop):
     print("BD‑inspired crawl (forward)")
     setup_pose_bias_back()
     order = [(LF_HIP, LF_KNEE), (RR_HIP, RR_KNEE), (RF_HIP, RF_KNEE), (LR_HIP, LR_KNEE)]
-    while movement_flag['forward']:
-        crawl_step_forward(order)
-    setup(); print("Forward stopped.")
+    while not stop.is_set():
+        crawl_step_forward(order, stop)
+    _park(); print("Forward stopped.")
 
-def walk_backward_loop():
+def walk_backward_loop(stop):
     print("BD‑inspired crawl (backward)")
     setup_pose_bias_back()
     order = [(LF_HIP, LF_KNEE), (RR_HIP, RR_KNEE), (RF_HIP, RF_KNEE), (LR_HIP, LR_KNEE)]
-    while movement_flag['backward']:
-        crawl_step_backward(order)
-    setup(); print("Backward stopped.")
+    while not stop.is_set():
+        crawl_step_backward(order, stop)
+    _park(); print("Backward stopped.")
 
 # ===================== STRICTLY-SYNCHRONIZED TROT (LOCKSTEP) =====================
 def trot_step_forward_sync(stance_pair, swing_pair):
@@ -266,72 +411,67 @@ def trot_step_forward_sync(stance_pair, swing_pair):
     weight_shift_for_pair(swing_pair)
 
     # 2) Lift swing pair (together)
-    set_knee_pair(swing_pair, KNEE_UP); time.sleep(TROT_DWELL)
+    _dwell_after(set_knee_pair(swing_pair, KNEE_UP), TROT_DWELL)
 
     # 3) Swing both swing hips forward (together)
-    set_hip_pair(swing_pair, HIP_FWD);  time.sleep(TROT_DWELL)
+    _dwell_after(set_hip_pair(swing_pair, HIP_FWD), TROT_DWELL)
 
     # 4) Lower swing pair (together)
-    set_knee_pair(swing_pair, KNEE_DOWN); time.sleep(TROT_DWELL)
+    _dwell_after(set_knee_pair(swing_pair, KNEE_DOWN), TROT_DWELL)
 
     # Clear weight shift
     clear_weight_shift()
 
     # 5) Drive push with all planted feet (no pulling planted legs forward)
-    set_hips_all_sync(HIP_BACK); time.sleep(TROT_DWELL)
+    _dwell_after(set_hips_all_sync(HIP_BACK), TROT_DWELL)
 
-def trot_forward_loop_sync():
+def trot_forward_loop_sync(stop):
     print("Diagonal‑pair LOCKSTEP trot (forward): A supports while B swings, then alternate.")
     setup_pose_bias_back()
-    stance, swing = DIAG_A, DIAG_B
-    while movement_flag['trot_sync']:
-        trot_step_forward_sync(stance, swing)
-        stance, swing = swing, stance
-    setup(); print("Trot (sync) stopped.")
+    _run_compiled(trot_step_forward_sync, stop)  # DIAG_B swings first
+    _park(); print("Trot (sync) stopped.")
 
 # (Legacy non-locked trot if you still want it)
 def trot_step_forward(stance_pair, swing_pair):
     weight_shift_for_pair(swing_pair)
-    set_knee_pair(swing_pair, KNEE_UP); time.sleep(TROT_DWELL)
-    _ramp_sync([swing_pair[0][0], swing_pair[1][0]], [HIP_FWD, HIP_FWD], INVERT_HIP)  # hips forward together
-    time.sleep(TROT_DWELL)
-    set_knee_pair(swing_pair, KNEE_DOWN); time.sleep(TROT_DWELL)
+    set_knee_pair(swing_pair, KNEE_UP); _pause(TROT_DWELL)
+    _ramp_sync([swing_pair[0][0], swing_pair[1][0]], [HIP_FWD, HIP_FWD])  # hips forward together
+    _pause(TROT_DWELL)
+    set_knee_pair(swing_pair, KNEE_DOWN); _pause(TROT_DWELL)
     clear_weight_shift()
-    set_hips_all_sync(HIP_BACK); time.sleep(TROT_DWELL)
+    set_hips_all_sync(HIP_BACK); _pause(TROT_DWELL)
 
-def trot_forward_loop():
+def trot_forward_loop(stop):
     print("Diagonal‑pair trot (forward)")
     setup_pose_bias_back()
     stance, swing = DIAG_A, DIAG_B
-    while movement_flag['trot']:
+    while not stop.is_set():
         trot_step_forward(stance, swing)
         stance, swing = swing, stance
-    setup(); print("Trot stopped.")
+    _park(); print("Trot stopped.")
 
 # ===================== Simple in‑place turn (LEFT/RIGHT) =====================
-def turn_left_loop():
+def turn_left_loop(stop):
     print("Turning left (in place)...")
-    plant_all(); hips_all(HIP_NEUTRAL); time.sleep(0.2)
-    while movement_flag['left']:
-        _ramp_sync([LF_HIP, LR_HIP, RF_HIP, RR_HIP],
-                   [HIP_BACK, HIP_BACK, HIP_FWD, HIP_FWD], INVERT_HIP)
-        time.sleep(DWELL)
-        set_knee(RF_KNEE, KNEE_UP); time.sleep(DWELL*0.6); set_knee(RF_KNEE, KNEE_DOWN)
-        set_knee(LR_KNEE, KNEE_UP); time.sleep(DWELL*0.6); set_knee(LR_KNEE, KNEE_DOWN)
-        hips_all(HIP_NEUTRAL); time.sleep(DWELL*0.5)
-    setup(); print("Left turn stopped.")
-
-def turn_right_loop():
+    _dwell_after(set_all_sync(HIP_NEUTRAL, KNEE_DOWN), 0.2)
+    while not stop.is_set():
+        _dwell_after(_ramp_sync([LF_HIP, LR_HIP, RF_HIP, RR_HIP],
+                                [HIP_BACK, HIP_BACK, HIP_FWD, HIP_FWD]), DWELL)
+        _dwell_after(set_knee(RF_KNEE, KNEE_UP), DWELL*0.6); set_knee(RF_KNEE, KNEE_DOWN)
+        _dwell_after(set_knee(LR_KNEE, KNEE_UP), DWELL*0.6); set_knee(LR_KNEE, KNEE_DOWN)
+        hips_all(HIP_NEUTRAL); stop.wait(DWELL*0.5)
+    _park(); print("Left turn stopped.")
+
+def turn_right_loop(stop):
     print("Turning right (in place)...")
-    plant_all(); hips_all(HIP_NEUTRAL); time.sleep(0.2)
-    while movement_flag['right']:
-        _ramp_sync([RF_HIP, RR_HIP, LF_HIP, LR_HIP],
-                   [HIP_BACK, HIP_BACK, HIP_FWD, HIP_FWD], INVERT_HIP)
-        time.sleep(DWELL)
-        set_knee(LF_KNEE, KNEE_UP); time.sleep(DWELL*0.6); set_knee(LF_KNEE, KNEE_DOWN)
-        set_knee(RR_KNEE, KNEE_UP); time.sleep(DWELL*0.6); set_knee(RR_KNEE, KNEE_DOWN)
-        hips_all(HIP_NEUTRAL); time.sleep(DWELL*0.5)
-    setup(); print("Right turn stopped.")
+    _dwell_after(set_all_sync(HIP_NEUTRAL, KNEE_DOWN), 0.2)
+    while not stop.is_set():
+        _dwell_after(_ramp_sync([RF_HIP, RR_HIP, LF_HIP, LR_HIP],
+                                [HIP_BACK, HIP_BACK, HIP_FWD, HIP_FWD]), DWELL)
+        _dwell_after(set_knee(LF_KNEE, KNEE_UP), DWELL*0.6); set_knee(LF_KNEE, KNEE_DOWN)
+        _dwell_after(set_knee(RR_KNEE, KNEE_UP), DWELL*0.6); set_knee(RR_KNEE, KNEE_DOWN)
+        hips_all(HIP_NEUTRAL); stop.wait(DWELL*0.5)
+    _park(); print("Right turn stopped.")
 
 # ===================== Flask UI =====================
 HTML = '''
@@ -380,98 +520,114 @@ HTML = '''
 </html>
 '''
 
+# HTML has no template variables, so it is encoded once instead of rendered per request
+_INDEX_BYTES = HTML.encode("utf-8")
+
 @app.route('/')
 def index():
-    return render_template_string(HTML)
+    resp = Response(_INDEX_BYTES, mimetype='text/html')
+    resp.headers['Cache-Control'] = 'public, max-age=3600'
+    return resp
 
 # ---- Start/Stop endpoints ----
-def _stop_all_flags():
-    for k in movement_flag.keys():
-        movement_flag[k] = False
+def _run_after(prev, loop, stop):
+    global _realtime
+    # Flask request threads stay at normal priority, so they can no longer
+    # delay a servo tick
+    if _realtime:
+        _realtime = make_realtime()
+    # The previous gait parks before this one moves, so two never drive the servos
+    if prev is not None:
+        prev.join()
+    if not stop.is_set():
+        _gait.stop = stop
+        loop(stop)
+
+def _start_gait(loop):
+    """Stop the running gait and queue loop(stop) behind it; returns its thread without waiting."""
+    global stop_evt, gait_thread
+    with _gait_lock:
+        stop_evt.set()
+        stop_evt = Event()
+        gait_thread = Thread(target=_run_after, args=(gait_thread, loop, stop_evt), daemon=True)
+        gait_thread.start()
+        return gait_thread
+
+def _run_once(move):
+    """Queue move(stop) like a gait, so nothing else drives the servos meanwhile, and wait for it."""
+    _start_gait(move).join()
 
 @app.route('/forward')
 def forward():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['forward'] = True
-    Thread(target=walk_forward_loop, daemon=True).start()
+    _start_gait(walk_forward_loop)
     return "Moving forward (crawl gait)..."
 
 @app.route('/backward')
 def backward():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['backward'] = True
-    Thread(target=walk_backward_loop, daemon=True).start()
+    _start_gait(walk_backward_loop)
     return "Moving backward (crawl gait)..."
 
 @app.route('/left')
 def left():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['left'] = True
-    Thread(target=turn_left_loop, daemon=True).start()
+    _start_gait(turn_left_loop)
     return "Turning left..."
 
 @app.route('/right')
 def right():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['right'] = True
-    Thread(target=turn_right_loop, daemon=True).start()
+    _start_gait(turn_right_loop)
     return "Turning right..."
 
 @app.route('/trot_sync')
 def trot_sync():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['trot_sync'] = True
-    Thread(target=trot_forward_loop_sync, daemon=True).start()
+    _start_gait(trot_forward_loop_sync)
     return "Trot (locked synchronization) started..."
 
 @app.route('/trot_sync_step')
 def trot_sync_step():
-    _stop_all_flags(); time.sleep(0.05)
-    setup_pose_bias_back()
-    trot_step_forward_sync(DIAG_A, DIAG_B)  # Phase 1
-    trot_step_forward_sync(DIAG_B, DIAG_A)  # Phase 2
-    setup()
+    def once(stop):
+        setup_pose_bias_back()
+        trot_step_forward_sync(DIAG_A, DIAG_B)  # Phase 1
+        trot_step_forward_sync(DIAG_B, DIAG_A)  # Phase 2
+        _park()
+    _run_once(once)
     return "Single locked-synchronization trot cycle done."
 
 @app.route('/trot')
 def trot():
-    if any(movement_flag.values()):
-        _stop_all_flags(); time.sleep(0.1)
-    movement_flag['trot'] = True
-    Thread(target=trot_forward_loop, daemon=True).start()
+    _start_gait(trot_forward_loop)
     return "Trot (legacy) started..."
 
 @app.route('/trot_step')
 def trot_step():
-    _stop_all_flags(); time.sleep(0.05)
-    setup_pose_bias_back()
-    trot_step_forward(DIAG_A, DIAG_B)
-    trot_step_forward(DIAG_B, DIAG_A)
-    setup()
+    def once(stop):
+        setup_pose_bias_back()
+        trot_step_forward(DIAG_A, DIAG_B)
+        trot_step_forward(DIAG_B, DIAG_A)
+        _park()
+    _run_once(once)
     return "Single trot cycle (legacy) done."
 
 @app.route('/step')
 def step():
-    _stop_all_flags(); time.sleep(0.05)
     order = [(LF_HIP, LF_KNEE), (RR_HIP, RR_KNEE), (RF_HIP, RF_KNEE), (LR_HIP, LR_KNEE)]
-    crawl_step_forward(order)
+    _run_once(lambda stop: crawl_step_forward(order, stop))
     return "Single forward step (crawl) done."
 
 @app.route('/stop')
 def stop():
-    _stop_all_flags()
-    setup()
+    _run_once(lambda stop: _park())
     return "Stopping and parking neutral."
 
 # ===================== Main =====================
-if __name__ == "__main__":
-    setup()
-    # Optional: calibrate pulse ranges per your servo datasheet (often improves reach/torque and linearity)
+def startup():
+    """One-time process setup; run from __main__ or gunicorn.conf.py's post_worker_init."""
+    # Optional: calibrate pulse ranges per your servo datasheet (often improves reach/torque and linearity);
+    # servo writes bypass ServoKit, so use servo_common.set_pulse_range before setup()
     # for ch in [LF_HIP, RF_HIP, LR_HIP, RR_HIP, LF_KNEE, RF_KNEE, LR_KNEE, RR_KNEE]:
-    #     kit.servo[ch].set_pulse_width_range(500, 2500)
-    app.run(host='0.0.0.0', port=5000)
+    #     set_pulse_range(ch, 500, 2500)
+    setup()
+
+if __name__ == "__main__":
+    startup()
+    # Development server; for production use `gunicorn -c gunicorn.conf.py moving:app`
+    app.run(host='0.0.0.0', port=5000, threaded=True)
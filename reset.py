@@ -1,81 +1,12 @@
-import time
-from adafruit_servokit import ServoKit
-
-kit = ServoKit(channels=16)
-
-kit.servo[0].angle = 180
-kit.continuous_servo[1].throttle = 1
-time.sleep(1)
-
-kit.continuous_servo[1].throttle = -1
-time.sleep(1)
-
-kit.servo[0].angle = 0
-kit.continuous_servo[1].throttle = 0
-time.sleep(1)
-
-kit.servo[0].angle = None
-
-def stop_signal(kit, channel):
-    pwm = kit._pca
-    pwm.channels[channel].duty_cycle = 0 
-
-stop_signal(kit, 1)
-
-
-kit.servo[2].angle = 180
-kit.continuous_servo[3].throttle = 1
-time.sleep(1)
-
-kit.continuous_servo[3].throttle = -1
-time.sleep(1)
-
-kit.servo[2].angle = 0
-kit.continuous_servo[3].throttle = 0
-time.sleep(1)
-
-kit.servo[2].angle = None
-
-def stop_signal(kit, channel):
-    pwm = kit._pca
-    pwm.channels[channel].duty_cycle = 0 
-
-stop_signal(kit, 3)
-
-kit.servo[8].angle = 180
-kit.continuous_servo[9].throttle = 1
-time.sleep(1)
-
-kit.continuous_servo[9].throttle = -1
-time.sleep(1)
-
-kit.servo[8].angle = 0
-kit.continuous_servo[9].throttle = 0
-time.sleep(1)
-
-kit.servo[8].angle = None
-
-def stop_signal(kit, channel):
-    pwm = kit._pca
-    pwm.channels[channel].duty_cycle = 0 
-
-stop_signal(kit, 9)
-
-kit.servo[10].angle = 180
-kit.continuous_servo[11].throttle = 1
-time.sleep(1)
-
-kit.continuous_servo[11].throttle = -1
-time.sleep(1)
-
-kit.servo[10].angle = 0
-kit.continuous_servo[11].throttle = 0
-time.sleep(1)
-
-kit.servo[10].angle = None
-
-def stop_signal(kit, channel):
-    pwm = kit._pca
-    pwm.channels[channel].duty_cycle = 0 
-
-stop_signal(kit, 11)
+from servo_common import broadcast_final_stop, get_kit, merge_events, pair_events, play_events, run_realtime
+
+kit = get_kit()
+
+# All four legs run their sequence at the same time; steps that land on the
+# same tick are written together, and the final stop is one broadcast
+run_realtime(play_events, kit._pca, broadcast_final_stop(merge_events(
+    pair_events(0, 1),
+    pair_events(2, 3),
+    pair_events(8, 9),
+    pair_events(10, 11),
+)))
@@ -0,0 +1,524 @@
+from array import array
+import ctypes
+import fcntl
+import os
+import selectors
+import struct
+import threading
+import time
+
+try:
+    from smbus2 import SMBus, i2c_msg
+except ImportError:
+    SMBus = None
+
+# PCA9685 registers (auto-increment is enabled by the Adafruit driver)
+MODE1 = 0x00
+MODE1_AI = 0x20
+MODE1_SLEEP = 0x10
+LED0_ON_L = 0x06
+ALL_LED_ON_L = 0xFA
+ALL_LED_OFF_H = 0xFD
+FULL_OFF = 0x10
+OFF = FULL_OFF << 8  # 16-bit OFF count with the FULL_OFF bit set
+ALL = "all"  # key in a {channel: count} dict that addresses every channel
+
+# ServoKit defaults: 50 Hz from the 25 MHz oscillator, 750-2250 us pulses.
+# Digital servos accept a faster frame (SERVO_PWM_HZ=200 cuts the wait for
+# a new pulse 4x); leave analog servos at 50, many misbehave above ~60 Hz.
+# Set before import: every angle table below is built for this rate.
+SERVO_PWM_HZ = int(os.environ.get("SERVO_PWM_HZ", "50"))
+PWM_FREQUENCY = 25_000_000 / 4096 / int(25_000_000 / 4096 / SERVO_PWM_HZ + 0.5)
+MIN_PULSE = 750
+MAX_PULSE = 2250
+ACTUATION_RANGE = 180
+
+# i2c-dev ioctls; the PCA9685 never clock-stretches, so fail fast
+I2C_BUS = 1
+I2C_FREQUENCY = 1_000_000
+I2C_FAST_MODE = 400_000  # below this the bus, not RAMP_DELAY, sets ramp timing
+I2C_RETRIES = 0x0701
+I2C_TIMEOUT = 0x0702  # units of 10 ms
+
+def tune_i2c_adapter(bus=I2C_BUS):
+    """Turn off retries and shorten the timeout on the kernel I2C adapter."""
+    try:
+        fd = os.open(f"/dev/i2c-{bus}", os.O_RDWR)
+    except OSError as e:
+        print(f"[WARN] could not open /dev/i2c-{bus}: {e}")
+        return
+    try:
+        fcntl.ioctl(fd, I2C_RETRIES, 0)
+        fcntl.ioctl(fd, I2C_TIMEOUT, 1)
+    except OSError as e:
+        print(f"[WARN] could not tune /dev/i2c-{bus}: {e}")
+    finally:
+        os.close(fd)
+
+def bus_clock_hz(bus=I2C_BUS):
+    """Return the kernel's configured I2C clock for a bus, or None if unknown."""
+    try:
+        with open(f"/sys/class/i2c-adapter/i2c-{bus}/of_node/clock-frequency", "rb") as f:
+            return struct.unpack(">I", f.read(4))[0]
+    except (OSError, struct.error):
+        return None
+
+def check_mode1(pca):
+    """Read MODE1 back after setup; bursts need auto-increment on and the oscillator awake."""
+    try:
+        mode = pca.mode1_reg
+    except OSError as e:
+        print("[WARN] could not read PCA9685 MODE1:", e)
+        return False
+    if mode & MODE1_SLEEP or not mode & MODE1_AI:
+        print(f"[WARN] PCA9685 MODE1 is 0x{mode:02x}; expected auto-increment on and not sleeping")
+        return False
+    return True
+
+_i2c = None
+_KITS = {}
+
+def get_kit(address=0x40):
+    """Return the shared ServoKit for a PCA9685 address, creating it on first use."""
+    global _i2c
+    kit = _KITS.get(address)
+    if kit is None:
+        # Blinka is imported here so importing this module never touches the hardware
+        import busio
+        from board import SCL, SDA
+        from adafruit_servokit import ServoKit
+        if _i2c is None:
+            tune_i2c_adapter()
+            # PCA9685 supports 1 MHz fast-mode-plus; on the Pi also set
+            # dtparam=i2c_arm_baudrate=1000000 in /boot/config.txt
+            _i2c = busio.I2C(SCL, SDA, frequency=I2C_FREQUENCY)
+            hz = bus_clock_hz()
+            if hz is not None and hz < I2C_FREQUENCY:
+                mode = " (standard mode: each servo write costs ~0.3 ms)" if hz < I2C_FAST_MODE else ""
+                print(f"[WARN] I2C bus clock is {hz // 1000} kHz{mode}; set "
+                      f"dtparam=i2c_arm_baudrate={I2C_FREQUENCY} in /boot/config.txt")
+        _KITS[address] = kit = ServoKit(channels=16, i2c=_i2c, address=address,
+                                         frequency=SERVO_PWM_HZ)
+        check_mode1(kit._pca)
+    return kit
+
+def _duty_range(min_pulse, max_pulse):
+    """(min duty, duty range) in ServoKit's 16-bit units for a pulse range in us."""
+    min_duty = int((min_pulse * PWM_FREQUENCY) / 1000000 * 0xFFFF)
+    return min_duty, int((max_pulse * PWM_FREQUENCY) / 1000000 * 0xFFFF - min_duty)
+
+_MIN_DUTY, _DUTY_RANGE = _duty_range(MIN_PULSE, MAX_PULSE)
+
+def _duty_for_fraction(fraction, min_duty=_MIN_DUTY, duty_range=_DUTY_RANGE):
+    """Convert a 0-1 pulse fraction to a 12-bit PCA9685 OFF count."""
+    duty_cycle = min_duty + int(fraction * duty_range)
+    return (duty_cycle + 1) >> 4
+
+def _angle_lut(min_duty=_MIN_DUTY, duty_range=_DUTY_RANGE):
+    """OFF count for every whole-degree angle, indexed by angle."""
+    return array("H", (_duty_for_fraction(a / ACTUATION_RANGE, min_duty, duty_range)
+                       for a in range(ACTUATION_RANGE + 1)))
+
+# Every whole-degree angle is worked out once at import; gaits only use these.
+# Channels share the default table until set_pulse_range() calibrates one.
+_DUTY_ANGLE = _angle_lut()
+_CHANNEL_RANGE = [(_MIN_DUTY, _DUTY_RANGE)] * 16
+_CHANNEL_DUTY = [_DUTY_ANGLE] * 16
+_DUTY_THROTTLE = {t: _duty_for_fraction((t + 1) / 2) for t in (-1, 0, 1)}
+
+def set_pulse_range(channel, min_pulse, max_pulse):
+    """Calibrate one channel, like kit.servo[n].set_pulse_width_range(min_pulse, max_pulse)."""
+    _CHANNEL_RANGE[channel] = rng = _duty_range(min_pulse, max_pulse)
+    _CHANNEL_DUTY[channel] = _angle_lut(*rng)
+
+def duty_for_angle(angle, channel=None):
+    """Same count kit.servo[n].angle = angle would write, using channel's calibration if given."""
+    if channel is None:
+        lut, rng = _DUTY_ANGLE, (_MIN_DUTY, _DUTY_RANGE)
+    else:
+        lut, rng = _CHANNEL_DUTY[channel], _CHANNEL_RANGE[channel]
+    if type(angle) is int and 0 <= angle <= ACTUATION_RANGE:
+        return lut[angle]
+    return _duty_for_fraction(angle / ACTUATION_RANGE, *rng)
+
+def duty_for_throttle(throttle):
+    """Same count kit.continuous_servo[n].throttle = throttle would write."""
+    duty = _DUTY_THROTTLE.get(throttle)
+    return duty if duty is not None else _duty_for_fraction((throttle + 1) / 2)
+
+# ===================== Raw writes =====================
+# With smbus2 installed, register writes skip Blinka's busio wrapper and go
+# to i2c-dev as one I2C_RDWR ioctl. Callers still hold pca.i2c_device so
+# other users of the Blinka bus stay locked out.
+_smbus = None
+_writers = {}
+
+class _SMBusWriter:
+    def __init__(self, bus, address):
+        self._bus = bus
+        self._address = address
+
+    def write(self, buf):
+        # i2c_msg has no 32-byte SMBus block limit, so a full frame fits
+        self._bus.i2c_rdwr(i2c_msg.write(self._address, buf))
+
+    def write_many(self, bufs):
+        # One ioctl; the kernel joins the messages with repeated STARTs
+        self._bus.i2c_rdwr(*(i2c_msg.write(self._address, buf) for buf in bufs))
+
+def _raw(pca, i2c):
+    """Return the fastest writer for the board; i2c must already be locked."""
+    global _smbus
+    if SMBus is None:
+        return i2c
+    writer = _writers.get(pca)
+    if writer is None:
+        if _smbus is None:
+            _smbus = SMBus(I2C_BUS)
+        writer = _writers[pca] = _SMBusWriter(_smbus, pca.i2c_device.device_address)
+    return writer
+
+# ===================== Register shadow =====================
+# Last LED register contents written to each board, so a burst can run
+# straight through channels whose value is already known and repeated
+# writes of the same value can be dropped. This only holds while every
+# write to the board goes through this module; call forget_shadow() after
+# touching it through kit.servo / kit.continuous_servo.
+_shadows = {}
+
+def _shadow(pca):
+    """Return (64-byte LED register frame, set of known channels) for a board."""
+    shadow = _shadows.get(pca)
+    if shadow is None:
+        shadow = _shadows[pca] = (bytearray(64), set())
+    return shadow
+
+def forget_shadow(pca):
+    """Drop what is known about a board's registers."""
+    _shadows.pop(pca, None)
+
+def _prime_shadow(i2c, pca):
+    """Read all 16 channels' LED registers into the shadow; i2c must already be locked.
+
+    Once every channel is known, any set of changes can go out as a single
+    burst from the lowest to the highest changed channel.
+    """
+    frame, known = _shadow(pca)
+    regs = bytearray(64)
+    try:
+        i2c.write_then_readinto(bytes([LED0_ON_L]), regs)
+    except OSError as e:
+        print("[WARN] could not read PCA9685 registers:", e)
+        return
+    for ch in range(16):
+        if ch not in known:
+            frame[4 * ch:4 * ch + 4] = regs[4 * ch:4 * ch + 4]
+    known.update(range(16))
+
+# One channel's LED registers (ON count 0, OFF count), pre-packed for every
+# 12-bit count plus the FULL_OFF pattern, and each channel's start register
+_REG = struct.Struct("<HH")
+_REGS = [_REG.pack(0, d) for d in range(OFF + 1)]
+_REG_ADDR = [bytes([LED0_ON_L + 4 * ch]) for ch in range(16)]
+
+def _write_runs(i2c, pca, duties):
+    """Write {channel: count}, one auto-incremented burst per run of adjacent channels.
+
+    Gaps between changed channels are bridged when the shadow already holds
+    the gap's registers, so e.g. channels 0 and 2 go out as one burst. The
+    shadow is read back from the board on first use, so after that every
+    tick is one burst.
+    """
+    frame, known = _shadow(pca)
+    if len(known) < 16:
+        _prime_shadow(i2c, pca)
+    i2c = _raw(pca, i2c)
+    bufs = []
+    if ALL in duties:
+        regs = _REGS[duties[ALL]]
+        if len(known) < 16 or frame != regs * 16:
+            bufs.append(bytes([ALL_LED_ON_L]) + regs)
+            frame[:] = regs * 16
+            known.update(range(16))
+        duties = {ch: d for ch, d in duties.items() if ch != ALL}
+    if len(known) == 16:
+        # Whole board known: the changed channels always go out as one
+        # burst from the lowest to the highest
+        lo = hi = None
+        for ch, d in duties.items():
+            if frame[4 * ch:4 * ch + 4] != _REGS[d]:
+                _REG.pack_into(frame, 4 * ch, 0, d)
+                if lo is None or ch < lo:
+                    lo = ch
+                if hi is None or ch > hi:
+                    hi = ch
+        if lo is not None:
+            bufs.append(_REG_ADDR[lo] + frame[4 * lo:4 * hi + 4])
+        duties = {}
+    duties = {ch: d for ch, d in duties.items()
+              if ch not in known or frame[4 * ch:4 * ch + 4] != _REGS[d]}
+    for ch, d in duties.items():
+        _REG.pack_into(frame, 4 * ch, 0, d)
+    known.update(duties)
+    runs = []
+    for ch in sorted(duties):
+        if runs and all(c in known for c in range(runs[-1][1] + 1, ch)):
+            runs[-1][1] = ch
+        else:
+            runs.append([ch, ch])
+    for lo, hi in runs:
+        bufs.append(_REG_ADDR[lo] + frame[4 * lo:4 * hi + 4])
+    if not bufs:
+        return
+    if len(bufs) > 1 and hasattr(i2c, "write_many"):
+        i2c.write_many(bufs)
+    else:
+        for buf in bufs:
+            i2c.write(buf)
+
+# ===================== Tick frames =====================
+# Updates for the next control tick, per board. Anything staged before a
+# commit (from any thread: a gait ramp and a stop handler, say) goes out in
+# that commit's single burst instead of each caller framing its own write.
+_frames = {}
+_frames_lock = threading.Lock()
+
+def stage(pca, duties):
+    """Queue {channel: count} updates for the board's next commit(); later values win."""
+    with _frames_lock:
+        frame = _frames.setdefault(pca, {})
+        if ALL in duties:
+            frame.clear()  # the broadcast replaces anything staged before it
+        frame.update(duties)
+
+def commit(pca):
+    """Write everything staged for the board as one tick."""
+    # Bus lock first, so frames reach the board in the order they were taken
+    with pca.i2c_device as i2c:
+        with _frames_lock:
+            duties = _frames.pop(pca, None)
+        if duties:
+            _write_runs(i2c, pca, duties)
+
+def write_channels(pca, duties):
+    """Write raw 12-bit OFF counts to several channels at once, as one tick frame."""
+    stage(pca, duties)
+    commit(pca)
+
+_ANGLE_DUTY = {d: a for a, d in enumerate(_DUTY_ANGLE)}
+
+def angle_of(pca, channel):
+    """Angle the channel was last set to, from the register shadow; None if off or unknown.
+
+    Same value kit.servo[n].angle would read back, without an I2C read
+    once the shadow has been primed.
+    """
+    frame, known = _shadow(pca)
+    if len(known) < 16:
+        with pca.i2c_device as i2c:
+            _prime_shadow(i2c, pca)
+        if channel not in known:
+            return None
+    off = frame[4 * channel + 2] | frame[4 * channel + 3] << 8
+    # Power-on registers read 0 (no pulse), which is no angle at all
+    if off == 0 or off & (FULL_OFF << 8):
+        return None
+    angle = _ANGLE_DUTY.get(off) if _CHANNEL_DUTY[channel] is _DUTY_ANGLE else None
+    if angle is None:
+        min_duty, duty_range = _CHANNEL_RANGE[channel]
+        angle = ACTUATION_RANGE * ((off << 4) - min_duty) / duty_range
+        if not 0 <= angle <= ACTUATION_RANGE:
+            return None  # a pulse this servo's range cannot produce
+    return angle
+
+def write_angles(pca, angles):
+    """Write {channel: angle} the way kit.servo[n].angle would, in as few bursts as possible."""
+    write_channels(pca, {ch: duty_for_angle(a, ch) for ch, a in angles.items()})
+
+def stop_all(kit):
+    """Force every channel fully off through the ALL_LED_OFF_H register."""
+    with kit._pca.i2c_device as i2c:
+        _raw(kit._pca, i2c).write(bytes([ALL_LED_OFF_H, FULL_OFF]))
+    frame, _ = _shadow(kit._pca)
+    frame[3::4] = bytes([FULL_OFF]) * 16
+
+# ===================== Waiting =====================
+# Schedules wait on a selector rather than time.sleep, so file descriptors
+# (GPIO edges, sockets, ...) registered here get serviced during the dwell.
+_selector = selectors.DefaultSelector()
+
+def add_reader(fileobj, callback):
+    """Call callback(fileobj) whenever fileobj is readable during a schedule's wait.
+
+    Callbacks run while play_events holds the bus lock, so they must not
+    touch the PCA9685.
+    """
+    _selector.register(fileobj, selectors.EVENT_READ, callback)
+
+def remove_reader(fileobj):
+    _selector.unregister(fileobj)
+
+def wait(seconds):
+    """Block for the given time, dispatching any registered readers."""
+    deadline = time.monotonic() + seconds
+    remaining = seconds
+    while remaining > 0:
+        for key, _ in _selector.select(remaining):
+            key.data(key.fileobj)
+        remaining = deadline - time.monotonic()
+
+# Last stretch before a deadline is spun rather than slept, since the
+# scheduler can wake a sleeper a millisecond or more late
+SPIN_MARGIN = 0.0005
+
+def wait_until(deadline):
+    """sleep_until for schedules: the coarse part is a selector wait(), so readers run during it."""
+    remaining = deadline - time.monotonic() - SPIN_MARGIN
+    if remaining > 0:
+        wait(remaining)
+    while time.monotonic() < deadline:
+        pass
+
+def sleep_until(deadline, stop=None):
+    """Block until time.monotonic() reaches deadline, spinning for the final SPIN_MARGIN.
+
+    With a stop Event, return True as soon as it is set instead of waiting out
+    the deadline.
+    """
+    remaining = deadline - time.monotonic() - SPIN_MARGIN
+    if stop is not None and (stop.wait(remaining) if remaining > 0 else stop.is_set()):
+        return True
+    if stop is None and remaining > 0:
+        time.sleep(remaining)
+    while time.monotonic() < deadline:
+        pass
+    return False
+
+# ===================== Event schedules =====================
+# A schedule is a list of (seconds from start, {channel: count}) sorted by time.
+
+# Dwell after a step: the longest of what it asked for
+SERVO_SETTLE = 0.4  # hobby servo end-to-end travel
+CR_RUN = 1.0        # how long the continuous servo spins in each direction
+
+def pair_events(servo_ch, cs_ch):
+    """Leg test sequence for one servo/continuous-servo pair."""
+    steps = [
+        ({servo_ch: duty_for_angle(180), cs_ch: duty_for_throttle(1)}, max(SERVO_SETTLE, CR_RUN)),
+        ({cs_ch: duty_for_throttle(-1)}, CR_RUN),
+        ({servo_ch: duty_for_angle(0), cs_ch: duty_for_throttle(0)}, SERVO_SETTLE),
+        ({servo_ch: OFF, cs_ch: OFF}, 0),
+    ]
+    events = []
+    t = 0.0
+    for duties, dwell in steps:
+        events.append((t, duties))
+        t += dwell
+    return events
+
+def merge_events(*schedules):
+    """Combine schedules so writes that share a timestamp go out together."""
+    merged = {}
+    for events in schedules:
+        for t, duties in events:
+            merged.setdefault(t, {}).update(duties)
+    return sorted(merged.items())
+
+def broadcast_final_stop(events):
+    """Turn a final all-OFF tick into a single ALL_LED write.
+
+    Only use this when the schedule owns every channel on the board.
+    """
+    t, duties = events[-1]
+    if all(d == OFF for d in duties.values()):
+        return events[:-1] + [(t, {ALL: OFF})]
+    return events
+
+def play_events(pca, events):
+    """Replay a schedule against absolute deadlines.
+
+    The bus lock is taken once for the whole schedule, so nothing else in
+    the process can use the I2C bus until it finishes.
+    """
+    with pca.i2c_device as i2c:
+        t0 = time.monotonic()
+        for t, duties in events:
+            wait_until(t0 + t)
+            _write_runs(i2c, pca, duties)
+
+def loop_events(pca, events, period, running):
+    """Replay a schedule every period seconds, on absolute deadlines, while running() is true.
+
+    running() is checked before each write, so a stop takes effect within one
+    step of the schedule.
+
+    The bus lock is taken per tick so other threads (e.g. a stop handler)
+    can still write between steps. A cycle that overruns restarts the clock
+    instead of firing the missed steps back to back.
+    """
+    t0 = time.monotonic()
+    while running():
+        for t, duties in events:
+            wait_until(t0 + t)
+            # Checked before every write, so nothing lands after a stop
+            if not running():
+                return
+            write_channels(pca, duties)
+        t0 += period
+        now = time.monotonic()
+        if now > t0:
+            t0 = now
+
+RT_PRIORITY = 80
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+def make_realtime(priority=RT_PRIORITY, cpu=None):
+    """Put the calling thread on SCHED_FIFO, optionally pinned to one CPU.
+
+    Needs root or CAP_SYS_NICE; otherwise the thread stays at normal priority.
+    """
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        if cpu is not None:
+            os.sched_setaffinity(0, {cpu})
+    except (AttributeError, OSError) as e:
+        print("[WARN] real-time scheduling unavailable:", e)
+        return False
+    return True
+
+def lock_memory():
+    """mlockall the process, so a page fault never stalls a real-time thread mid-gait."""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+    except (AttributeError, OSError) as e:
+        print("[WARN] could not lock memory:", e)
+        return False
+    return True
+
+def run_realtime(fn, *args, priority=RT_PRIORITY, cpu=None):
+    """Run fn(*args) on a SCHED_FIFO thread, optionally pinned to one CPU, and wait for it.
+
+    Needs root or CAP_SYS_NICE; otherwise fn runs at normal priority.
+    """
+    error = []
+
+    def runner():
+        make_realtime(priority, cpu)
+        try:
+            fn(*args)
+        except BaseException as e:
+            error.append(e)
+
+    t = threading.Thread(target=runner)
+    t.start()
+    t.join()
+    if error:
+        raise error[0]
+
+def run_pair(servo_ch, cs_ch):
+    """Run the leg test sequence on one pair using the shared kit."""
+    run_realtime(play_events, get_kit()._pca, pair_events(servo_ch, cs_ch))
@@ -1,8 +1,7 @@
-import time
-from adafruit_servokit import ServoKit
+from servo_common import get_kit, write_angles
 
 # Initialize ServoKit with 16 channels
-kit = ServoKit(channels=16)
+kit = get_kit()
 
 # Define servo channels
 LEG1F_CHANNEL = 0  # Front Left Forward
@@ -14,20 +13,16 @@ LEG3B_CHANNEL = 3  # Back Left Backward
 LEG4F_CHANNEL = 10 # Back Right Forward
 LEG4B_CHANNEL = 11 # Back Right Backward
 
+LEG_CHANNELS = (LEG1F_CHANNEL, LEG1B_CHANNEL, LEG2F_CHANNEL, LEG2B_CHANNEL,
+                LEG3F_CHANNEL, LEG3B_CHANNEL, LEG4F_CHANNEL, LEG4B_CHANNEL)
+
 def setup():
     """Initialize default servo positions."""
     set_all_servos(180)
 
 def set_all_servos(angle):
-    """Set all servos to the same angle."""
-    kit.servo[LEG1F_CHANNEL].angle = angle
-    kit.servo[LEG1B_CHANNEL].angle = angle
-    kit.servo[LEG2F_CHANNEL].angle = angle
-    kit.servo[LEG2B_CHANNEL].angle = angle
-    kit.servo[LEG3F_CHANNEL].angle = angle
-    kit.servo[LEG3B_CHANNEL].angle = angle
-    kit.servo[LEG4F_CHANNEL].angle = angle
-    kit.servo[LEG4B_CHANNEL].angle = angle
+    """Set the eight leg servos to the same angle in one burst."""
+    write_angles(kit._pca, dict.fromkeys(LEG_CHANNELS, angle))
 
 if __name__ == "__main__":
     setup()
@@ -0,0 +1,209 @@
+function sendCmd(path){
+  fetch('/' + path);
+  appendBubble('system', 'Executing: ' + path);
+}
+function appendBubble(kind, text){
+  const box = document.getElementById('chatbox');
+  const div = document.createElement('div');
+  div.className = 'msg ' + (kind || 'bot');
+  div.textContent = text;
+  box.appendChild(div);
+  box.scrollTop = box.scrollHeight;
+}
+async function ask(){
+  const input = document.getElementById('msg');
+  const text = input.value.trim();
+  if(!text) return;
+  appendBubble('user', text);
+  input.value = '';
+  const resp = await fetch('/ask', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({text})});
+  if ((resp.headers.get('Content-Type') || '').includes('application/json')){
+    const data = await resp.json();
+    if (data.robot_action) appendBubble('system', 'Executing: ' + data.robot_action);
+    appendBubble('bot', data.reply || '(no response)');
+    return;
+  }
+  // Language-model replies stream in as plain text
+  const action = resp.headers.get('X-Robot-Action');
+  if (action) appendBubble('system', 'Executing: ' + action);
+  appendBubble('bot', '');
+  const box = document.getElementById('chatbox');
+  const bubble = box.lastChild;
+  const reader = resp.body.getReader();
+  const decoder = new TextDecoder();
+  for (;;){
+    const {done, value} = await reader.read();
+    if (done) break;
+    bubble.textContent += decoder.decode(value, {stream: true});
+    box.scrollTop = box.scrollHeight;
+  }
+  if (!bubble.textContent) bubble.textContent = '(no response)';
+}
+document.getElementById('msg').addEventListener('keydown', (e)=>{ if(e.key === 'Enter') ask(); });
+
+// ======== Voice (MediaRecorder -> Deepgram live, fallback /voice_ask) ========
+// Mic chunks go straight to Deepgram's WebSocket while recording, so the
+// transcript is ready when the button is released; if a token cannot be
+// minted the whole recording is uploaded to /voice_ask as before.
+let mediaRecorder = null, chunks = [], streamRef = null, recording = false;
+let dgSocket = null, dgFinals = [], dgBubble = null, dgClosed = null;
+// Energy VAD: a take counts as speech once the mic RMS stays above the
+// threshold for VAD_MIN_MS; silent takes are never sent
+const VAD_RMS = 0.02, VAD_MIN_MS = 150, VAD_TICK_MS = 30, MIN_BLOB_BYTES = 4096;
+let vad = null;
+function startVad(stream){
+  try {
+    const ctx = new (window.AudioContext || window.webkitAudioContext)();
+    const analyser = ctx.createAnalyser();
+    analyser.fftSize = 1024;
+    ctx.createMediaStreamSource(stream).connect(analyser);
+    const buf = new Float32Array(analyser.fftSize);
+    const state = { ctx, speechMs: 0, hadSpeech: false };
+    state.timer = setInterval(() => {
+      analyser.getFloatTimeDomainData(buf);
+      let sum = 0;
+      for (let i = 0; i < buf.length; i++) sum += buf[i] * buf[i];
+      if (Math.sqrt(sum / buf.length) > VAD_RMS){
+        state.speechMs += VAD_TICK_MS;
+        if (state.speechMs >= VAD_MIN_MS) state.hadSpeech = true;
+      } else {
+        state.speechMs = 0;
+      }
+    }, VAD_TICK_MS);
+    return state;
+  } catch (e){
+    return null;  // no Web Audio: send everything, as before
+  }
+}
+function stopVad(){
+  if (vad){ clearInterval(vad.timer); vad.ctx.close(); vad = null; }
+}
+// Speech needs no more than 16 kHz mono; ~24 kbps Opus is a quarter of the
+// browser's default upload and Deepgram still decodes it natively
+const MIC_CONSTRAINTS = { audio: { channelCount: 1, sampleRate: 16000, echoCancellation: true, noiseSuppression: true } };
+const VOICE_BITRATE = 24000;
+function pickSupportedMime(){
+  // Opus in a container Deepgram reads natively; the server never decodes it
+  const candidates = ['audio/ogg;codecs=opus','audio/webm;codecs=opus','audio/webm','audio/mp4'];
+  for (const t of candidates){
+    if (MediaRecorder.isTypeSupported && MediaRecorder.isTypeSupported(t)) return t;
+  }
+  return '';
+}
+async function toggleRec(){
+  if (recording){ stopRec(); } else { await startRec(); }
+}
+async function openDeepgram(){
+  try {
+    const resp = await fetch('/dg_token');
+    if (!resp.ok) return null;
+    const data = await resp.json();
+    const url = 'wss://api.deepgram.com/v1/listen?' + new URLSearchParams(data.params);
+    const ws = new WebSocket(url, ['bearer', data.token]);
+    dgFinals = [];
+    dgBubble = null;
+    dgClosed = new Promise(resolve => { ws.onclose = resolve; ws.onerror = resolve; });
+    ws.onmessage = (e) => {
+      const msg = JSON.parse(e.data);
+      const alt = msg.channel && msg.channel.alternatives && msg.channel.alternatives[0];
+      if (!alt || !alt.transcript) return;
+      if (msg.is_final) dgFinals.push(alt.transcript);
+      // Deepgram thinks the utterance ended: let the server start the reply early
+      if (msg.speech_final) fetch('/voice_prefetch', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({transcript: dgFinals.join(' ').trim()})});
+      const text = dgFinals.join(' ') + (msg.is_final ? '' : ' ' + alt.transcript);
+      if (!dgBubble){ appendBubble('user', ''); dgBubble = document.getElementById('chatbox').lastChild; }
+      dgBubble.textContent = text.trim();
+    };
+    return ws;
+  } catch (e){
+    return null;
+  }
+}
+async function startRec(){
+  const micBtn = document.getElementById('micBtn');
+  try {
+    const mimeType = pickSupportedMime();
+    streamRef = await navigator.mediaDevices.getUserMedia(MIC_CONSTRAINTS);
+    vad = startVad(streamRef);
+    dgSocket = await openDeepgram();
+    const recOpts = { audioBitsPerSecond: VOICE_BITRATE };
+    if (mimeType) recOpts.mimeType = mimeType;
+    mediaRecorder = new MediaRecorder(streamRef, recOpts);
+    chunks = [];
+    mediaRecorder.ondataavailable = e => {
+      if (!e.data || e.data.size === 0) return;
+      chunks.push(e.data);
+      if (dgSocket && dgSocket.readyState === WebSocket.OPEN){
+        // Send everything not yet sent (chunks queued while connecting too)
+        while (dgSocket.sentCount < chunks.length) dgSocket.send(chunks[dgSocket.sentCount++]);
+      }
+    };
+    if (dgSocket) dgSocket.sentCount = 0;
+    mediaRecorder.onstop = async () => {
+      const chosenType = mediaRecorder.mimeType || 'audio/webm';
+      const blob = new Blob(chunks, { type: chosenType });
+      const ws = dgSocket;
+      const streamed = ws && ws.readyState === WebSocket.OPEN && ws.sentCount === chunks.length;
+      const hadSpeech = !vad || vad.hadSpeech;
+      chunks = [];
+      dgSocket = null;
+      if (!hadSpeech || blob.size < MIN_BLOB_BYTES){
+        if (ws) ws.close();
+        if (dgBubble){ dgBubble.remove(); dgBubble = null; }
+        appendBubble('system', '(silence)');
+      } else if (streamed){
+        ws.send(JSON.stringify({ type: 'CloseStream' }));
+        await Promise.race([dgClosed, new Promise(r => setTimeout(r, 3000))]);
+        await sendTranscript(dgFinals.join(' ').trim());
+      } else {
+        if (ws) ws.close();
+        if (dgBubble){ dgBubble.remove(); dgBubble = null; }
+        await sendVoiceBlob(blob);
+      }
+      cleanupStream();
+    };
+    mediaRecorder.start(250);
+    recording = true;
+    micBtn.classList.add('active');
+  } catch (err) {
+    appendBubble('system', 'Microphone error: ' + err);
+    cleanupStream();
+  }
+}
+function stopRec(){
+  const micBtn = document.getElementById('micBtn');
+  if (mediaRecorder && mediaRecorder.state === 'recording') { mediaRecorder.stop(); }
+  else { cleanupStream(); }
+  recording = false;
+  micBtn.classList.remove('active');
+}
+function cleanupStream(){
+  if (streamRef){ streamRef.getTracks().forEach(t => t.stop()); streamRef = null; }
+  if (dgSocket){ dgSocket.close(); dgSocket = null; }
+  stopVad();
+  mediaRecorder = null;
+}
+function showVoiceReply(data, transcriptShown){
+  if (data.transcript && !transcriptShown) appendBubble('user', data.transcript);
+  if (data.robot_action) appendBubble('system', 'Executing: ' + data.robot_action);
+  appendBubble('bot', data.reply || '(no response)');
+}
+async function sendTranscript(transcript){
+  try {
+    const resp = await fetch('/voice_text', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({transcript})});
+    showVoiceReply(await resp.json(), !!dgBubble);
+  } catch (e){
+    appendBubble('system', 'Voice send error: ' + e);
+  }
+  dgBubble = null;
+}
+async function sendVoiceBlob(blob){
+  const form = new FormData();
+  form.append('audio', blob, 'voice');
+  try {
+    const resp = await fetch('/voice_ask', { method: 'POST', body: form });
+    showVoiceReply(await resp.json(), false);
+  } catch (e){
+    appendBubble('system', 'Voice send error: ' + e);
+  }
+}
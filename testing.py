@@ -1,17 +1,18 @@
+import sys
 import time
-from adafruit_servokit import ServoKit
+from servo_common import get_kit, write_angles
 
-kit = ServoKit(channels=16)
+kit = get_kit()
 
 
-LEG1F_CHANNEL = 0  
-LEG1B_CHANNEL = 1 
-LEG2F_CHANNEL = 8  
-LEG2B_CHANNEL = 9  
-LEG3F_CHANNEL = 2  
-LEG3B_CHANNEL = 3  
-LEG4F_CHANNEL = 10 
-LEG4B_CHANNEL = 11 
+LEG1F_CHANNEL = 0
+LEG1B_CHANNEL = 1
+LEG2F_CHANNEL = 8
+LEG2B_CHANNEL = 9
+LEG3F_CHANNEL = 2
+LEG3B_CHANNEL = 3
+LEG4F_CHANNEL = 10
+LEG4B_CHANNEL = 11
 
 servo_channels = {
     "LEG1F_CHANNEL": LEG1F_CHANNEL,
@@ -24,19 +25,40 @@ servo_channels = {
     "LEG4B_CHANNEL": LEG4B_CHANNEL
 }
 
-def test_servo(channel_name, channel, angle):
+# (angle, seconds to watch) for each stage of the sweep
+TEST_SEQUENCE = [(90, 2), (0, 2), (180, 2)]
+
+def test_servo(channel_name, channel, angle, wait):
     print(f"Testing {channel_name} on channel {channel} with angle {angle}")
-    kit.servo[channel].angle = angle
-    time.sleep(2)  # Wait for 2 seconds to observe the servo movement
+    write_angles(kit._pca, {channel: angle})
+    time.sleep(wait)  # Wait to observe the servo movement
 
-if __name__ == "__main__":
-    for name, channel in servo_channels.items():
+def test_servos(channels):
+    """Take each channel in turn through TEST_SEQUENCE, so a miswired servo is easy to spot."""
+    for name, channel in channels.items():
         print(f"Testing {name} (channel {channel})")
-        
-        test_servo(name, channel, 90)
+        for angle, wait in TEST_SEQUENCE:
+            test_servo(name, channel, angle, wait)
 
-        test_servo(name, channel, 0)
+def sweep_servos(channels):
+    """Drive every channel through TEST_SEQUENCE together, one burst per stage."""
+    for angle, wait in TEST_SEQUENCE:
+        print(f"Testing {', '.join(channels)} with angle {angle}")
+        write_angles(kit._pca, dict.fromkeys(channels.values(), angle))
+        time.sleep(wait)  # Wait to observe the servo movement
 
-        test_servo(name, channel, 180)
+if __name__ == "__main__":
+    # python testing.py [--all] [channel]: one servo at a time by default,
+    # --all sweeps them together; with a channel, test only that servo
+    args = sys.argv[1:]
+    sweep = "--all" in args
+    if sweep:
+        args.remove("--all")
+    channels = servo_channels
+    if args:
+        ch = int(args[0])
+        names = [name for name, c in servo_channels.items() if c == ch] or [f"CHANNEL_{ch}"]
+        channels = {names[0]: ch}
+    (sweep_servos if sweep else test_servos)(channels)
 
     print("Servo testing complete.")
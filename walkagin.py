@@ -1,8 +1,9 @@
 import time
-from adafruit_servokit import ServoKit
+from functools import lru_cache
+from servo_common import duty_for_angle, get_kit, sleep_until, write_angles, write_channels
 
 # Initialize ServoKit with 16 channels
-kit = ServoKit(channels=16)
+kit = get_kit()
 
 # Define servo channels
 LEG1F_CHANNEL = 0  # Front Left Forward
@@ -14,12 +15,12 @@ LEG3B_CHANNEL = 3  # Back Left Backward
 LEG4F_CHANNEL = 10 # Back Right Forward
 LEG4B_CHANNEL = 11 # Back Right Backward
 
-# Variables for angles
-TOLeg1F, TOLeg1B, TOLeg2F, TOLeg2B = 90,90,90,90
-TOLeg3F, TOLeg3B, TOLeg4F, TOLeg4B = 90,90,90,90
+LEG_CHANNELS = (LEG1F_CHANNEL, LEG1B_CHANNEL, LEG2F_CHANNEL, LEG2B_CHANNEL,
+                LEG3F_CHANNEL, LEG3B_CHANNEL, LEG4F_CHANNEL, LEG4B_CHANNEL)
 
-LALeg1F, LALeg1B, LALeg2F, LALeg2B = 90,90,90,90
-LALeg3F, LALeg3B, LALeg4F, LALeg4B = 90,90,90,90
+# Target (TO) and last written (LA) angle per leg servo, in LEG_CHANNELS order
+TO = [90] * 8
+LA = [90] * 8
 
 # Walking parameters
 walkF = [
@@ -35,6 +36,7 @@ Bheight = 5
 walkstep = 1
 walkstep2 = 4
 smoothdelay = 2  # Smooth movement delay (milliseconds)
+STEP_PERIOD = 0.6  # Seconds from one step's start to the next (includes the smooth move)
 
 def setup():
     # Initialize default positions
@@ -42,93 +44,71 @@ def setup():
 
 def set_all_servos(angle):
     """Set all servos to the same angle."""
-    kit.servo[LEG1F_CHANNEL].angle = angle
-    kit.servo[LEG1B_CHANNEL].angle = angle
-    kit.servo[LEG2F_CHANNEL].angle = angle
-    kit.servo[LEG2B_CHANNEL].angle = angle
-    kit.servo[LEG3F_CHANNEL].angle = angle
-    kit.servo[LEG3B_CHANNEL].angle = angle
-    kit.servo[LEG4F_CHANNEL].angle = angle
-    kit.servo[LEG4B_CHANNEL].angle = angle
+    write_angles(kit._pca, dict.fromkeys(LEG_CHANNELS, angle))
 
 def walk_forward():
-    global walkstep, walkstep2, TOLeg1F, TOLeg1B, TOLeg2F, TOLeg2B
-    global TOLeg3F, TOLeg3B, TOLeg4F, TOLeg4B
+    global walkstep, walkstep2
 
     # Update step positions
     walkstep = walkstep + 1 if walkstep < 7 else 1
     walkstep2 = walkstep + 3 if walkstep + 3 <= 7 else walkstep + 3 - 7
 
-    # Update leg angles for this step
-    TOLeg1F = walkF[Fheight][walkstep - 1]
-    TOLeg1B = walkF[Fheight][walkstep2 - 1]
-    TOLeg4F = 180 - walkF[Bheight][walkstep - 1]
-    TOLeg4B = 180 - walkF[Bheight][walkstep2 - 1]
-
-    TOLeg2F = 180 - walkF[Fheight][walkstep2 - 1]
-    TOLeg2B = 180 - walkF[Fheight][walkstep - 1]
-    TOLeg3F = walkF[Bheight][walkstep - 1]
-    TOLeg3B = walkF[Bheight][walkstep2 - 1]
+    # Update leg angles for this step (LEG_CHANNELS order)
+    TO[:] = [
+        walkF[Fheight][walkstep - 1],
+        walkF[Fheight][walkstep2 - 1],
+        180 - walkF[Fheight][walkstep2 - 1],
+        180 - walkF[Fheight][walkstep - 1],
+        walkF[Bheight][walkstep - 1],
+        walkF[Bheight][walkstep2 - 1],
+        180 - walkF[Bheight][walkstep - 1],
+        180 - walkF[Bheight][walkstep2 - 1],
+    ]
 
     # Smooth transition for servo movement
     smooth_move()
 
+@lru_cache(maxsize=None)
+def _plan_move(start, target):
+    """Every tick's {channel: count} write moving start to target, one degree per tick at most.
+
+    Tick i puts each servo at start + (target - start) * i / maxstep, rounded
+    to the nearest whole degree in integer arithmetic, so the counts come
+    straight from the angle table. Only channels whose count changed are
+    written. The gait cycles through a handful of poses, so every move is
+    planned once.
+    """
+    maxstep = max(abs(t - a) for a, t in zip(start, target))
+    ticks = []
+    last = [duty_for_angle(a, ch) for ch, a in zip(LEG_CHANNELS, start)]
+    for i in range(1, maxstep + 1):
+        tick = {}
+        for idx, (ch, a, t) in enumerate(zip(LEG_CHANNELS, start, target)):
+            duty = duty_for_angle(a + (2 * (t - a) * i + maxstep) // (2 * maxstep), ch)
+            if duty != last[idx]:
+                tick[ch] = last[idx] = duty
+        ticks.append(tick)
+    return tuple(ticks)
+
 def smooth_move():
     """Smoothly move servos to target positions."""
-    global LALeg1F, LALeg1B, LALeg2F, LALeg2B
-    global LALeg3F, LALeg3B, LALeg4F, LALeg4B
-
-    # Calculate max steps for smooth movement
-    maxstep = max(
-        abs(LALeg1F - TOLeg1F),
-        abs(LALeg1B - TOLeg1B),
-        abs(LALeg2F - TOLeg2F),
-        abs(LALeg2B - TOLeg2B),
-        abs(LALeg3F - TOLeg3F),
-        abs(LALeg3B - TOLeg3B),
-        abs(LALeg4F - TOLeg4F),
-        abs(LALeg4B - TOLeg4B)
-    )
-
-    # Ensure maxstep is an integer
-    maxstep = int(maxstep)
-
-    if maxstep > 0:
-        stepLeg1F = (TOLeg1F - LALeg1F) / maxstep
-        stepLeg1B = (TOLeg1B - LALeg1B) / maxstep
-        stepLeg2F = (TOLeg2F - LALeg2F) / maxstep
-        stepLeg2B = (TOLeg2B - LALeg2B) / maxstep
-        stepLeg3F = (TOLeg3F - LALeg3F) / maxstep
-        stepLeg3B = (TOLeg3B - LALeg3B) / maxstep
-        stepLeg4F = (TOLeg4F - LALeg4F) / maxstep
-        stepLeg4B = (TOLeg4B - LALeg4B) / maxstep
-
-        for _ in range(maxstep):
-            LALeg1F += stepLeg1F
-            LALeg1B += stepLeg1B
-            LALeg2F += stepLeg2F
-            LALeg2B += stepLeg2B
-            LALeg3F += stepLeg3F
-            LALeg3B += stepLeg3B
-            LALeg4F += stepLeg4F
-            LALeg4B += stepLeg4B
-
-            kit.servo[LEG1F_CHANNEL].angle = LALeg1F
-            kit.servo[LEG1B_CHANNEL].angle = LALeg1B
-            kit.servo[LEG2F_CHANNEL].angle = LALeg2F
-            kit.servo[LEG2B_CHANNEL].angle = LALeg2B
-            kit.servo[LEG3F_CHANNEL].angle = LALeg3F
-            kit.servo[LEG3B_CHANNEL].angle = LALeg3B
-            kit.servo[LEG4F_CHANNEL].angle = LALeg4F
-            kit.servo[LEG4B_CHANNEL].angle = LALeg4B
-
-            time.sleep(smoothdelay / 1000.0)  # Convert ms to seconds
+    # Each tick is one burst write, sleeping to a fixed deadline
+    t0 = time.monotonic()
+    for i, tick in enumerate(_plan_move(tuple(LA), tuple(TO)), 1):
+        if tick:
+            write_channels(kit._pca, tick)
+        sleep_until(t0 + i * smoothdelay / 1000.0)  # Convert ms to seconds
+    LA[:] = TO
 
 def loop():
-    # Continuous walking forward
+    # Continuous walking forward, one step every STEP_PERIOD on fixed deadlines
+    next_step = time.monotonic()
     while True:
         walk_forward()
-        time.sleep(0.5)  # Delay between steps
+        next_step += STEP_PERIOD
+        # A step that overran restarts the clock instead of rushing the next one
+        next_step = max(next_step, time.monotonic())
+        sleep_until(next_step)
 
 if __name__ == "__main__":
     setup()